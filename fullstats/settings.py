@@ -45,10 +45,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'socialnet.metrics.MetricsMiddleware',
+    'socialnet.routers.PrimaryAfterWriteMiddleware',
+    'socialnet.middleware.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'socialnet.authentication.JWTAuthenticationMiddleware',
+    'socialnet.favourites.LegacyFavouritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -78,16 +83,47 @@ WSGI_APPLICATION = 'fullstats.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': 'fullstats',
-        'USER': os.environ.get('USER_DB'),
-        'PASSWORD': os.environ.get('PASSWORD_DB'),
-        'HOST': '127.0.0.1',
-        'PORT': 5432
+# Основная база принимает запись, реплики (DB_REPLICA_HOSTS через запятую) - чтение
+# Соединения переиспользуются между запросами (CONN_MAX_AGE) с проверкой перед использованием;
+# для пула соединений перед PostgreSQL ставится pgbouncer в режиме transaction
+# DB_ENGINE=sqlite - локальный режим: одна база SQLite без реплик; с DB_READ_FROM_REPLICAS=1
+# добавляется реплика 'replica' - второе соединение с тем же файлом (для проверки маршрутизации)
+
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        },
+    }
+    if os.environ.get('DB_READ_FROM_REPLICAS', '0') == '1':
+        DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': 'fullstats',
+            'USER': os.environ.get('USER_DB'),
+            'PASSWORD': os.environ.get('PASSWORD_DB'),
+            'HOST': '127.0.0.1',
+            'PORT': 5432,
+            'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE_DB', 60)),
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
-}
+    for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), start=1):
+        DATABASES[f'replica_{number}'] = dict(DATABASES['default'], HOST=host.strip(),
+                                              TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['socialnet.routers.ReplicaRouter']
+# Реплики, с которых читаем; DB_READ_FROM_REPLICAS=0 - всё из основной базы
+# (например, пока реплики догоняют основную базу после развёртывания)
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default'] \
+    if os.environ.get('DB_READ_FROM_REPLICAS', '1') == '1' else []
+# round_robin - по очереди, least_loaded - реплика с наименьшим кол-вом выполняющихся запросов
+REPLICA_STRATEGY = os.environ.get('DB_REPLICA_STRATEGY', 'round_robin')
+# Сколько секунд после записи юзер читает из основной базы (запас на отставание реплик)
+REPLICA_STICKY_SECONDS = 5
 
 
 # Password validation
@@ -130,7 +166,126 @@ STATIC_URL = '/static/'
 
 AUTH_USER_MODEL = 'socialnet.User'
 
+# Вход по паролю: пароль хэшируется один раз за попытку в пуле потоков (socialnet.passwords)
+
+AUTHENTICATION_BACKENDS = ['socialnet.authentication.PooledModelBackend']
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Буферизованный счётчик просмотров статей
+# Для нескольких процессов: 'socialnet.counters.CacheStore' поверх общего кэша (memcached, redis);
+# команда flush_views работает только с ним - буфер LocalMemoryStore процесс сервера сбрасывает сам при выходе
+# VIEW_COUNTER_LOOKBACK - сколько прошедших интервалов CacheStore ещё забирает при сбросе
+
+VIEW_COUNTER_STORE = 'socialnet.counters.LocalMemoryStore'
+VIEW_COUNTER_FLUSH_INTERVAL = 5
+VIEW_COUNTER_FLUSH_THRESHOLD = 500
+VIEW_COUNTER_LOOKBACK = 60
+
+# Конфигурация полнотекстового поиска PostgreSQL (regconfig)
+
+SEARCH_CONFIG = 'russian'
+
+# Кэш выдачи списка статей (id статей страницы и общее кол-во)
+# В продакшене LISTING_CACHE должен указывать на общий для процессов бэкенд (memcached, redis)
+
+LISTING_CACHE = 'default'
+LISTING_CACHE_TIMEOUT = 300
+
+# Полностраничный кэш страниц статей для анонимных посетителей
+
+PAGE_CACHE = 'default'
+PAGE_CACHE_TIMEOUT = 60
+PAGE_CACHE_URL_NAMES = ('index', 'detail')
+
+# Асинхронные view для чтения статей (включать при запуске под ASGI)
+
+ASYNC_READ_VIEWS = False
+
+# Кэш наборов id избранных статей залогиненных юзеров
+
+FAVOURITES_CACHE = 'default'
+FAVOURITES_CACHE_TIMEOUT = 3600
+
+# JWT (User.token): срок действия в секундах, cookie, размер кэша проверенных токенов
+# и сколько секунд запись кэша живёт без проверки юзера в БД
+
+JWT_LIFETIME = 3600
+JWT_COOKIE_NAME = 'jwt'
+JWT_CACHE_SIZE = 1024
+JWT_CACHE_TIMEOUT = 60
+
+# Метрики запросов (Server-Timing и гистограммы для Prometheus на 'metrics')
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_ALLOWED_IPS = ('127.0.0.1', )
+
+# Рейтинг «популярное сейчас»: период полураспада веса активности (в секундах),
+# веса просмотра и балла оценки, минимальный вес строки рейтинга, размер и кэш топа
+
+TRENDING_HALF_LIFE = 6 * 3600
+TRENDING_VIEW_WEIGHT = 1
+TRENDING_VOTE_WEIGHT = 10
+TRENDING_MIN_WEIGHT = 1
+TRENDING_TOP_SIZE = 100
+TRENDING_CACHE = 'default'
+TRENDING_CACHE_TIMEOUT = 600
+
+# Похожие статьи (по совместному добавлению в избранное): сколько показывать
+# и минимальное кол-во общих юзеров у пары статей
+
+SIMILAR_ARTICLES_COUNT = 5
+SIMILAR_ARTICLES_MIN_COMMON = 2
+
+# Пагинация: начиная с какого кол-ва строк списки без фильтров показывают
+# оценку планировщика PostgreSQL (~1.2M) вместо точного COUNT(*)
+
+PAGINATION_ESTIMATE_THRESHOLD = 100000
+
+# Тексты статей (ArticleBody): алгоритм сжатия новых текстов ('zlib', 'zstd' - с пакетом zstandard, 'plain')
+# и максимальная длина текста в форме
+
+ARTICLE_BODY_CODEC = 'zlib'
+ARTICLE_BODY_MAX_LENGTH = 100000
+
+# Пул хэширования паролей: кол-во потоков (None - по числу ядер) и сколько задач может ждать в очереди,
+# попытки сверх очереди отклоняются с 429
+
+PASSWORD_HASHING_WORKERS = None
+PASSWORD_HASHING_QUEUE = 64
+
+# Ограничение попыток входа и регистрации (token bucket в памяти процесса):
+# (кол-во попыток подряд, за сколько секунд они восстанавливаются) по IP и по аккаунту с одного IP,
+# кол-во хранимых ключей
+
+LOGIN_THROTTLE_IP = (20, 60)
+LOGIN_THROTTLE_ACCOUNT = (5, 60)
+LOGIN_THROTTLE_SIZE = 10000
+# Адреса и подсети обратных прокси: от них IP клиента берётся из X-Forwarded-For
+TRUSTED_PROXIES = [proxy.strip() for proxy in os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1').split(',')
+                   if proxy.strip()]
+
+# Лучшие авторы (счётчики AuthorStats): сколько показывать
+# и минимальное кол-во оценок для сортировки по средней оценке
+
+AUTHOR_TOP_SIZE = 20
+AUTHOR_TOP_MIN_VOTES = 10
+
+# Подсказки поиска (индекс префиксов в памяти процесса): минимальная длина ввода, кол-во подсказок,
+# через сколько секунд индекс перестраивается (изменения других процессов и массовых вставок)
+# и сколько статей читать из БД за раз при построении
+
+SUGGEST_MIN_LENGTH = 2
+SUGGEST_LIMIT = 10
+SUGGEST_REBUILD_INTERVAL = 600
+SUGGEST_BATCH_SIZE = 2000
+
+# Ленты RSS/Atom (готовые документы в кэше): кэш, кол-во статей в ленте
+# и адрес сайта для ссылок (ленты собираются и вне запроса)
+
+FEED_CACHE = 'default'
+FEED_SIZE = 20
+FEED_SITE_URL = 'http://localhost:8000'
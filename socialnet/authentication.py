@@ -0,0 +1,270 @@
+"""
+Аутентификация по JWT (User.token) без обращения к таблице сессий
+
+Токен берётся из заголовка «Authorization: Bearer <token>» или из cookie JWT_COOKIE_NAME
+Проверенные токены кэшируются в памяти процесса (LRU ограниченного размера) вместе с юзером,
+поэтому повторные запросы с тем же токеном не обращаются к БД
+Каждый запрос получает свою копию юзера; сохранение или удаление юзера сбрасывает его записи (сигнал),
+а изменения из других процессов подхватываются не позже чем через JWT_CACHE_TIMEOUT
+Запись живёт не дольше срока действия токена (claim exp)
+
+Вход по паролю - PooledModelBackend: юзер ищется в текущем потоке, а пароль хэшируется
+один раз за попытку в пуле socialnet.passwords
+"""
+import copy
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import load_backend
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_login_failed
+from django.core.exceptions import PermissionDenied
+
+from . import passwords
+from .models import User
+
+BEARER_PREFIX = 'Bearer '
+
+
+def get_cookie_name() -> str:
+    return getattr(settings, 'JWT_COOKIE_NAME', 'jwt')
+
+
+class TokenCache:
+    """
+    LRU проверенных токенов: токен -> (юзер, момент истечения)
+    Юзер хранится копией и выдаётся копией: изменения в одном запросе не видны другим
+    При переполнении сначала удаляются истёкшие записи, затем давно не использованные
+    Доступ из разных потоков защищён блокировкой
+    """
+
+    def __init__(self, max_size=None, timeout=None):
+        self.max_size = max_size or getattr(settings, 'JWT_CACHE_SIZE', 1024)
+        self.timeout = timeout or getattr(settings, 'JWT_CACHE_TIMEOUT', 60)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """
+        :param token: str
+        :return: User или None, если токена нет в кэше или он истёк
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+        return copy.copy(user)
+
+    def set(self, token, user, expires):
+        """
+        :param token: str
+        :param user: User
+        :param expires: int - момент истечения токена (unix time), запись живёт не дольше timeout
+        """
+        entry = (copy.copy(user), min(expires, time.time() + self.timeout))
+        with self._lock:
+            self._entries[token] = entry
+            self._entries.move_to_end(token)
+            if len(self._entries) > self.max_size:
+                now = time.time()
+                for expired in [key for key, (_, exp) in self._entries.items() if exp <= now]:
+                    del self._entries[expired]
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+    def discard(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def forget_user(self, user_id):
+        """
+        Сбрасываем все токены юзера (юзер изменён или удалён)
+        :param user_id: UUID - id юзера
+        """
+        with self._lock:
+            for token in [key for key, (user, _) in self._entries.items() if user.pk == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache()
+
+
+def get_request_token(request):
+    """
+    Токен запроса из заголовка Authorization или из cookie
+    :param request:
+    :return: tuple - (токен или None, передан ли токен заголовком)
+    """
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if header.startswith(BEARER_PREFIX):
+        return header[len(BEARER_PREFIX):].strip(), True
+    return request.COOKIES.get(get_cookie_name()), False
+
+
+def authenticate_token(token):
+    """
+    Проверяем подпись и срок действия токена и находим его юзера
+    :param token: str
+    :return: User или None
+    """
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    try:
+        claims = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+    if 'id' not in claims or 'exp' not in claims:
+        return None
+    user = User.objects.filter(id=claims['id'], is_active=True).first()
+    if user is not None:
+        token_cache.set(token, user, claims['exp'])
+    return user
+
+
+class JWTAuthenticationMiddleware:
+    """
+    Подменяет request.user юзером из JWT
+    Ставится после AuthenticationMiddleware: её ленивый request.user не вычисляется,
+    поэтому сессия не загружается
+    Запросы с токеном в заголовке не используют cookies и не проверяются на CSRF
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token, from_header = get_request_token(request)
+        if token:
+            self.login(request, authenticate_token(token), token, from_header)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        token, from_header = get_request_token(request)
+        if token:
+            user = token_cache.get(token) or await sync_to_async(authenticate_token)(token)
+            self.login(request, user, token, from_header)
+        return await self.get_response(request)
+
+    @staticmethod
+    def login(request, user, token, from_header):
+        if user is None:
+            return
+        request.user = user
+        request.auth_token = token
+        if from_header:
+            request._dont_enforce_csrf_checks = True
+
+
+def set_token_cookie(response, token):
+    """
+    Кладём токен юзера в cookie
+    :param response: HttpResponse
+    :param token: str - User.token
+    """
+    response.set_cookie(key=get_cookie_name(), value=token, max_age=getattr(settings, 'JWT_LIFETIME', 3600),
+                        secure=True, httponly=True, samesite='strict')
+
+
+async def aauthenticate(request=None, **credentials):
+    """
+    Асинхронный аналог django.contrib.auth.authenticate (в Django 4.2 его нет):
+    перебираем AUTHENTICATION_BACKENDS, у кого есть aauthenticate - ждём его (хэш в пуле, поток не занят),
+    остальных вызываем в потоке; при неудаче отправляем user_login_failed
+    :param request:
+    :param credentials: username, password и т.п.
+    :return: User или None
+    """
+    for backend_path in settings.AUTHENTICATION_BACKENDS:
+        backend = load_backend(backend_path)
+        method = getattr(backend, 'aauthenticate', None)
+        try:
+            inspect.signature(method or backend.authenticate).bind(request, **credentials)
+        except TypeError:
+            # Бэкенд не принимает такие учётные данные
+            continue
+        try:
+            if method is not None:
+                user = await method(request, **credentials)
+            else:
+                user = await sync_to_async(backend.authenticate)(request, **credentials)
+        except PermissionDenied:
+            # Бэкенд запретил вход - остальные не проверяем
+            break
+        if user is None:
+            continue
+        user.backend = backend_path
+        return user
+    hidden = {key: '********************' if 'password' in key else value for key, value in credentials.items()}
+    await sync_to_async(user_login_failed.send)(sender=__name__, credentials=hidden, request=request)
+    return None
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend, который хэширует пароль в пуле потоков (passwords.password_pool)
+    Запрос юзера остаётся в потоке view (соединения с БД привязаны к потоку), в пул уходит только хэш
+    Для несуществующего юзера хэш всё равно считается - время ответа не выдаёт, есть ли аккаунт
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        username = username or kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = User._default_manager.filter(**{User.USERNAME_FIELD: username}).first()
+        if user is None:
+            passwords.make_password(password)
+            return None
+        return self.finish(user, password, *passwords.check_password(password, user.password))
+
+    async def aauthenticate(self, request, username=None, password=None):
+        """
+        Асинхронный вариант authenticate() для async view: хэш ждём, не блокируя event loop
+        """
+        if username is None or password is None:
+            return None
+        user = await User._default_manager.filter(**{User.USERNAME_FIELD: username}).afirst()
+        if user is None:
+            await passwords.amake_password(password)
+            return None
+        valid, outdated = await passwords.acheck_password(password, user.password)
+        if valid and outdated:
+            # Редкий случай (сменились настройки хэширования): перехэшируем синхронно
+            return await sync_to_async(self.finish)(user, password, valid, outdated)
+        return self.finish(user, password, valid, False)
+
+    def finish(self, user, password, valid, outdated):
+        """
+        :return: User, если пароль верный и юзеру разрешён вход, иначе None
+        """
+        if not valid or not self.user_can_authenticate(user):
+            return None
+        if outdated:
+            user.password = passwords.make_password(password)
+            user.save(update_fields=['password'])
+        user.backend = f'{self.__module__}.{type(self).__name__}'
+        return user
@@ -0,0 +1,139 @@
+"""
+Счётчики авторов (AuthorStats)
+
+Вместо агрегации по Article, Rating и Favourites на каждый запрос счётчики автора
+меняются атомарными дельтами (F-выражения) вместе с изменением статьи:
+создание статьи - сигнал, оценка - ratings.apply_rating_delta (тем же выражением, что и статья),
+просмотры - сброс счётчика просмотров, избранное - socialnet.favourites
+При удалении статьи (редкая операция) счётчики автора пересчитываются целиком:
+значения удаляемого экземпляра могут быть устаревшими
+Строка автора создаётся с его первой статьёй, массовые вставки (импорт, seed_fake_data)
+и любые расхождения исправляет reconcile() (команда reconcile_author_stats)
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Subquery, Sum
+
+from .models import Article, AuthorStats, Favourites, Rating, User
+
+# Сортировки списка лучших авторов: параметр order -> поле AuthorStats
+TOP_ORDERS = {
+    'rating': 'rating',
+    'reviews': 'reviews',
+    'favourites': 'favourites_count',
+    'articles': 'articles_count',
+}
+
+
+def author_of(article_id) -> Subquery:
+    """
+    Автор статьи подзапросом: дельта по одной статье применяется одним UPDATE
+    """
+    return Subquery(Article.objects.filter(id=article_id).values('author_id')[:1])
+
+
+def add_article(author_id):
+    """
+    Новая статья автора (строка счётчиков создаётся при первой статье)
+    :param author_id: id автора
+    """
+    AuthorStats.objects.bulk_create([AuthorStats(author_id=author_id)], ignore_conflicts=True)
+    AuthorStats.objects.filter(author_id=author_id).update(articles_count=F('articles_count') + 1)
+
+
+def add_favourites(article_id, delta):
+    """
+    :param article_id: int - id статьи, добавленной в избранное (или убранной из него)
+    :param delta: int - +1 или -1
+    """
+    AuthorStats.objects.filter(author_id=author_of(article_id)) \
+        .update(favourites_count=F('favourites_count') + delta)
+
+
+def add_by_articles(field, amounts, batch_size=1000):
+    """
+    Прирост счётчика по нескольким статьям сразу (сброс просмотров, перенос избранного)
+    Авторы с одинаковым приростом обновляются одним UPDATE
+    :param field: str - поле AuthorStats ('reviews', 'favourites_count')
+    :param amounts: dict - {id статьи: прирост}
+    :param batch_size: int - кол-во статей/авторов в одном запросе
+    """
+    article_ids = list(amounts)
+    by_author = defaultdict(int)
+    for start in range(0, len(article_ids), batch_size):
+        for article_id, author_id in (Article.objects.filter(id__in=article_ids[start:start + batch_size])
+                                      .values_list('id', 'author_id')):
+            by_author[author_id] += amounts[article_id]
+    by_amount = defaultdict(list)
+    for author_id, amount in by_author.items():
+        by_amount[amount].append(author_id)
+    for amount, author_ids in by_amount.items():
+        for start in range(0, len(author_ids), batch_size):
+            AuthorStats.objects.filter(author_id__in=author_ids[start:start + batch_size]) \
+                .update(**{field: F(field) + amount})
+
+
+def top_authors(order, limit) -> list:
+    """
+    Лучшие авторы одним запросом по индексу сортировки
+    По средней оценке - только авторы с AUTHOR_TOP_MIN_VOTES оценок и больше
+    :param order: str - ключ TOP_ORDERS
+    :param limit: int - кол-во авторов
+    :return: list - AuthorStats с подгруженным автором
+    """
+    field = TOP_ORDERS[order]
+    queryset = AuthorStats.objects.select_related('author').filter(articles_count__gt=0)
+    if field == 'rating':
+        queryset = queryset.filter(rating_count__gte=getattr(settings, 'AUTHOR_TOP_MIN_VOTES', 10))
+    return list(queryset.order_by(f'-{field}', 'author')[:limit])
+
+
+def reconcile(batch_size=1000) -> int:
+    """
+    Пересчитываем счётчики авторов по исходным таблицам пачками авторов (по id)
+    Каждая пачка - отдельная транзакция; авторы без статей лишаются строки
+    :param batch_size: int - кол-во авторов за раз
+    :return: int - кол-во авторов со статьями
+    """
+    users = User.objects.order_by('id').values_list('id', flat=True)
+    last_id, total = None, 0
+    while True:
+        batch = list((users.filter(id__gt=last_id) if last_id is not None else users)[:batch_size])
+        if not batch:
+            break
+        total += reconcile_authors(batch)
+        last_id = batch[-1]
+    return total
+
+
+def reconcile_authors(author_ids) -> int:
+    """
+    Пересчитываем счётчики заданных авторов по Article, Rating и Favourites
+    Дельты, применённые между подсчётом и записью, теряются до следующей сверки
+    :param author_ids: list - id авторов
+    :return: int - кол-во авторов со статьями
+    """
+    author_ids = list(author_ids)
+    articles = (Article.objects.filter(author_id__in=author_ids).order_by().values_list('author_id')
+                .annotate(Count('id'), Sum('reviews')))
+    votes = {author_id: (total, count) for author_id, total, count
+             in Rating.objects.filter(article__author_id__in=author_ids).order_by()
+             .values_list('article__author_id').annotate(Sum('mark'), Count('id'))}
+    favourites = dict(Favourites.objects.filter(article__author_id__in=author_ids).order_by()
+                      .values_list('article__author_id').annotate(Count('id')))
+    rows = []
+    for author_id, articles_count, reviews in articles:
+        rating_sum, rating_count = votes.get(author_id, (0, 0))
+        rows.append(AuthorStats(author_id=author_id, articles_count=articles_count, reviews=reviews or 0,
+                                rating_sum=rating_sum, rating_count=rating_count,
+                                rating=rating_sum / rating_count if rating_count else 0.0,
+                                favourites_count=favourites.get(author_id, 0)))
+    with transaction.atomic():
+        AuthorStats.objects.filter(author_id__in=author_ids) \
+            .exclude(author_id__in=[row.author_id for row in rows]).delete()
+        AuthorStats.objects.bulk_create(rows, update_conflicts=True, unique_fields=['author'],
+                                        update_fields=['articles_count', 'reviews', 'rating', 'rating_sum',
+                                                       'rating_count', 'favourites_count'])
+    return len(rows)
@@ -0,0 +1,35 @@
+"""
+Запись текстов статей в ArticleBody
+
+Текст задаётся через Article.description и сохраняется при Article.save(),
+после массовой вставки (bulk_create) - явным вызовом save_bodies()
+Вместе с текстом обновляется поисковый индекс: сжатый текст СУБД проиндексировать не может
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .compression import compress
+from .models import Article, ArticleBody
+from .search import get_search_backend
+
+
+def save_bodies(articles, batch_size=1000, using=DEFAULT_DB_ALIAS):
+    """
+    Сохраняем тексты статей (Article.description) в ArticleBody и в поисковый индекс
+    Статьи без id (после bulk_create на СУБД, которая не возвращает id) находим по slug
+    :param articles: list - сохранённые статьи
+    :param batch_size: int - кол-во строк в одном INSERT
+    :param using: str - алиас подключения
+    """
+    missing = {article.slug: article for article in articles if article.id is None}
+    if missing:
+        for article_id, slug in Article.objects.using(using).filter(slug__in=missing).values_list('id', 'slug'):
+            missing[slug].id = article_id
+    rows = []
+    for article in articles:
+        codec, data = compress(article.description)
+        rows.append(ArticleBody(article_id=article.id, codec=codec, data=data))
+        article._description_changed = False
+    ArticleBody.objects.using(using).bulk_create(rows, batch_size=batch_size, update_conflicts=True,
+                                                 unique_fields=['article'], update_fields=['codec', 'data'])
+    get_search_backend(using).index_bodies(connections[using],
+                                           [(article.id, article.description) for article in articles])
@@ -0,0 +1,47 @@
+"""
+Сжатие текстов статей (ArticleBody)
+
+Рядом с данными хранится маркер кодека, поэтому смена ARTICLE_BODY_CODEC
+не требует пересжатия уже сохранённых текстов
+zstd доступен, если установлен пакет zstandard
+Короткие тексты, которые не становятся меньше при сжатии, хранятся как есть ('plain')
+"""
+import zlib
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Кодек -> (сжатие bytes -> bytes, распаковка bytes -> bytes)
+CODECS = {
+    'plain': (bytes, bytes),
+    'zlib': (lambda raw: zlib.compress(raw, 6), zlib.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (lambda raw: zstandard.ZstdCompressor(level=6).compress(raw),
+                      lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+
+def compress(text) -> tuple:
+    """
+    :param text: str
+    :return: tuple - (кодек, сжатые данные)
+    """
+    raw = text.encode()
+    codec = getattr(settings, 'ARTICLE_BODY_CODEC', 'zlib')
+    data = CODECS[codec][0](raw)
+    if len(data) >= len(raw):
+        return 'plain', raw
+    return codec, data
+
+
+def decompress(codec, data) -> str:
+    """
+    :param codec: str - кодек из compress()
+    :param data: bytes (или memoryview из BinaryField)
+    :return: str
+    """
+    return CODECS[codec][1](bytes(data)).decode()
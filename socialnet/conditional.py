@@ -0,0 +1,57 @@
+"""
+Условные GET-запросы для страниц статей
+
+Ответы получают ETag (и Last-Modified для страницы статьи), а запрос с If-None-Match/If-Modified-Since
+проверяется по лёгкому запросу к БД (или по кэшу) до выборки статей и рендеринга шаблона
+Cache-Control: no-cache - браузер и прокси хранят страницу, но перепроверяют её при каждом показе
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+def has_conditions(request) -> bool:
+    """
+    Есть ли в запросе условия, ради которых стоит проверять версию до рендеринга
+    """
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def make_etag(*parts) -> str:
+    """
+    :param parts: значения, от которых зависит содержимое страницы
+    :return: str - ETag в кавычках
+    """
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def timestamp(moment):
+    """
+    :param moment: datetime или None
+    :return: int - секунды (точность заголовка Last-Modified) или None
+    """
+    return int(moment.timestamp()) if moment is not None else None
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    :param request:
+    :param etag: str - текущий ETag страницы
+    :param last_modified: int - время изменения страницы в секундах
+    :return: HttpResponseNotModified (или 412) либо None, если страницу нужно отдать
+    """
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    """
+    Проставляем ETag/Last-Modified отданной странице
+    """
+    if response.status_code != 200:
+        return response
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,245 @@
+"""
+Буферизованный (write-behind) счётчик просмотров статей
+
+Вместо UPDATE на каждый просмотр инкременты копятся в хранилище
+и периодически сбрасываются в Article.reviews пачками:
+статьи с одинаковым приростом обновляются одним UPDATE
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class LocalMemoryStore:
+    """
+    Хранилище инкрементов в памяти текущего процесса
+    Подходит для одного процесса и для тестов,
+    накопленное сбрасывается при выходе из процесса
+    """
+    shared = False
+
+    def __init__(self):
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def incr(self, article_id, amount=1):
+        with self._lock:
+            self._counts[article_id] += amount
+
+    def drain(self, final=False) -> dict:
+        """
+        Забираем все накопленные инкременты, очищая хранилище
+        :param final: bool - финальный сброс (для этого хранилища ничего не меняет)
+        :return: dict - {id статьи: прирост просмотров}
+        """
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+        return dict(counts)
+
+
+class CacheStore:
+    """
+    Общее для всех процессов хранилище поверх кэша Django (memcached, redis и т.п.)
+
+    API кэша не умеет перечислять ключи, поэтому инкременты пишутся в «эпохи»:
+    каждая новая статья в эпохе получает слот с порядковым номером (атомарный incr).
+    Эпоха - номер интервала сброса по часам (time // interval), поэтому она одинакова во всех процессах
+    и не зависит от того, сколько процессов сбрасывают просмотры.
+    Эпоха забирается не раньше, чем через интервал после её закрытия: запись, начатая в ней,
+    успевает завершиться. Каждую эпоху забирает один процесс - тот, кто первым занял её ключом add()
+    """
+    shared = True
+
+    def __init__(self, alias=None, key_prefix='views', interval=None, lookback=None):
+        """
+        :param interval: float - длина эпохи в секундах (по умолчанию VIEW_COUNTER_FLUSH_INTERVAL)
+        :param lookback: int - сколько закрытых эпох просматривает сброс (просмотры эпох старше теряются,
+                         если за это время просмотры не сбросил ни один процесс)
+        """
+        self.cache = caches[alias or getattr(settings, 'VIEW_COUNTER_CACHE', 'default')]
+        self.key_prefix = key_prefix
+        self.interval = interval or getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 5)
+        self.lookback = lookback or getattr(settings, 'VIEW_COUNTER_LOOKBACK', 60)
+
+    def _key(self, epoch, *parts) -> str:
+        return ':'.join(str(part) for part in (self.key_prefix, epoch, *parts))
+
+    def _epoch(self) -> int:
+        return int(time.time() // self.interval)
+
+    def incr(self, article_id, amount=1, attempts=3):
+        """
+        :param attempts: int - сколько раз повторять, если счётчик пропал между add и incr
+        """
+        for _ in range(attempts):
+            epoch = self._epoch()
+            counter_key = self._key(epoch, 'count', article_id)
+            if self.cache.add(counter_key, amount, timeout=None):
+                # Первый просмотр статьи в эпохе - регистрируем её в слоте
+                self.cache.add(self._key(epoch, 'seq'), 0, timeout=None)
+                slot = self.cache.incr(self._key(epoch, 'seq'))
+                self.cache.set(self._key(epoch, 'slot', slot), article_id, timeout=None)
+                return
+            try:
+                self.cache.incr(counter_key, amount)
+                return
+            except ValueError:
+                # Ключ вытеснен из кэша или забран сбросом (эпоха могла смениться) - регистрируем заново
+                continue
+        logger.warning('Не удалось учесть просмотр статьи %s', article_id)
+
+    def drain(self, final=False) -> dict:
+        """
+        Забираем эпохи, закрытые не меньше интервала назад и ещё не занятые другим процессом
+        :param final: bool - забрать и текущую с предыдущей эпохой (при остановке, когда записей больше нет);
+                      они не занимаются, поэтому поздние записи в них заберёт обычный сброс
+        :return: dict - {id статьи: прирост просмотров}
+        """
+        current = self._epoch()
+        closed = range(current - 1 - self.lookback, current - 1)
+        # Одним запросом узнаём, в каких эпохах есть просмотры и какие уже заняты
+        found = self.cache.get_many([self._key(epoch, part) for epoch in closed for part in ('seq', 'drained')])
+        epochs = [epoch for epoch in closed
+                  if self._key(epoch, 'seq') in found and self._key(epoch, 'drained') not in found
+                  and self.cache.add(self._key(epoch, 'drained'), 1, timeout=self.interval * (self.lookback + 2))]
+        if final:
+            epochs += [current - 1, current]
+        counts = defaultdict(int)
+        for epoch in epochs:
+            for article_id, amount in self._drain_epoch(epoch).items():
+                counts[article_id] += amount
+        return dict(counts)
+
+    def _drain_epoch(self, epoch) -> dict:
+        seq = self.cache.get(self._key(epoch, 'seq'), 0)
+        slot_keys = [self._key(epoch, 'slot', slot) for slot in range(1, seq + 1)]
+        article_ids = list(self.cache.get_many(slot_keys).values())
+        counter_keys = {self._key(epoch, 'count', article_id): article_id for article_id in article_ids}
+        counts = {counter_keys[key]: amount for key, amount in self.cache.get_many(counter_keys).items() if amount}
+        self.cache.delete_many([*slot_keys, *counter_keys, self._key(epoch, 'seq')])
+        return counts
+
+
+class ViewCounter:
+    """
+    Накопитель просмотров с фоновым сбросом в БД по таймеру или по порогу
+    """
+
+    def __init__(self, store=None, flush_interval=None, flush_threshold=None):
+        self._store = store
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.flush_batch_size = None
+        self._pending = 0
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._worker = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    store_class = import_string(getattr(settings, 'VIEW_COUNTER_STORE',
+                                                        'socialnet.counters.LocalMemoryStore'))
+                    self._store = store_class()
+        return self._store
+
+    def _setting(self, name, default):
+        value = getattr(self, name)
+        return value if value is not None else getattr(settings, f'VIEW_COUNTER_{name.upper()}', default)
+
+    def incr(self, article_id, amount=1):
+        """
+        Учитываем просмотр статьи без обращения к БД
+        :param article_id: int - id статьи
+        :param amount: int - кол-во просмотров
+        """
+        self.store.incr(article_id, amount)
+        with self._lock:
+            self._pending += amount
+            if self._pending >= self._setting('flush_threshold', 500):
+                self._wakeup.set()
+        self._ensure_worker()
+
+    async def aincr(self, article_id, amount=1):
+        """
+        Асинхронный аналог incr(): в общее хранилище пишем из потока, чтобы не блокировать event loop
+        """
+        if self.store.shared:
+            await sync_to_async(self.incr)(article_id, amount)
+        else:
+            self.incr(article_id, amount)
+
+    def flush(self, final=False) -> int:
+        """
+        Сбрасываем накопленные просмотры в Article.reviews, счётчики авторов,
+        в активность рейтинга «популярное сейчас» и в ранжирование подсказок
+        Статьи с одинаковым приростом обновляются одним UPDATE
+        :param final: bool - финальный сброс при остановке
+        :return: int - кол-во обновлённых статей
+        """
+        from .author_stats import add_by_articles
+        from .models import Article
+        from .suggest import suggest_index
+        from .trending import record_views
+
+        with self._lock:
+            self._pending = 0
+        counts = self.store.drain(final=final)
+        if not counts:
+            return 0
+        by_amount = defaultdict(list)
+        for article_id, amount in counts.items():
+            by_amount[amount].append(article_id)
+        batch_size = self._setting('flush_batch_size', 1000)
+        try:
+            with transaction.atomic():
+                for amount, article_ids in by_amount.items():
+                    for start in range(0, len(article_ids), batch_size):
+                        Article.objects.filter(id__in=article_ids[start:start + batch_size]) \
+                            .update(reviews=F('reviews') + amount)
+                add_by_articles('reviews', counts, batch_size)
+                record_views(counts, batch_size)
+        except Exception:
+            # Возвращаем просмотры в хранилище, чтобы не потерять их до следующего сброса
+            for article_id, amount in counts.items():
+                self.store.incr(article_id, amount)
+            raise
+        suggest_index.add_reviews(counts)
+        return len(counts)
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='view-counter-flush', daemon=True)
+                self._worker.start()
+                if not self.store.shared:
+                    atexit.register(self.flush, final=True)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._setting('flush_interval', 5))
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Не удалось сбросить просмотры статей в БД')
+            finally:
+                close_old_connections()
+
+
+view_counter = ViewCounter()
@@ -0,0 +1,104 @@
+"""
+Потоковая выгрузка статей в NDJSON/CSV
+
+Строки читаются из БД итератором пачками (на PostgreSQL - серверным курсором)
+и сразу сериализуются, поэтому расход памяти не зависит от размера таблицы
+Под ASGI синхронный итератор Django собрал бы в список целиком, поэтому там выгрузка отдаётся
+асинхронным итератором (aiterate)
+"""
+import csv
+import itertools
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .compression import decompress
+from .models import Article
+
+# Выгружаемые поля: имя в выгрузке -> поле запроса (None - текст статьи, см. BODY_FIELDS)
+EXPORT_FIELDS = {
+    'id': 'id',
+    'slug': 'slug',
+    'header': 'header',
+    'summary': 'summary',
+    'description': None,
+    'author_id': 'author_id',
+    'author': 'author__username',
+    'reviews': 'reviews',
+    'rating': 'rating',
+    'rating_sum': 'rating_sum',
+    'rating_count': 'rating_count',
+    'date': 'date',
+}
+# Текст статьи: сжатый ArticleBody, а до переноса - прежний столбец
+BODY_FIELDS = ('body__codec', 'body__data', 'legacy_description')
+
+
+def export_rows(since=None, chunk_size=2000):
+    """
+    Статьи в порядке публикации
+    :param since: datetime - выгружать только статьи, опубликованные позже
+    :param chunk_size: int - кол-во строк, получаемых из БД за раз
+    :return: generator - кортежи значений в порядке EXPORT_FIELDS
+    """
+    fields = list(EXPORT_FIELDS.values())
+    position = fields.index(None)
+    del fields[position]
+    queryset = Article.objects.order_by('date', 'id').values_list(*fields, *BODY_FIELDS)
+    if since is not None:
+        queryset = queryset.filter(date__gt=since)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        codec, data, legacy = row[-len(BODY_FIELDS):]
+        text = decompress(codec, data) if codec is not None else legacy
+        yield row[:position] + (text,) + row[position:-len(BODY_FIELDS)]
+
+
+def ndjson_lines(rows):
+    columns = list(EXPORT_FIELDS)
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    """
+    Псевдофайл для csv.writer: возвращает записанную строку вместо буферизации
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(value.isoformat() if hasattr(value, 'isoformat') else value for value in row)
+
+
+# Формат -> (сериализатор, Content-Type)
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson; charset=utf-8'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+}
+
+
+async def aiterate(lines, batch_size=500):
+    """
+    Асинхронный итератор поверх потоковой выгрузки для ASGI
+    Строки забираются пачками в одном и том же потоке (thread_sensitive), где живёт курсор БД
+    :param lines: iterator - строки выгрузки (ndjson_lines, csv_lines)
+    :param batch_size: int - кол-во строк за одно переключение в поток
+    :return: async generator - куски выгрузки
+    """
+    lines = iter(lines)
+    next_batch = sync_to_async(lambda: ''.join(itertools.islice(lines, batch_size)), thread_sensitive=True)
+    try:
+        while True:
+            chunk = await next_batch()
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if hasattr(lines, 'close'):
+            await sync_to_async(lines.close, thread_sensitive=True)()
@@ -0,0 +1,256 @@
+"""
+Избранное юзеров на стороне сервера
+
+Анонимы хранят id понравившихся статей в сессии, залогиненные юзеры - в Favourites,
+а набор их id дополнительно кэшируется компактным массивом чисел
+В пределах запроса набор читается один раз и проверка «в избранном» - поиск в множестве
+При входе избранное анонима переносится к юзеру, избранное из старой cookie 'likes' - в сессию или к юзеру
+Article.favourites_count - денормализованное кол-во записей Favourites статьи
+(AuthorStats.favourites_count - то же по всем статьям автора), расхождения исправляет команда reconcile_favourites
+Изменения избранного юзера идут под блокировкой его строки: счётчики увеличиваются только на реально добавленное
+Изменения избранного юзеров помечают статьи для пересчёта похожих статей
+"""
+from array import array
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .author_stats import add_by_articles, add_favourites
+from .models import Article, Favourites, User
+from .similar import mark_stale
+
+SESSION_KEY = 'favourites'
+# Cookie, в которой избранное хранилось раньше: '1,2,3,'
+LEGACY_COOKIE = 'likes'
+
+
+def get_cache():
+    return caches[getattr(settings, 'FAVOURITES_CACHE', 'default')]
+
+
+class FavouriteStore:
+    """
+    Избранное юзера текущего запроса
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user if request.user.is_authenticated else None
+        self._ids = None
+
+    @property
+    def cache_key(self) -> str:
+        return f'favourites:{self.user.pk}'
+
+    @property
+    def ids(self) -> frozenset:
+        """
+        id статей в избранном (читаются один раз за запрос)
+        :return: frozenset
+        """
+        if self._ids is None:
+            if self.user is None:
+                self._ids = frozenset(self.request.session.get(SESSION_KEY, ()))
+            else:
+                self._ids = frozenset(self._load_user_ids())
+        return self._ids
+
+    def _load_user_ids(self):
+        cache = get_cache()
+        packed = cache.get(self.cache_key)
+        if packed is not None:
+            ids = array('q')
+            ids.frombytes(packed)
+            return ids
+        ids = array('q', sorted(Favourites.objects.filter(who=self.user).values_list('article_id', flat=True)))
+        cache.set(self.cache_key, ids.tobytes(), getattr(settings, 'FAVOURITES_CACHE_TIMEOUT', 3600))
+        return ids
+
+    def __contains__(self, article_id) -> bool:
+        return article_id in self.ids
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, article_id) -> bool:
+        """
+        Добавляем статью в избранное
+        :param article_id: int - id существующей статьи
+        :return: bool - была ли статья добавлена (не было ли её там раньше)
+        """
+        if self.user is None:
+            if article_id in self.ids:
+                return False
+            self._save_session(self.ids | {article_id})
+            return True
+        with transaction.atomic():
+            lock_user(self.user)
+            _, created = Favourites.objects.get_or_create(who=self.user, article_id=article_id)
+            if created:
+                Article.objects.filter(id=article_id).update(favourites_count=F('favourites_count') + 1)
+                add_favourites(article_id, 1)
+                mark_stale([article_id])
+        self._invalidate()
+        return created
+
+    def remove(self, article_id) -> bool:
+        """
+        Убираем статью из избранного
+        :param article_id: int - id статьи
+        :return: bool - была ли статья в избранном
+        """
+        if self.user is None:
+            if article_id not in self.ids:
+                return False
+            self._save_session(self.ids - {article_id})
+            return True
+        with transaction.atomic():
+            lock_user(self.user)
+            deleted, _ = Favourites.objects.filter(who=self.user, article_id=article_id).delete()
+            if deleted:
+                Article.objects.filter(id=article_id).update(favourites_count=F('favourites_count') - 1)
+                add_favourites(article_id, -1)
+                # Пары с остальным избранным юзера больше не находятся через Favourites - помечаем и их
+                mark_stale(self.ids | {article_id})
+        self._invalidate()
+        return bool(deleted)
+
+    def merge(self, article_ids) -> int:
+        """
+        Добавляем в избранное сразу несколько статей (перенос из старой cookie)
+        :param article_ids: iterable - id статей
+        :return: int - кол-во добавленных статей
+        """
+        if self.user is not None:
+            added = merge_favourites(self.user, article_ids)
+            self._ids = None
+            return added
+        new_ids = set(Article.objects.filter(id__in=set(article_ids) - self.ids).values_list('id', flat=True))
+        if new_ids:
+            self._save_session(self.ids | new_ids)
+        return len(new_ids)
+
+    def _save_session(self, ids):
+        self._ids = frozenset(ids)
+        self.request.session[SESSION_KEY] = sorted(self._ids)
+
+    def _invalidate(self):
+        self._ids = None
+        get_cache().delete(self.cache_key)
+
+
+def get_favourites(request) -> FavouriteStore:
+    """
+    Избранное текущего юзера, одно на запрос
+    :param request:
+    :return: FavouriteStore
+    """
+    if not hasattr(request, '_favourites'):
+        request._favourites = FavouriteStore(request)
+    return request._favourites
+
+
+def merge_favourites(user, article_ids) -> int:
+    """
+    Переносим избранное в Favourites юзера
+    Пропускаем удалённые статьи и уже отмеченные юзером; строка юзера заблокирована,
+    поэтому параллельный вход или добавление не вставят те же статьи и счётчики увеличиваются
+    ровно на вставленные записи (ignore_conflicts - только от записей в обход FavouriteStore)
+    :param user: User
+    :param article_ids: iterable - id статей
+    :return: int - кол-во добавленных статей
+    """
+    article_ids = set(article_ids)
+    if not article_ids:
+        return 0
+    with transaction.atomic():
+        lock_user(user)
+        new_ids = list(Article.objects.filter(id__in=article_ids)
+                       .exclude(favourites__who=user).values_list('id', flat=True))
+        Favourites.objects.bulk_create((Favourites(who=user, article_id=article_id) for article_id in new_ids),
+                                       ignore_conflicts=True)
+        Article.objects.filter(id__in=new_ids).update(favourites_count=F('favourites_count') + 1)
+        add_by_articles('favourites_count', dict.fromkeys(new_ids, 1))
+        mark_stale(new_ids)
+    get_cache().delete(f'favourites:{user.pk}')
+    return len(new_ids)
+
+
+def lock_user(user):
+    """
+    Блокируем строку юзера до конца транзакции: изменения избранного одного юзера идут по очереди
+    """
+    list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+
+
+def reconcile(batch_size=5000) -> int:
+    """
+    Пересчитываем Article.favourites_count по Favourites пачками по диапазонам id
+    :param batch_size: int - кол-во статей в одном UPDATE
+    :return: int - кол-во пересчитанных статей
+    """
+    total = Subquery(Favourites.objects.filter(article=OuterRef('pk')).order_by().values('article')
+                     .annotate(total=Count('id')).values('total'))
+    ids = Article.objects.order_by('id').values_list('id', flat=True)
+    last_id, updated = 0, 0
+    while True:
+        batch = list(ids.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        updated += Article.objects.filter(id__gte=batch[0], id__lte=batch[-1]) \
+            .update(favourites_count=Coalesce(total, Value(0)))
+        last_id = batch[-1]
+    return updated
+
+
+def legacy_cookie_ids(request) -> set:
+    """
+    :return: set - id статей из старой cookie 'likes' (нечисловые значения пропускаются)
+    """
+    return {int(like) for like in request.COOKIES.get(LEGACY_COOKIE, '').split(',') if like.strip().isdigit()}
+
+
+class LegacyFavouritesMiddleware:
+    """
+    Переносит избранное из старой cookie 'likes' в сессию анонима или в Favourites юзера и удаляет cookie
+    Ставится после AuthenticationMiddleware и JWTAuthenticationMiddleware
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if LEGACY_COOKIE not in request.COOKIES:
+            return self.get_response(request)
+        self.migrate(request)
+        response = self.get_response(request)
+        response.delete_cookie(LEGACY_COOKIE)
+        return response
+
+    async def __acall__(self, request):
+        if LEGACY_COOKIE not in request.COOKIES:
+            return await self.get_response(request)
+        await sync_to_async(self.migrate)(request)
+        response = await self.get_response(request)
+        response.delete_cookie(LEGACY_COOKIE)
+        return response
+
+    @staticmethod
+    def migrate(request):
+        article_ids = legacy_cookie_ids(request)
+        if article_ids:
+            get_favourites(request).merge(article_ids)
@@ -0,0 +1,140 @@
+"""
+Ленты последних статей (RSS и Atom): общая и по авторам
+
+Читалки опрашивают ленты каждые несколько минут, поэтому документы лент готовятся заранее и лежат в кэше
+вместе с ETag: опрос - одно чтение кэша, а с If-None-Match - ответ 304 без тела
+Лента пересобирается (одним запросом к БД) только когда в ней появляется новая статья
+или меняется/удаляется статья, которая в ней уже есть; остальные правки ленты не трогают
+Last-Modified ленты - момент, когда изменилось содержимое её документов: он не зависит от дат статей,
+поэтому правка или удаление статьи не оставляют его прежним и не сдвигают назад
+Массовые вставки (импорт, seed_fake_data) сигналов не вызывают и сбрасывают ленты (forget_feeds),
+сброшенная лента собирается при следующем опросе
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.http import quote_etag
+
+from .models import Article, User
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'rss': Rss201rev2Feed,
+    'atom': Atom1Feed,
+}
+
+
+def get_cache():
+    return caches[getattr(settings, 'FEED_CACHE', 'default')]
+
+
+def feed_key(author_id=None) -> str:
+    """
+    :param author_id: UUID - id автора (None - общая лента)
+    :return: str - ключ кэша ленты
+    """
+    return f'feeds:{author_id or "all"}'
+
+
+def absolute_url(path) -> str:
+    """
+    Ленты собираются и вне запроса (по сигналам), поэтому адрес сайта берётся из FEED_SITE_URL
+    """
+    return getattr(settings, 'FEED_SITE_URL', 'http://localhost:8000').rstrip('/') + path
+
+
+def build_feed(author_id=None):
+    """
+    Собираем ленту во всех форматах и кладём в кэш
+    :param author_id: UUID - id автора (None - общая лента)
+    :return: dict - {'ids': id статей ленты, 'updated': datetime изменения документов,
+                     'documents': {формат: (содержимое, ETag)}} или None, если автора нет
+    """
+    articles = Article.objects.select_related('author').only('id', 'slug', 'header', 'summary', 'date',
+                                                             'author__username')
+    if author_id is None:
+        title, link = 'Статьи', reverse('index')
+    else:
+        username = User.objects.filter(id=author_id).values_list('username', flat=True).first()
+        if username is None:
+            return None
+        title, link = f'Статьи автора {username}', reverse('author', args=[author_id])
+        articles = articles.filter(author_id=author_id)
+    articles = list(articles.order_by('-date', '-id')[:getattr(settings, 'FEED_SIZE', 20)])
+    documents = {}
+    for file_format, generator_class in FORMATS.items():
+        feed_url = reverse('author_feed', args=[author_id, file_format]) if author_id else reverse(
+            'feed', args=[file_format])
+        generator = generator_class(title=title, link=absolute_url(link), description=title, language='ru',
+                                    feed_url=absolute_url(feed_url))
+        for article in articles:
+            url = absolute_url(reverse('detail', args=[article.slug]))
+            generator.add_item(title=article.header, link=url, description=article.summary, unique_id=url,
+                               pubdate=article.date, author_name=article.author.username)
+        stream = io.StringIO()
+        generator.write(stream, 'utf-8')
+        content = stream.getvalue().encode()
+        documents[file_format] = (content, quote_etag(hashlib.md5(content).hexdigest()))
+    cache = get_cache()
+    previous = cache.get(feed_key(author_id))
+    now = timezone.now()
+    if previous is not None and previous['documents'] == documents:
+        # Пересобрали то же самое - клиентам, приходящим с If-Modified-Since, качать нечего
+        updated = previous['updated']
+    else:
+        updated = max(now, previous['updated']) if previous is not None else now
+    feed = {'ids': [article.id for article in articles], 'updated': updated, 'documents': documents}
+    cache.set(feed_key(author_id), feed, timeout=None)
+    return feed
+
+
+def get_feed(author_id=None):
+    """
+    Лента из кэша, при промахе собирается заново
+    :param author_id: UUID - id автора (None - общая лента)
+    :return: dict - см. build_feed() или None, если автора нет
+    """
+    feed = get_cache().get(feed_key(author_id))
+    if feed is None:
+        feed = build_feed(author_id)
+    return feed
+
+
+def article_changed(article_id, author_id, created=False):
+    """
+    Пересобираем ленты, которых касается изменение статьи (вызывается после коммита)
+    Новая статья попадает в начало общей ленты и ленты автора, изменённая или удалённая -
+    только в те ленты, где она есть
+    :param article_id: int - id статьи
+    :param author_id: UUID - id автора статьи
+    :param created: bool - статья добавлена
+    """
+    cache = get_cache()
+    author_ids = (None, author_id)
+    keys = [feed_key(feed_author) for feed_author in author_ids]
+    cached = cache.get_many(keys)
+    for feed_author, key in zip(author_ids, keys):
+        feed = cached.get(key)
+        if feed is None or not (created or article_id in feed['ids']):
+            # Ленты нет в кэше (соберётся при опросе) или статья её не касается
+            continue
+        try:
+            build_feed(feed_author)
+        except Exception:
+            logger.exception('Не удалось пересобрать ленту %s', key)
+            cache.delete(key)
+
+
+def forget_feeds(author_ids=()):
+    """
+    Сбрасываем общую ленту и ленты авторов после массовых изменений
+    :param author_ids: iterable - id авторов
+    """
+    get_cache().delete_many([feed_key(), *(feed_key(author_id) for author_id in author_ids)])
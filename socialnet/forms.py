@@ -1,12 +1,19 @@
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.core.exceptions import ValidationError
+from django.urls import resolve, reverse
 from .models import User, Article
+from .passwords import make_password
 from django import forms
+from django.core.validators import validate_slug
 
 
 class RegisterForm(UserCreationForm):
     """
     Форма для регистрации
+    Уникальность email проверяет ограничение БД при сохранении (RegisterView.form_valid), без отдельного запроса
     """
+    duplicate_email_message = 'Пользователь с таким email уже существует!'
     password1 = forms.CharField(widget=forms.PasswordInput, label='Пароль', error_messages={
         'invalid': 'Пароль должен быть не менее 8 символов и не содержать только цифры'})
     password2 = forms.CharField(widget=forms.PasswordInput, label='Подтвердите пароль')
@@ -25,36 +32,92 @@ class RegisterForm(UserCreationForm):
             raise forms.ValidationError('Пароли не совпадают!\r\n Попытайтесь снова')
         return cd['password2']
 
-    def clean_email(self):
+    def validate_unique(self):
+        try:
+            self.instance.validate_unique(exclude=self._get_validation_exclusions() | {'email'})
+        except ValidationError as e:
+            self._update_errors(e)
+
+    def save(self, commit=True):
         """
-        Проверка ввода email (не должен существовать в БД)
-        :return: str - email
+        Пароль хэшируется один раз, в пуле socialnet.passwords
+        :return: User
         """
-        cd = self.cleaned_data
-        if User.objects.filter(email=cd['email']).exists():
-            raise forms.ValidationError('Пользователь с таким email уже существует!')
-        return cd['email']
+        user = super(UserCreationForm, self).save(commit=False)
+        user.password = make_password(self.cleaned_data['password1'])
+        if commit:
+            user.save()
+        return user
 
 
 class LoginForm(AuthenticationForm):
     """
     Форма для входа
+    Пароль проверяется один раз: в clean() или заранее в асинхронной view (set_user())
     """
+    checked = False
 
     class Meta:
         model = User
         fields = ('username', 'password')
 
+    def clean_credentials(self):
+        """
+        Проверяем только поля формы, без входа (пароль асинхронная view проверяет сама)
+        :return: tuple - (username, password) или None, если поля не прошли проверку
+        """
+        try:
+            return tuple(self.fields[name].clean(self[name].data) for name in ('username', 'password'))
+        except ValidationError:
+            return None
+
+    def set_user(self, user):
+        """
+        Подставляем юзера, уже проверенного по паролю (None - пароль неверный)
+        :param user: User или None
+        """
+        self.user_cache = user
+        self.checked = True
+
+    def clean(self):
+        if not self.checked:
+            return super(LoginForm, self).clean()
+        if self.user_cache is None:
+            raise self.get_invalid_login_error()
+        self.confirm_login_allowed(self.user_cache)
+        return self.cleaned_data
+
 
 class ArticleForm(forms.ModelForm):
     """
     Форма для создания статьи
     Доступные поля: заголовок (транслитом), заголовок, краткое содержание, описание
+    Описание - не поле модели, а текст в ArticleBody (Article.description)
+    slug, адрес которого занят другой страницей (login, authors, metrics...), не принимается
     """
+    reserved_slug_message = 'Этот адрес занят страницей сайта, выберите другой заголовок (транслитом)'
+
+    description = forms.CharField(label='Содержание', widget=forms.Textarea,
+                                  max_length=getattr(settings, 'ARTICLE_BODY_MAX_LENGTH', 100000))
 
     class Meta:
         model = Article
-        fields = ('slug', 'header', 'summary', 'description', )
+        fields = ('slug', 'header', 'summary', )
+
+    def clean_slug(self):
+        """
+        Фиксированные маршруты стоят раньше страницы статьи, поэтому статья со slug,
+        совпадающим с ними, была бы недоступна
+        :return: str - slug
+        """
+        slug = self.cleaned_data['slug']
+        if resolve(reverse('detail', args=[slug])).url_name != 'detail':
+            raise forms.ValidationError(self.reserved_slug_message)
+        return slug
+
+    def save(self, commit=True):
+        self.instance.description = self.cleaned_data['description']
+        return super(ArticleForm, self).save(commit)
 
 
 class SettingForm(forms.Form):
@@ -66,6 +129,13 @@ class SettingForm(forms.Form):
                                      widget=forms.NumberInput,
                                      min_value=10, max_value=100)
 
+    PAGINATION_CHOICES = (
+        ('pages', 'По номерам страниц'),
+        ('cursor', 'Лентой (быстрее на больших списках)'),
+    )
+
+    pagination = forms.ChoiceField(label='Пагинация', choices=PAGINATION_CHOICES, initial=PAGINATION_CHOICES[0][0])
+
 
 class OrderAndFilterForm(forms.Form):
     """
@@ -82,11 +152,33 @@ class OrderAndFilterForm(forms.Form):
         ('-rating', 'Самый высокий рейтинг'),
         ('rating', 'Самый низкий рейтинг'),
         ('header', 'По умолчанию'),
+        ('-trending_score', 'Популярные сейчас'),
+    )
+
+    SEARCH_CHOICES = (
+        ('slug', 'По заголовку (транслитом)'),
+        ('fulltext', 'По тексту статьи'),
     )
 
     date_order = forms.ChoiceField(label='Сортировка по дате', choices=DATE_CHOICES, initial=DATE_CHOICES[2])
     rating_order = forms.ChoiceField(label='Сортировка по рейтингу', choices=RATING_CHOICES, initial=RATING_CHOICES[2])
-    filter_by_slug = forms.SlugField(label='Поиск статьи по заголовку (транслитом)', required=False, initial='')
+    search_mode = forms.ChoiceField(label='Режим поиска', choices=SEARCH_CHOICES, initial=SEARCH_CHOICES[0][0],
+                                    required=False)
+    filter_by_slug = forms.CharField(label='Поиск статьи', required=False, initial='', max_length=100,
+                                     widget=forms.TextInput(attrs={'list': 'suggestions', 'autocomplete': 'off'}))
+
+    def clean(self):
+        """
+        В режиме поиска по заголовку (транслитом) запрос должен быть slug-ом
+        :return: dict - данные формы
+        """
+        cd = super(OrderAndFilterForm, self).clean()
+        if cd.get('search_mode') != 'fulltext' and cd.get('filter_by_slug'):
+            try:
+                validate_slug(cd['filter_by_slug'])
+            except forms.ValidationError as error:
+                self.add_error('filter_by_slug', error)
+        return cd
 
 
 class FavouriteForm(forms.Form):
@@ -95,6 +187,8 @@ class FavouriteForm(forms.Form):
     """
 
     like = forms.ChoiceField(label='Понравилась?', widget=forms.CheckboxInput, required=False, initial=False)
+    # Признак отправки формы: снятый checkbox в GET-запрос не попадает
+    favourite = forms.CharField(widget=forms.HiddenInput, required=False, initial='1')
 
 
 class RateForm(forms.Form):
@@ -0,0 +1,145 @@
+"""
+Кэш результатов списка статей
+
+Для каждой комбинации фильтра, сортировки, номера и размера страницы
+храним id статей страницы, общее кол-во статей и время последнего изменения статей (для ETag)
+Ключи содержат номер поколения, который увеличивается сигналами при изменении
+Article/Rating, поэтому старые записи не удаляются, а просто перестают читаться
+Общее кол-во статей выдачи живёт в своём поколении: оно меняется только при добавлении
+и удалении статей, а не при каждой новой оценке
+Выдача «популярные сейчас» дополнительно зависит от поколения рейтинга trending,
+которое увеличивает его обновление (trending.refresh)
+Сразу после смены поколения реплики могут ещё не догнать основную базу, поэтому
+кэш в это время заполняется чтением из основной базы (primary_after_bump)
+"""
+import hashlib
+import json
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.functional import cached_property
+
+from .routers import use_primary
+
+GENERATION_KEY = 'articles:generation'
+COUNT_GENERATION_KEY = 'articles:count-generation'
+TRENDING_GENERATION_KEY = 'articles:trending-generation'
+# Время последней смены любого из поколений
+BUMPED_KEY = 'articles:generation-bumped'
+# Сортировка «популярные сейчас» (trending.ORDER)
+TRENDING_ORDER = '-trending_score'
+# Параметры запроса, от которых зависит выдача списка
+LISTING_PARAMS = ('filter_by_slug', 'search_mode', 'date_order', 'rating_order')
+
+
+def get_cache():
+    return caches[getattr(settings, 'LISTING_CACHE', 'default')]
+
+
+def get_generation(key=GENERATION_KEY) -> int:
+    """
+    Текущее поколение списков статей
+    Начальное значение берём от времени, чтобы после вытеснения ключа поколения
+    не прочитать записи, оставшиеся от прежней нумерации
+    :param key: str - ключ поколения (GENERATION_KEY, COUNT_GENERATION_KEY или TRENDING_GENERATION_KEY)
+    :return: int
+    """
+    return get_cache().get_or_set(key, lambda: int(time.time() * 1000), timeout=None)
+
+
+def bump_generation(counts=True):
+    """
+    Инвалидируем все закэшированные списки
+    :param counts: bool - и общее кол-во статей выдач (статьи добавлены или удалены)
+    """
+    _bump((GENERATION_KEY, COUNT_GENERATION_KEY) if counts else (GENERATION_KEY, ))
+
+
+def bump_trending_generation():
+    """
+    Инвалидируем закэшированные выдачи «популярные сейчас» (рейтинг обновлён)
+    """
+    _bump((TRENDING_GENERATION_KEY, ))
+
+
+def _bump(keys):
+    cache = get_cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), timeout=None)
+    cache.set(BUMPED_KEY, time.time(), timeout=getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+
+
+def recently_bumped() -> bool:
+    """
+    Поколение сменилось меньше REPLICA_STICKY_SECONDS секунд назад и реплики могут отставать
+    Без реплик кэш не читаем
+    :return: bool
+    """
+    if not getattr(settings, 'DATABASE_REPLICAS', ()):
+        return False
+    bumped = get_cache().get(BUMPED_KEY)
+    return bumped is not None and bumped > time.time() - getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+def primary_after_bump():
+    """
+    Контекст для чтений, результат которых попадёт в кэш под новым поколением:
+    сразу после смены поколения читаем из основной базы, иначе отставшая реплика
+    закэширует старую выдачу на всё время жизни записи
+    :return: контекстный менеджер
+    """
+    return use_primary() if recently_bumped() else nullcontext()
+
+
+class ListingCache:
+    """
+    Записи кэша одной выдачи (фильтр + сортировка + размер страницы) в текущем поколении
+    """
+
+    def __init__(self, params, page_size):
+        """
+        :param params: QueryDict - GET-параметры запроса
+        :param page_size: int - кол-во записей на одной странице
+        """
+        self.cache = get_cache()
+        self.timeout = getattr(settings, 'LISTING_CACHE_TIMEOUT', 300)
+        listing = json.dumps([params.get(param, '') for param in LISTING_PARAMS])
+        self.listing = hashlib.md5(listing.encode()).hexdigest()
+        # Состав и кол-во статей «популярных сейчас» меняет и обновление рейтинга
+        self.trending = f'.{get_generation(TRENDING_GENERATION_KEY)}' \
+            if params.get('rating_order') == TRENDING_ORDER else ''
+        self.prefix = f'articles:list:{get_generation()}{self.trending}:{self.listing}'
+        self.page_size = page_size
+
+    @cached_property
+    def count_key(self) -> str:
+        return f'articles:count:{get_generation(COUNT_GENERATION_KEY)}{self.trending}:{self.listing}'
+
+    def get_count(self):
+        """
+        :return: tuple - (кол-во статей, приблизительное ли оно) или None
+        """
+        return self.cache.get(self.count_key)
+
+    def set_count(self, count, approximate=False):
+        self.cache.set(self.count_key, (count, approximate), self.timeout)
+
+    def get_latest_change(self):
+        """
+        :return: float - время последнего изменения статей выдачи (0 - статей нет) или None
+        """
+        return self.cache.get(f'{self.prefix}:latest')
+
+    def set_latest_change(self, latest):
+        self.cache.set(f'{self.prefix}:latest', latest, self.timeout)
+
+    def get_page(self, number):
+        return self.cache.get(f'{self.prefix}:{self.page_size}:{number}')
+
+    def set_page(self, number, ids):
+        self.cache.set(f'{self.prefix}:{self.page_size}:{number}', ids, self.timeout)
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import include, path
+
+from socialnet.models import Article
+from socialnet.urls import get_urlpatterns
+
+
+def build_urlconf(async_views):
+    """
+    URLconf проекта с синхронными или асинхронными view чтения статей
+    :param async_views: bool
+    :return: module
+    """
+    urlconf = types.ModuleType(f'benchmark_urls_{"async" if async_views else "sync"}')
+    urlconf.urlpatterns = [path('socialnet/', include(get_urlpatterns(async_views)))]
+    return urlconf
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочное сравнение: синхронные view через WSGI-обработчик против асинхронных через ASGI-обработчик
+    Запросы идут в процессе через тестовые клиенты Django (без сетевого сервера),
+    WSGI - из пула потоков, ASGI - конкурентными задачами в одном event loop
+    Полностраничный кэш обходится cookie сессии, чтобы мерить именно view
+    """
+    help = 'Сравнивает пропускную способность чтения статей под WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Кол-во запросов на каждый режим')
+        parser.add_argument('--concurrency', type=int, default=20, help='Кол-во одновременных запросов')
+
+    def handle(self, *args, **options):
+        slug = Article.objects.values_list('slug', flat=True).first()
+        if slug is None:
+            raise CommandError('Нет статей для нагрузки, сначала заполните БД')
+        self.paths = ['/socialnet/', '/socialnet/favourites/', f'/socialnet/{slug}/']
+        total, concurrency = options['requests'], options['concurrency']
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            with override_settings(ROOT_URLCONF=build_urlconf(async_views=False)):
+                results['WSGI (sync)'] = self.run_wsgi(total, concurrency)
+            with override_settings(ROOT_URLCONF=build_urlconf(async_views=True)):
+                results['ASGI (async)'] = asyncio.run(self.run_asgi(total, concurrency))
+
+        for mode, (elapsed, errors) in results.items():
+            self.stdout.write(f'{mode}: {total / elapsed:.1f} запр./с, {elapsed:.2f} с, ошибок {errors}')
+        (sync_elapsed, _), (async_elapsed, _) = results.values()
+        self.stdout.write(self.style.SUCCESS(f'ASGI/WSGI: x{sync_elapsed / async_elapsed:.2f}'))
+
+    def run_wsgi(self, total, concurrency) -> tuple:
+        local = threading.local()
+
+        def request(number):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+                local.client.cookies[settings.SESSION_COOKIE_NAME] = 'benchmark'
+            return local.client.get(self.paths[number % len(self.paths)]).status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            statuses = list(executor.map(request, range(total)))
+        return time.perf_counter() - started, sum(status != 200 for status in statuses)
+
+    async def run_asgi(self, total, concurrency) -> tuple:
+        client = AsyncClient()
+        client.cookies[settings.SESSION_COOKIE_NAME] = 'benchmark'
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request(number):
+            async with semaphore:
+                response = await client.get(self.paths[number % len(self.paths)])
+                return response.status_code
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(request(number) for number in range(total)))
+        return time.perf_counter() - started, sum(status != 200 for status in statuses)
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from socialnet import passwords, throttle
+from socialnet.models import User
+
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный замер входа по паролю: сколько входов в секунду выдерживает одно ядро
+    Отдельно мерится голое хэширование (потолок) и полный вход через view тестовым клиентом Django
+    Юзер для замера создаётся и удаляется командой, ограничение попыток на время замера снимается
+    """
+    help = 'Замеряет пропускную способность входа по паролю (входов в секунду на ядро)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='Кол-во попыток входа на каждый замер')
+        parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1,
+                            help='Кол-во одновременных попыток')
+
+    def handle(self, *args, **options):
+        total, concurrency = options['logins'], options['concurrency']
+        cores = os.cpu_count() or 1
+        user = User.objects.create(username='benchlogin', email='benchmark-login@example.com',
+                                   password=make_password(PASSWORD))
+        limits = throttle.ip_throttle, throttle.account_throttle
+        # Все попытки идут с одного IP на один аккаунт - без снятия лимита почти все получили бы 429
+        throttle.ip_throttle = throttle.account_throttle = throttle.TokenBucket(total + 1, total)
+        try:
+            results = {
+                'Хэширование': self.run(total, concurrency,
+                                        lambda _: passwords.check_password(PASSWORD, user.password)[0]),
+                'Вход (view)': self.run_logins(user, total, concurrency),
+            }
+        finally:
+            throttle.ip_throttle, throttle.account_throttle = limits
+            user.delete()
+
+        self.stdout.write(f'Ядер: {cores}, потоков хэширования: {passwords.password_pool.workers}')
+        for mode, (elapsed, errors) in results.items():
+            self.stdout.write(f'{mode}: {total / elapsed:.1f} в сек., {total / elapsed / cores:.1f} в сек. на ядро, '
+                              f'ошибок {errors}')
+
+    @staticmethod
+    def run(total, concurrency, attempt) -> tuple:
+        """
+        :param attempt: callable(номер) -> bool - успешна ли попытка
+        :return: tuple - (время в секундах, кол-во неудачных попыток)
+        """
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            succeeded = list(executor.map(attempt, range(total)))
+        return time.perf_counter() - started, succeeded.count(False)
+
+    def run_logins(self, user, total, concurrency) -> tuple:
+        local = threading.local()
+        url = reverse('login')
+        data = {'username': user.email, 'password': PASSWORD}
+
+        def attempt(number):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            return local.client.post(url, data).status_code == 302
+
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            return self.run(total, concurrency, attempt)
@@ -0,0 +1,47 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from socialnet.models import Article
+from socialnet.suggest import SuggestIndex, normalize
+
+
+class Command(BaseCommand):
+    """
+    Замер индекса подсказок по статьям из БД (для больших объёмов - после seed_fake_data):
+    время построения, память в пересчёте на 100 тыс. статей и время ответа на префиксы разной длины
+    Префиксы берутся из заголовков случайных статей
+    """
+    help = 'Замеряет построение, память и скорость индекса подсказок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=10000, help='Кол-во запросов на каждую длину префикса')
+        parser.add_argument('--limit', type=int, default=10, help='Кол-во подсказок в ответе')
+
+    def handle(self, *args, **options):
+        index = SuggestIndex()
+        started = time.perf_counter()
+        index.build()
+        elapsed = time.perf_counter() - started
+        if not len(index):
+            raise CommandError('Статей нет, сначала запустите seed_fake_data')
+        memory = index.memory_usage()
+        self.stdout.write(f'Статей: {len(index)}, построение: {elapsed:.2f} с, '
+                          f'память: {memory / 2 ** 20:.1f} МБ ({memory / len(index) * 100000 / 2 ** 20:.1f} МБ '
+                          f'на 100 тыс. статей)')
+
+        headers = [normalize(header) for header in Article.objects.order_by('?')
+                   .values_list('header', flat=True)[:1000]]
+        for length in (2, 3, 4, 6):
+            prefixes = [random.choice(headers)[:length] for _ in range(options['queries'])]
+            timings, found = [], 0
+            for prefix in prefixes:
+                started = time.perf_counter()
+                found += len(index.suggest(prefix, options['limit']))
+                timings.append((time.perf_counter() - started) * 10 ** 6)
+            timings.sort()
+            self.stdout.write(f'Префикс {length} симв.: медиана {statistics.median(timings):.0f} мкс, '
+                              f'p99 {timings[int(len(timings) * 0.99)]:.0f} мкс, '
+                              f'подсказок в среднем {found / len(prefixes):.1f}')
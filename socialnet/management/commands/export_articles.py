@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from socialnet.export import FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    """
+    Выгрузка статей для аналитики в NDJSON/CSV
+    Для инкрементальной выгрузки передаётся дата последней выгруженной статьи (--since)
+    """
+    help = 'Потоково выгружает статьи в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson', help='Формат выгрузки')
+        parser.add_argument('--since', help='Выгрузить статьи, опубликованные после даты (ISO 8601)')
+        parser.add_argument('--output', help='Файл для выгрузки (по умолчанию - стандартный вывод)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Кол-во строк, читаемых из БД за раз')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('Дата --since должна быть в формате ISO 8601')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        serialize, _ = FORMATS[options['format']]
+        lines = serialize(export_rows(since, options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
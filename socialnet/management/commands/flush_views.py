@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from socialnet.counters import view_counter
+
+
+class Command(BaseCommand):
+    """
+    Сброс накопленных просмотров статей в БД
+    Запускается при остановке сервиса (и по крону) с общим хранилищем (CacheStore),
+    чтобы просмотры из буфера не терялись
+    Хранилище в памяти процесса (LocalMemoryStore) команде недоступно: его сбрасывает сам процесс сервера
+    при выходе (atexit), поэтому с ним команда отказывается работать, а не сообщает о 0 статей
+    """
+    help = 'Сбрасывает накопленные просмотры статей в Article.reviews'
+
+    def handle(self, *args, **options):
+        if not view_counter.store.shared:
+            raise CommandError('Просмотры копятся в памяти процессов сервера (VIEW_COUNTER_STORE) и сбрасываются '
+                               'ими при выходе. Для сброса командой нужно общее хранилище '
+                               'socialnet.counters.CacheStore')
+        updated = view_counter.flush(final=True)
+        self.stdout.write(self.style.SUCCESS(f'Обновлено статей: {updated}'))
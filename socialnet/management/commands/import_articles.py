@@ -0,0 +1,226 @@
+import csv
+import itertools
+import json
+import sys
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from socialnet import author_stats, feeds
+from socialnet.bodies import save_bodies
+from socialnet.forms import ArticleForm
+from socialnet.listing_cache import bump_generation
+from socialnet.models import Article, User
+
+
+class ImportArticleForm(ArticleForm):
+    """
+    Проверка строки импорта по правилам ArticleForm
+    Уникальность slug проверяется не построчно, а для всей пачки сразу
+    """
+
+    def validate_unique(self):
+        pass
+
+
+class Command(BaseCommand):
+    """
+    Массовый импорт статей из CSV/JSONL
+    Файл читается потоково, строки проверяются ArticleForm и вставляются пачками через bulk_create,
+    каждая пачка - отдельная транзакция (контрольная точка)
+    Для продолжения прерванного импорта передаётся кол-во уже обработанных строк (--skip)
+    """
+    help = 'Импортирует статьи из CSV или JSONL'
+
+    CONFLICT_CHOICES = ('skip', 'update', 'suffix')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл со статьями, "-" - стандартный ввод')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Кол-во статей в одной транзакции')
+        parser.add_argument('--on-conflict', choices=self.CONFLICT_CHOICES, default='skip',
+                            help='Что делать со статьёй, slug которой уже занят: '
+                                 'пропустить, обновить существующую или добавить суффикс к slug')
+        parser.add_argument('--author', help='Email автора для строк без поля author')
+        parser.add_argument('--skip', type=int, default=0, help='Пропустить первые N строк (продолжение импорта)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.batch_size = options['batch_size']
+        self.on_conflict = options['on_conflict']
+        self.authors = {}
+        self.default_author = None
+        if options['author']:
+            self.default_author = User.objects.filter(email=options['author']).first()
+            if self.default_author is None:
+                raise CommandError(f'Автор {options["author"]} не найден')
+
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            rows = self.read_rows(stream, file_format)
+            rows = itertools.islice(rows, options['skip'], None)
+            processed, created, updated, rejected, skipped = options['skip'], 0, 0, 0, 0
+            while True:
+                batch = list(itertools.islice(rows, self.batch_size))
+                if not batch:
+                    break
+                articles, errors = self.validate(batch)
+                with transaction.atomic():
+                    batch_created, batch_updated, conflicts = self.save(articles)
+                processed += len(batch)
+                created += batch_created
+                updated += batch_updated
+                rejected += len(errors)
+                skipped += len(conflicts)
+                for line, error in sorted(errors + conflicts):
+                    self.stderr.write(f'Строка {line}: {error}')
+                self.stdout.write(f'Контрольная точка: обработано строк {processed} (создано {created}, '
+                                  f'обновлено {updated}, пропущено {skipped}, отклонено {rejected})')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        if created or updated:
+            bump_generation()
+        self.stdout.write(self.style.SUCCESS(f'Импорт завершён: создано {created}, обновлено {updated}, '
+                                             f'пропущено {skipped}, отклонено {rejected}'))
+
+    @staticmethod
+    def read_rows(stream, file_format):
+        """
+        Построчное чтение файла
+        :return: generator - (номер строки, dict)
+        """
+        if file_format == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(stream, start=1):
+                if line.strip():
+                    try:
+                        yield line_num, json.loads(line)
+                    except ValueError:
+                        yield line_num, None
+
+    def resolve_authors(self, keys):
+        """
+        Подгружаем авторов пачки одним запросом (по email или никнейму)
+        """
+        missing = {key for key in keys if key and key not in self.authors}
+        if missing:
+            for user in User.objects.filter(Q(email__in=missing) | Q(username__in=missing)):
+                self.authors[user.email] = user
+                self.authors[user.username] = user
+
+    def validate(self, batch):
+        """
+        Проверяем строки пачки
+        :param batch: list - (номер строки, dict)
+        :return: tuple - (несохранённые статьи (номер строки, статья), ошибки (номер строки, текст))
+        """
+        articles, errors = [], []
+        self.resolve_authors({row.get('author') for _, row in batch if isinstance(row, dict)})
+        for line, row in batch:
+            if not isinstance(row, dict):
+                errors.append((line, 'некорректная строка'))
+                continue
+            form = ImportArticleForm(data=row)
+            if not form.is_valid():
+                errors.append((line, form.errors.as_text().replace('\n', ' ')))
+                continue
+            author = self.authors.get(row.get('author')) or self.default_author
+            if author is None:
+                errors.append((line, 'автор не найден'))
+                continue
+            article = form.save(commit=False)
+            article.author = author
+            articles.append((line, article))
+        return articles, errors
+
+    def save(self, articles):
+        """
+        Разрешаем конфликты slug для всей пачки и сохраняем её
+        :param articles: list - несохранённые статьи (номер строки, статья)
+        :return: tuple - (кол-во созданных, кол-во обновлённых, пропущенные строки (номер строки, причина))
+        """
+        unique, lines, duplicates = {}, {}, []
+        for line, article in articles:
+            lines[id(article)] = line
+            if self.on_conflict == 'update' or article.slug not in unique:
+                unique[article.slug] = article
+            else:
+                duplicates.append(article)
+        existing, previous_authors = {}, set()
+        for slug, article_id, author_id in (Article.objects.filter(slug__in=unique)
+                                            .values_list('slug', 'id', 'author_id')):
+            existing[slug] = article_id
+            previous_authors.add(author_id)
+
+        to_create = [article for slug, article in unique.items() if slug not in existing]
+        to_update = []
+        colliding = [article for slug, article in unique.items() if slug in existing]
+        if self.on_conflict == 'update':
+            for article in colliding:
+                article.id = existing[article.slug]
+            to_update = colliding
+        elif self.on_conflict == 'suffix':
+            to_create += self.suffix_slugs(colliding + duplicates, taken=set(unique))
+        skipped = []
+        if self.on_conflict == 'skip':
+            skipped = [(lines[id(article)], f'slug {article.slug} уже занят, статья пропущена')
+                       for article in colliding + duplicates]
+
+        Article.objects.bulk_create(to_create, batch_size=self.batch_size)
+        if to_update:
+            # bulk_update не вызывает Article.save(): версию и время изменения (ETag, Last-Modified) меняем сами
+            now = timezone.now()
+            for article in to_update:
+                article.version, article.updated = F('version') + 1, now
+            Article.objects.bulk_update(to_update, ['header', 'summary', 'author', 'version', 'updated'],
+                                        batch_size=self.batch_size)
+        save_bodies(to_create + to_update, batch_size=self.batch_size)
+        # bulk_create/bulk_update не вызывают сигналов - пересчитываем счётчики затронутых авторов
+        authors = {article.author_id for article in to_create + to_update}
+        if to_update:
+            authors |= previous_authors
+        author_stats.reconcile_authors(authors)
+        transaction.on_commit(partial(feeds.forget_feeds, authors))
+        return len(to_create), len(to_update), skipped
+
+    @staticmethod
+    def suffix_slugs(articles, taken, attempts=20):
+        """
+        Подбираем свободные slug вида slug-2, slug-3, ... одним запросом на раунд
+        :param articles: list - статьи с занятыми slug
+        :param taken: set - slug, уже занятые в пачке
+        :param attempts: int - кол-во вариантов на статью за раунд
+        :return: list - статьи со свободными slug
+        """
+        max_length = Article._meta.get_field('slug').max_length
+        pending = [(article, article.slug, 2) for article in articles]
+        resolved = []
+        while pending:
+            candidates = set()
+            for article, base, start in pending:
+                for number in range(start, start + attempts):
+                    suffix = f'-{number}'
+                    candidates.add(f'{base[:max_length - len(suffix)]}{suffix}')
+            taken |= set(Article.objects.filter(slug__in=candidates).values_list('slug', flat=True))
+            next_round = []
+            for article, base, start in pending:
+                for number in range(start, start + attempts):
+                    suffix = f'-{number}'
+                    slug = f'{base[:max_length - len(suffix)]}{suffix}'
+                    if slug not in taken:
+                        taken.add(slug)
+                        article.slug = slug
+                        resolved.append(article)
+                        break
+                else:
+                    next_round.append((article, base, start + attempts))
+            pending = next_round
+        return resolved
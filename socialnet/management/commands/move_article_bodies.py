@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from socialnet.bodies import save_bodies
+from socialnet.models import Article
+
+
+class Command(BaseCommand):
+    """
+    Перенос текстов статей из прежнего столбца description в сжатый ArticleBody
+    Статьи перебираются по id пачками, каждая пачка - отдельная транзакция,
+    поэтому команду можно прервать и запустить снова
+    """
+    help = 'Переносит тексты статей в сжатую таблицу ArticleBody'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Кол-во статей за раз')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        moved, last_id = 0, 0
+        while True:
+            with transaction.atomic():
+                rows = list(Article.objects.filter(id__gt=last_id).exclude(legacy_description='')
+                            .order_by('id').values_list('id', 'slug', 'legacy_description')[:batch_size])
+                if not rows:
+                    break
+                articles = []
+                for article_id, slug, text in rows:
+                    article = Article(id=article_id, slug=slug)
+                    article.description = text
+                    articles.append(article)
+                save_bodies(articles, batch_size=batch_size)
+                Article.objects.filter(id__in=[row[0] for row in rows]).update(legacy_description='')
+            moved += len(rows)
+            last_id = rows[-1][0]
+        self.stdout.write(self.style.SUCCESS(f'Перенесено текстов: {moved}'))
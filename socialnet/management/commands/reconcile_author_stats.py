@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from socialnet import author_stats
+
+
+class Command(BaseCommand):
+    """
+    Периодическая сверка счётчиков авторов (AuthorStats)
+    Пересчитывает их по Article, Rating и Favourites пачками авторов,
+    исправляя расхождения после массовых вставок и сбоев
+    """
+    help = 'Пересчитывает счётчики авторов по статьям, оценкам и избранному'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Кол-во авторов за раз')
+
+    def handle(self, *args, **options):
+        authors = author_stats.reconcile(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано авторов: {authors}'))
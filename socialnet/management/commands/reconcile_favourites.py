@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from socialnet import favourites
+
+
+class Command(BaseCommand):
+    """
+    Периодическая сверка денормализованного Article.favourites_count
+    Пересчитывает его по таблице Favourites пачками по диапазонам id
+    (счётчики авторов сверяет reconcile_author_stats)
+    """
+    help = 'Пересчитывает кол-во добавлений статей в избранное по таблице Favourites'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Кол-во статей в одном UPDATE')
+
+    def handle(self, *args, **options):
+        updated = favourites.reconcile(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано статей: {updated}'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from socialnet.models import Article, Rating
+from socialnet.ratings import rating_expression
+
+
+class Command(BaseCommand):
+    """
+    Периодическая сверка денормализованных агрегатов оценок
+    Пересчитывает rating_sum/rating_count/rating по таблице Rating
+    пачками по диапазонам id, каждая пачка - два UPDATE
+    """
+    help = 'Пересчитывает агрегаты оценок статей по таблице Rating'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Кол-во статей в одном UPDATE')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        votes = Rating.objects.filter(article=OuterRef('pk')).order_by().values('article')
+        votes_sum = Subquery(votes.annotate(total=Sum('mark')).values('total'))
+        votes_count = Subquery(votes.annotate(total=Count('id')).values('total'))
+
+        ids = Article.objects.order_by('id').values_list('id', flat=True)
+        last_id, updated = 0, 0
+        while True:
+            batch = list(ids.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            articles = Article.objects.filter(id__gte=batch[0], id__lte=batch[-1])
+            with transaction.atomic():
+                updated += articles.update(rating_sum=Coalesce(votes_sum, Value(0)),
+                                           rating_count=Coalesce(votes_count, Value(0)))
+                articles.update(rating=rating_expression(F('rating_sum'), F('rating_count')))
+            last_id = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано статей: {updated}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from socialnet import similar
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт похожих статей по избранному
+    По умолчанию - только статьи с изменившимся избранным (запускается по крону),
+    --full пересчитывает все статьи (после импорта или смены настроек)
+    """
+    help = 'Пересчитывает похожие статьи по совместному добавлению в избранное'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать все статьи')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Кол-во статей за раз')
+
+    def handle(self, *args, **options):
+        refreshed = similar.refresh(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано статей: {refreshed}'))
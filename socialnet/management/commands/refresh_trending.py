@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from socialnet import trending
+
+
+class Command(BaseCommand):
+    """
+    Обновление рейтинга «популярное сейчас» по накопленной активности
+    Запускается по крону (раз в несколько минут), пересчитываются только статьи с новой активностью
+    """
+    help = 'Обновляет рейтинг «популярное сейчас» и его кэш'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Кол-во строк активности за раз')
+
+    def handle(self, *args, **options):
+        processed = trending.refresh(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Разобрано строк активности: {processed}'))
@@ -0,0 +1,162 @@
+import json
+import platform
+import statistics
+import time
+from contextlib import ExitStack
+
+import django
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from socialnet.models import Article, User
+from socialnet.urls import urlpatterns
+
+# Маршруты, которые меняют состояние или требуют тела запроса
+SKIP_URL_NAMES = ('logout', 'token_refresh')
+
+
+def percentile(values, fraction) -> float:
+    """
+    Перцентиль по методу ближайшего ранга
+    :param values: list - отсортированные значения
+    :param fraction: float - доля (0.5 - медиана)
+    """
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+class Command(BaseCommand):
+    """
+    Замеры страниц сайта тестовым клиентом Django (без сетевого сервера)
+    Для каждого маршрута socialnet/urls.py: пропускная способность, перцентили задержки
+    и кол-во SQL-запросов ко всем базам (основной и репликам); результаты пишутся в JSON для сравнения прогонов
+    Данные для замеров готовит seed_fake_data, внешние сервисы не нужны (работает и на SQLite)
+    """
+    help = 'Замеряет скорость страниц сайта и сохраняет результаты в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Кол-во замеряемых запросов на маршрут')
+        parser.add_argument('--warmup', type=int, default=5, help='Кол-во запросов для прогрева на маршрут')
+        parser.add_argument('--user', help='Email юзера, от имени которого идут запросы (по умолчанию - аноним)')
+        parser.add_argument('--only', nargs='*', help='Замерять только эти маршруты')
+        parser.add_argument('--cold', action='store_true', help='Очищать кэши перед каждым запросом')
+        parser.add_argument('--label', default='', help='Метка прогона (ветка, описание изменения)')
+        parser.add_argument('--output', help='Файл для результатов JSON (по умолчанию - стандартный вывод)')
+        parser.add_argument('--compare', help='JSON прошлого прогона: вывести изменение метрик')
+
+    def handle(self, *args, **options):
+        article = Article.objects.order_by('id').values_list('slug', 'author_id').first()
+        if article is None:
+            raise CommandError('Нет статей для замеров, сначала выполните seed_fake_data')
+        client = Client()
+        if options['user']:
+            user = User.objects.filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f'Юзер {options["user"]} не найден')
+            client.force_login(user)
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            kwargs = {'slug': article[0], 'author_id': article[1], 'file_format': 'rss'}
+            for name, url in self.get_urls(kwargs, options['only']):
+                results[name] = self.measure(client, url, options['requests'], options['warmup'], options['cold'])
+                self.stderr.write(f'{name}: {results[name]["rps"]} запр./с, p50 {results[name]["p50_ms"]} мс, '
+                                  f'SQL {results[name]["queries_mean"]}')
+
+        report = {
+            'label': options['label'],
+            'timestamp': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'replicas': list(getattr(settings, 'DATABASE_REPLICAS', [])),
+                'articles': Article.objects.count(),
+                'user': options['user'] or 'anonymous',
+                'requests': options['requests'],
+                'cold': options['cold'],
+            },
+            'results': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    @staticmethod
+    def get_urls(kwargs, only=None):
+        """
+        Адреса всех маршрутов приложения с подставленными параметрами
+        Маршруты с параметрами, значений которых нет в kwargs, пропускаются
+        :param kwargs: dict - значения параметров маршрутов
+        :param only: list - имена маршрутов для замера
+        :return: generator - (имя маршрута, адрес)
+        """
+        for pattern in urlpatterns:
+            if not isinstance(pattern, URLPattern) or pattern.name in SKIP_URL_NAMES:
+                continue
+            if only and pattern.name not in only:
+                continue
+            if not set(pattern.pattern.converters) <= set(kwargs):
+                continue
+            yield pattern.name, reverse(pattern.name, kwargs={key: kwargs[key] for key in pattern.pattern.converters})
+
+    @staticmethod
+    def measure(client, url, requests, warmup, cold=False) -> dict:
+        """
+        :param cold: bool - очищать кэши перед каждым запросом (замер пути через БД)
+        :return: dict - метрики маршрута
+        """
+        for _ in range(warmup):
+            client.get(url)
+        latencies, queries, statuses = [], [], set()
+        elapsed = 0
+        for _ in range(requests):
+            if cold:
+                for cache in caches.all():
+                    cache.clear()
+            # Чтение уходит на реплики, поэтому запросы считаются по всем соединениям
+            with ExitStack() as stack:
+                captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+                request_started = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - request_started)
+            elapsed += latencies[-1]
+            queries.append(sum(len(context) for context in captured))
+            statuses.add(response.status_code)
+        latencies.sort()
+        return {
+            'url': url,
+            'status': sorted(statuses),
+            'rps': round(requests / elapsed, 1),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p90_ms': round(percentile(latencies, 0.9) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'queries_max': max(queries),
+        }
+
+    def compare(self, path, results):
+        """
+        Изменение пропускной способности, медианы и кол-ва SQL-запросов относительно прошлого прогона
+        """
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        for name, current in results.items():
+            if name not in previous:
+                continue
+            before = previous[name]
+            rps = (current['rps'] - before['rps']) / before['rps'] * 100 if before['rps'] else 0
+            p50 = (current['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            self.stderr.write(f'{name}: запр./с {rps:+.1f}%, p50 {p50:+.1f}%, '
+                              f'SQL {before["queries_mean"]} -> {current["queries_mean"]}')
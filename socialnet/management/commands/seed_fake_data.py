@@ -0,0 +1,141 @@
+import random
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from socialnet import author_stats, feeds
+from socialnet.bodies import save_bodies
+from socialnet.listing_cache import bump_generation
+from socialnet.models import Article, Favourites, Rating, User
+
+WORDS = ('статья', 'данные', 'город', 'наука', 'история', 'музыка', 'спорт', 'путешествие', 'технологии',
+         'кино', 'книга', 'работа', 'здоровье', 'природа', 'экономика', 'образование', 'искусство', 'игра',
+         'программирование', 'база', 'запрос', 'сервер', 'кэш', 'индекс', 'производительность', 'новости',
+         'обзор', 'мнение', 'интервью', 'советы', 'python', 'django', 'postgresql', 'весна', 'лето')
+# Доли оценок: чаще ставят «Отлично», реже - «Не понравилась»
+MARK_WEIGHTS = {Rating.RatingChoices.LOW: 2, Rating.RatingChoices.NORMAL: 3, Rating.RatingChoices.EXCELLENT: 5}
+
+
+class Command(BaseCommand):
+    """
+    Синтетические данные для нагрузочных замеров
+    Распределения приближены к реальным: немногие авторы пишут большую часть статей,
+    а оценки, избранное и просмотры сосредоточены на популярных статьях (закон Ципфа)
+    Вставка - через bulk_create, агрегаты статей считаются в памяти и пишутся bulk_update
+    При одинаковом --seed данные повторяются
+    """
+    help = 'Генерирует юзеров, статьи, оценки и избранное'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Кол-во юзеров')
+        parser.add_argument('--articles', type=int, default=1000, help='Кол-во статей')
+        parser.add_argument('--ratings', type=int, default=5000, help='Кол-во оценок')
+        parser.add_argument('--favourites', type=int, default=2000, help='Кол-во отметок «в избранном»')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора случайных чисел')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Кол-во строк в одном INSERT')
+        parser.add_argument('--password', default='password', help='Пароль всех юзеров')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            users = self.create_users(options['users'], options['password'])
+            articles = self.create_articles(options['articles'], users)
+            rating_totals = self.create_pairs(Rating, options['ratings'], users, articles)
+            favourite_counts = self.create_pairs(Favourites, options['favourites'], users, articles)
+            for article in articles:
+                marks = rating_totals.get(article.id, ())
+                article.rating_sum = sum(marks)
+                article.rating_count = len(marks)
+                article.rating = article.rating_sum / article.rating_count if marks else 0
+                article.favourites_count = favourite_counts.get(article.id, 0)
+            Article.objects.bulk_update(articles, ['rating_sum', 'rating_count', 'rating', 'favourites_count'],
+                                        batch_size=self.batch_size)
+            for start in range(0, len(users), self.batch_size):
+                author_stats.reconcile_authors([user.id for user in users[start:start + self.batch_size]])
+        bump_generation()
+        feeds.forget_feeds()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: юзеров {len(users)}, статей {len(articles)}, '
+            f'оценок {sum(map(len, rating_totals.values()))}, в избранном {sum(favourite_counts.values())}'))
+
+    def zipf_weights(self, count, exponent=1.1) -> list:
+        """
+        Веса популярности: k-й по популярности элемент встречается в ~1/k^exponent раз реже первого
+        Порядок популярности перемешан, чтобы он не совпадал с порядком id
+        """
+        weights = [1 / rank ** exponent for rank in range(1, count + 1)]
+        self.random.shuffle(weights)
+        return weights
+
+    def text(self, min_words, max_words, max_length) -> str:
+        words = self.random.choices(WORDS, k=self.random.randint(min_words, max_words))
+        return ' '.join(words).capitalize()[:max_length]
+
+    def create_users(self, count, password):
+        offset = User.objects.count()
+        # Хэш пароля один на всех: хэширование намеренно медленное
+        password = make_password(password)
+        users = [User(id=uuid.UUID(int=self.random.getrandbits(128), version=4),
+                      username=f'u{offset + i}', email=f'user{offset + i}@example.com', password=password,
+                      first_name=self.text(1, 1, 40), last_name=self.text(1, 1, 40))
+                 for i in range(count)]
+        return User.objects.bulk_create(users, batch_size=self.batch_size)
+
+    def create_articles(self, count, users):
+        offset = Article.objects.count()
+        authors = self.random.choices(users, weights=self.zipf_weights(len(users)), k=count)
+        now = timezone.now()
+        articles = []
+        for i, author in enumerate(authors):
+            articles.append(Article(
+                slug=f'seed-{offset + i}',
+                header=self.text(2, 5, 50),
+                summary=self.text(10, 30, 250),
+                description=self.text(40, 600, 20000),
+                author=author,
+                # Просмотры - логнормальное распределение: большинство статей читают мало
+                reviews=int(self.random.lognormvariate(4, 1.5)),
+            ))
+        articles = Article.objects.bulk_create(articles, batch_size=self.batch_size)
+        save_bodies(articles, batch_size=self.batch_size)
+        if articles[0].id is None:
+            # Бэкенд не вернул id после вставки
+            articles = list(Article.objects.filter(slug__in=[article.slug for article in articles]))
+        # Дата публикации ставится auto_now_add, разносим статьи по последнему году
+        for article in articles:
+            article.date = now - timedelta(seconds=self.random.randint(0, 365 * 24 * 3600))
+        Article.objects.bulk_update(articles, ['date'], batch_size=self.batch_size)
+        return articles
+
+    def create_pairs(self, model, count, users, articles) -> dict:
+        """
+        Уникальные пары (юзер, статья) для Rating/Favourites, статьи - по популярности
+        :return: dict - для Rating: {id статьи: [оценки]}, для Favourites: {id статьи: кол-во}
+        """
+        count = min(count, len(users) * len(articles))
+        weights = self.zipf_weights(len(articles))
+        pairs = set()
+        while len(pairs) < count:
+            needed = count - len(pairs)
+            chosen = zip(self.random.choices(users, k=needed),
+                         self.random.choices(articles, weights=weights, k=needed))
+            pairs.update((user.id, article.id) for user, article in chosen)
+        pairs = sorted(pairs, key=str)
+        if model is Rating:
+            marks = self.random.choices(list(MARK_WEIGHTS), weights=list(MARK_WEIGHTS.values()), k=len(pairs))
+            Rating.objects.bulk_create((Rating(user_id=user_id, article_id=article_id, mark=mark)
+                                        for (user_id, article_id), mark in zip(pairs, marks)),
+                                       batch_size=self.batch_size)
+            totals = {}
+            for (_, article_id), mark in zip(pairs, marks):
+                totals.setdefault(article_id, []).append(int(mark))
+            return totals
+        Favourites.objects.bulk_create((Favourites(who_id=user_id, article_id=article_id)
+                                        for user_id, article_id in pairs), batch_size=self.batch_size)
+        return dict(Counter(article_id for _, article_id in pairs))
@@ -0,0 +1,228 @@
+"""
+Метрики производительности запросов
+
+MetricsMiddleware замеряет для каждого запроса время ответа, кол-во и время SQL-запросов,
+время рендеринга шаблона и размер ответа, отдаёт их в заголовке Server-Timing
+и накапливает гистограммы по имени маршрута (index, detail, favourites, ...)
+Гистограммы отдаются в текстовом формате Prometheus view 'metrics'
+Метрики копятся в памяти процесса: каждый воркер отдаёт свои
+При METRICS_ENABLED = False middleware отключается целиком (MiddlewareNotUsed)
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import Resolver404, resolve
+
+_current = ContextVar('request_metrics', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+# Метрика -> (описание, границы корзин)
+METRICS = {
+    'request_duration_seconds': ('Время обработки запроса', DURATION_BUCKETS),
+    'db_queries': ('Кол-во SQL-запросов на запрос', QUERY_BUCKETS),
+    'db_duration_seconds': ('Суммарное время SQL-запросов на запрос', DURATION_BUCKETS),
+    'template_render_seconds': ('Время рендеринга шаблона', DURATION_BUCKETS),
+    'response_size_bytes': ('Размер тела ответа', SIZE_BUCKETS),
+}
+PREFIX = 'socialnet_'
+
+
+class Histogram:
+    """
+    Гистограмма Prometheus: счётчики по корзинам (le), сумма и кол-во наблюдений
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        :return: generator - (граница корзины, кол-во наблюдений не больше неё)
+        """
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """
+    Гистограммы всех метрик по маршрутам
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, **values):
+        """
+        :param view: str - имя маршрута
+        :param values: метрика из METRICS -> значение
+        """
+        with self._lock:
+            for name, value in values.items():
+                key = (name, view)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(METRICS[name][1])
+                self._histograms[key].observe(value)
+
+    def render(self) -> str:
+        """
+        :return: str - метрики в текстовом формате Prometheus
+        """
+        lines = []
+        with self._lock:
+            for name, (description, _) in METRICS.items():
+                metric = PREFIX + name
+                lines.append(f'# HELP {metric} {description}')
+                lines.append(f'# TYPE {metric} histogram')
+                for (histogram_name, view), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'{metric}_bucket{{view="{view}",le="{bound}"}} {total}')
+                    lines.append(f'{metric}_sum{{view="{view}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{view="{view}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetrics:
+    """
+    Замеры одного запроса
+    Хранятся в ContextVar, поэтому SQL-запросы из sync_to_async учитываются тоже
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0
+        self.render_started = None
+        self.render_time = 0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Обёртка выполнения SQL-запросов (execute_wrapper) для всех соединений
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    Обработчик connection_created: подключаем учёт SQL-запросов к новому соединению
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    """
+    Замеры запросов для Server-Timing и гистограмм registry
+    Ставится первым, чтобы учитывать и ответы из полностраничного кэша
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        connection_created.connect(install_query_recorder, dispatch_uid='socialnet.metrics.query_recorder')
+        for connection in connections.all():
+            install_query_recorder(None, connection)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def process_template_response(self, request, response):
+        """
+        Рендеринг идёт после process_template_response всех middleware,
+        поэтому засекаем его здесь и останавливаем post-render колбэком
+        """
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self.stop_render(metrics))
+        return response
+
+    @staticmethod
+    def stop_render(metrics):
+        metrics.render_time = time.perf_counter() - metrics.render_started
+
+    def finish(self, request, response, metrics):
+        duration = time.perf_counter() - metrics.started
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(self.get_view_name(request), request_duration_seconds=duration,
+                         db_queries=metrics.queries, db_duration_seconds=metrics.db_time,
+                         template_render_seconds=metrics.render_time, response_size_bytes=size)
+        response['Server-Timing'] = (f'app;dur={duration * 1000:.1f}, '
+                                     f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+                                     f'tpl;dur={metrics.render_time * 1000:.1f}')
+        return response
+
+    @staticmethod
+    def get_view_name(request) -> str:
+        """
+        Имя маршрута запроса; ответы из полностраничного кэша не проходят разрешение URL,
+        поэтому для них маршрут определяем сами
+        """
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                return 'unmatched'
+        return match.url_name or match.view_name
@@ -0,0 +1,104 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response, get_max_age
+from django.utils.http import parse_http_date_safe
+
+from .authentication import get_cookie_name
+from .counters import view_counter
+from .listing_cache import get_generation, primary_after_bump
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Полностраничный кэш страниц статей для анонимных посетителей
+    Страницы не зависят от юзера (ссылки входа и отметка «в избранном» подгружаются
+    с фрагмента 'fragment'), поэтому один отрендеренный ответ отдаётся всем анонимам
+    без обращения к сессии, БД и шаблонам
+    Сразу после смены поколения страница рендерится по основной базе (реплики могут отставать)
+    Ставится до SessionMiddleware
+    """
+    sync_capable = True
+    async_capable = True
+    # Cookies, от которых зависит вёрстка списка
+    VARY_COOKIES = ('paginate_by', 'pagination')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cache = caches[getattr(settings, 'PAGE_CACHE', 'default')]
+        self.timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+        self.url_names = set(getattr(settings, 'PAGE_CACHE_URL_NAMES', ('index', 'detail')))
+        # Под ASGI работаем асинхронно, чтобы не переводить цепочку обработки в поток
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.is_cacheable_request(request):
+            return self.get_response(request)
+        key = self.get_cache_key(request)
+        entry = self.cache.get(key)
+        if entry is not None:
+            response, article_id = entry
+            if article_id is not None:
+                view_counter.incr(article_id)
+            return self.conditional(request, response)
+        with primary_after_bump():
+            response = self.get_response(request)
+        if self.is_cacheable_response(response):
+            self.cache.set(key, (response, getattr(response, 'article_id', None)), self.timeout)
+        return response
+
+    async def __acall__(self, request):
+        if not self.is_cacheable_request(request):
+            return await self.get_response(request)
+        key = self.get_cache_key(request)
+        entry = await self.cache.aget(key)
+        if entry is not None:
+            response, article_id = entry
+            if article_id is not None:
+                await view_counter.aincr(article_id)
+            return self.conditional(request, response)
+        with primary_after_bump():
+            response = await self.get_response(request)
+        if self.is_cacheable_response(response):
+            await self.cache.aset(key, (response, getattr(response, 'article_id', None)), self.timeout)
+        return response
+
+    def is_cacheable_request(self, request) -> bool:
+        """
+        Кэшируем только GET анонимов (без cookie сессии и JWT) к выбранным страницам
+        """
+        if request.method != 'GET' or settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return False
+        if get_cookie_name() in request.COOKIES or 'HTTP_AUTHORIZATION' in request.META:
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        return match.url_name in self.url_names
+
+    @staticmethod
+    def conditional(request, response):
+        """
+        Закэшированный ответ с ETag/Last-Modified тоже отвечает 304 на условный запрос
+        """
+        return get_conditional_response(request, etag=response.get('ETag'),
+                                        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+                                        response=response)
+
+    @staticmethod
+    def is_cacheable_response(response) -> bool:
+        """
+        Не кэшируем ответы, которые ставят cookies или зависят от сессии
+        """
+        return (response.status_code == 200 and not response.streaming and not response.cookies
+                and 'cookie' not in response.get('Vary', '').lower() and get_max_age(response) != 0)
+
+    def get_cache_key(self, request) -> str:
+        cookies = ':'.join(request.COOKIES.get(name, '') for name in self.VARY_COOKIES)
+        return f'page:{get_generation()}:{request.get_full_path()}:{cookies}'
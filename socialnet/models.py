@@ -2,10 +2,13 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.shortcuts import reverse
-from datetime import datetime, timedelta
+from django.utils import timezone
+from datetime import timedelta
 from uuid import uuid4
 import jwt
 
+from .compression import decompress
+
 
 class User(AbstractUser):
 
@@ -25,11 +28,27 @@ class User(AbstractUser):
         return self._generate_jwt_token()
 
     def _generate_jwt_token(self):
-        exp_time = datetime.now() + timedelta(hours=1)
-        token = jwt.encode(payload={'username': self.username, 'exp': int(exp_time.strftime("%s"))},
+        exp_time = timezone.now() + timedelta(seconds=getattr(settings, 'JWT_LIFETIME', 3600))
+        token = jwt.encode(payload={'id': str(self.id), 'username': self.username, 'exp': int(exp_time.timestamp())},
                            key=settings.SECRET_KEY,
                            algorithm='HS256')
-        return token.decode('utf-8')
+        # PyJWT < 2 возвращает bytes
+        return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+class ArticleQuerySet(models.QuerySet):
+    """
+    Выборки статей под конкретные страницы
+    """
+    # Поля, которые выводит список статей (без тяжёлого описания)
+    LIST_FIELDS = ('id', 'slug', 'header', 'summary', 'reviews', 'rating', 'date', 'author__username')
+
+    def for_list(self):
+        """
+        Проекция для списков: только выводимые поля и автор в том же запросе
+        :return: QuerySet
+        """
+        return self.select_related('author').only(*self.LIST_FIELDS)
 
 
 class Article(models.Model):
@@ -37,18 +56,86 @@ class Article(models.Model):
     header = models.CharField(max_length=50, verbose_name='Заголовок', null=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Автор')
     summary = models.CharField(max_length=250, verbose_name='Краткое содержание', null=False)
-    description = models.CharField(verbose_name='Содержание', max_length=750, null=False)
+    # Прежнее место текста статьи: теперь текст хранится в ArticleBody (Article.description),
+    # команда move_article_bodies переносит старые тексты и очищает столбец
+    legacy_description = models.CharField(verbose_name='Содержание (устаревшее)', max_length=750, blank=True,
+                                          default='', db_column='description')
     reviews = models.IntegerField(verbose_name='Просмотры', default=0)
-    rating = models.FloatField(verbose_name='Рейтинг', default=0)
+    rating = models.FloatField(verbose_name='Рейтинг', default=0, db_index=True)
+    rating_sum = models.IntegerField(verbose_name='Сумма оценок', default=0)
+    rating_count = models.IntegerField(verbose_name='Кол-во оценок', default=0)
+    favourites_count = models.IntegerField(verbose_name='В избранном', default=0)
     date = models.DateTimeField(auto_now_add=True, verbose_name='Дата публикации')
+    # Отметка изменения для ETag/Last-Modified: меняется при правке статьи и при оценках
+    updated = models.DateTimeField(auto_now=True, verbose_name='Изменена', db_index=True)
+    version = models.PositiveIntegerField(verbose_name='Версия', default=1)
+
+    objects = ArticleQuerySet.as_manager()
+
+    class Meta:
+        # Составные индексы под все сортировки OrderAndFilterForm (с id в конце для курсорной пагинации)
+        # Обратный обход индекса обслуживает сортировку с противоположными направлениями всех полей
+        indexes = [
+            models.Index(fields=['rating', 'date', 'id'], name='article_rating_date_idx'),
+            models.Index(fields=['rating', '-date', '-id'], name='article_rating_date_desc_idx'),
+            models.Index(fields=['rating', 'header', 'id'], name='article_rating_header_idx'),
+            models.Index(fields=['-rating', 'header', 'id'], name='article_rating_desc_header_idx'),
+            models.Index(fields=['header', 'date', 'id'], name='article_header_date_idx'),
+            models.Index(fields=['header', '-date', '-id'], name='article_header_date_desc_idx'),
+            models.Index(fields=['header', 'id'], name='article_header_idx'),
+            # Инкрементальная выгрузка статей по дате публикации и последние статьи для лент (socialnet.feeds)
+            models.Index(fields=['date', 'id'], name='article_date_idx'),
+        ]
 
     def get_absolute_url(self):
         return reverse('detail', args=[self.slug])
 
+    @property
+    def description(self) -> str:
+        """
+        Текст статьи: распаковывается из ArticleBody при первом обращении
+        (до переноса - берётся из legacy_description)
+        """
+        if '_description' not in self.__dict__:
+            body = getattr(self, 'body', None)
+            self._description = body.text if body is not None else self.legacy_description
+        return self._description
+
+    @description.setter
+    def description(self, value):
+        # Текст записывается в ArticleBody при save() (или bodies.save_bodies() после bulk_create)
+        self._description = value
+        self._description_changed = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated'}
+        super(Article, self).save(*args, **kwargs)
+        if self.__dict__.get('_description_changed'):
+            from .bodies import save_bodies
+
+            save_bodies([self])
+
     def __str__(self):
         return f'{self.header}'
 
 
+class ArticleBody(models.Model):
+    """
+    Текст статьи отдельно от строки Article: списки статей его не читают
+    Хранится сжатым, codec - маркер алгоритма сжатия (socialnet.compression)
+    """
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True, related_name='body')
+    codec = models.CharField(verbose_name='Кодек', max_length=10)
+    data = models.BinaryField(verbose_name='Сжатый текст')
+
+    @property
+    def text(self) -> str:
+        return decompress(self.codec, self.data)
+
+
 class Rating(models.Model):
 
     class RatingChoices(models.IntegerChoices):
@@ -57,9 +144,13 @@ class Rating(models.Model):
         NORMAL = 0, 'Нормально'
         EXCELLENT = 1, 'Отлично'
 
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Кто оценил', related_name='ratings')
     article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='article_fk')
     mark = models.IntegerField(verbose_name='Рейтинг', default=RatingChoices.NORMAL, choices=RatingChoices.choices)
 
+    class Meta:
+        unique_together = ('user', 'article', )
+
 
 class Favourites(models.Model):
     who = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='У кого?')
@@ -68,8 +159,63 @@ class Favourites(models.Model):
     class Meta:
         unique_together = ('who', 'article', )
 
-    
-
-
 
+class ArticleActivity(models.Model):
+    """
+    Необработанная активность по статье для рейтинга «популярное сейчас»
+    Пишется пачкой при сбросе просмотров и при оценке, разбирается командой refresh_trending
+    """
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='activity')
+    views = models.IntegerField(verbose_name='Просмотры', default=0)
+    # Сумма (оценка + 1) по новым оценкам: «Не понравилась» не добавляет популярности
+    vote_points = models.IntegerField(verbose_name='Очки оценок', default=0)
+    created = models.DateTimeField(verbose_name='Когда', default=timezone.now)
+
+
+class TrendingScore(models.Model):
+    """
+    Материализованный рейтинг «популярное сейчас»
+    score - натуральный логарифм суммы весов активности, каждый из которых растёт
+    экспоненциально со временем (log-space decay): новые строки не требуют пересчёта старых
+    """
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    score = models.FloatField(verbose_name='Популярность', db_index=True)
+    updated = models.DateTimeField(verbose_name='Обновлено', auto_now=True)
+
+
+class SimilarArticles(models.Model):
+    """
+    Предвычисленные похожие статьи (по совместному добавлению в избранное), одна строка на статью
+    neighbours - до SIMILAR_ARTICLES_COUNT записей {'id', 'slug', 'header', 'score'} по убыванию сходства,
+    поэтому страница статьи получает их тем же SELECT (JOIN по первичному ключу)
+    """
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True, related_name='similar')
+    neighbours = models.JSONField(verbose_name='Похожие статьи', default=list)
+    updated = models.DateTimeField(verbose_name='Обновлено', auto_now=True)
+
+
+class StaleSimilarArticles(models.Model):
+    """
+    Статьи, чьё избранное изменилось после последнего пересчёта похожих статей
+    """
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True, related_name='+')
+
+
+class AuthorStats(models.Model):
+    """
+    Счётчики автора по его статьям, одна строка на автора
+    Поддерживаются дельтами при создании статьи, оценке, просмотрах и избранном (socialnet.author_stats),
+    расхождения исправляет команда reconcile_author_stats
+    Индексы совпадают с сортировками списка лучших авторов (по убыванию счётчика, затем по id)
+    """
+    author = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    articles_count = models.IntegerField(verbose_name='Статей', default=0)
+    reviews = models.BigIntegerField(verbose_name='Просмотры', default=0)
+    rating = models.FloatField(verbose_name='Средняя оценка', default=0)
+    rating_sum = models.IntegerField(verbose_name='Сумма оценок', default=0)
+    rating_count = models.IntegerField(verbose_name='Кол-во оценок', default=0)
+    favourites_count = models.IntegerField(verbose_name='В избранном', default=0)
 
+    class Meta:
+        indexes = [models.Index(fields=[f'-{field}', 'author'], name=f'author_stats_{field}')
+                   for field in ('articles_count', 'reviews', 'rating', 'favourites_count')]
@@ -0,0 +1,372 @@
+"""
+Пагинация списков статей
+
+Курсорная (keyset): вместо OFFSET страница выбирается условием «после последней показанной строки»
+по полям сортировки с уникальным id в конце, поэтому глубина страницы не влияет
+на скорость, а COUNT(*) не нужен
+По номерам страниц: кол-во статей и id статей страницы берутся из кэша списков,
+а для большой таблицы без фильтров кол-во - из оценки планировщика PostgreSQL
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+TIEBREAKER = 'id'
+
+
+class InvalidCursor(Exception):
+    """
+    Курсор повреждён или не подходит к текущей сортировке
+    """
+
+
+def keyset_ordering(ordering) -> list:
+    """
+    Приводим сортировку к виду, пригодному для курсора:
+    убираем повторы полей и добавляем уникальный id в направлении последнего поля,
+    чтобы сортировку можно было обслужить одним составным индексом
+    :param ordering: iterable - поля сортировки ('-date', 'header', ...)
+    :return: list - поля сортировки
+    """
+    result, seen = [], set()
+    for field in ordering:
+        name = field.lstrip('-')
+        if name not in seen:
+            seen.add(name)
+            result.append(field)
+    if TIEBREAKER not in seen:
+        descending = bool(result) and result[-1].startswith('-')
+        result.append(f'-{TIEBREAKER}' if descending else TIEBREAKER)
+    return result
+
+
+def encode_cursor(values, direction) -> str:
+    """
+    Упаковываем значения полей сортировки в непрозрачную строку
+    :param values: list - значения полей сортировки строки-границы
+    :param direction: str - 'next' или 'prev'
+    :return: str
+    """
+    payload = [{'dt': value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps({'v': payload, 'd': direction}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor) -> tuple:
+    """
+    Распаковываем курсор
+    :param cursor: str
+    :return: tuple - (значения полей сортировки, направление)
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = [parse_datetime(value['dt']) if isinstance(value, dict) else value for value in data['v']]
+        direction = data['d']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor(cursor)
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor(cursor)
+    return values, direction
+
+
+class CursorPage:
+    """
+    Страница курсорной пагинации, совместимая по интерфейсу с Page в шаблонах
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Пагинатор по курсору для QuerySet, отсортированного через keyset_ordering
+    """
+
+    def __init__(self, queryset, per_page):
+        self.ordering = keyset_ordering(queryset.query.order_by)
+        self.queryset = queryset.order_by(*self.ordering)
+        self.per_page = int(per_page)
+
+    def _clean(self, name, value):
+        """
+        Приводим значение из курсора к типу поля сортировки (поля модели или аннотации)
+        :raise ValidationError: значение не подходит полю (в том числе выходит за диапазон столбца)
+        """
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = self.queryset.query.annotations[name].output_field
+        if value is None:
+            raise ValidationError('Пустое значение в курсоре')
+        value = field.to_python(value)
+        field.run_validators(value)
+        # Диапазон целых проверяют валидаторы не всех СУБД (SQLite - нет), а драйвер падает на переполнении
+        if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+            raise ValidationError('Значение вне диапазона')
+        return value
+
+    def _seek(self, values, backwards) -> Q:
+        """
+        Условие «строка идёт после границы» в лексикографическом порядке полей сортировки:
+        (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...
+        """
+        if len(values) != len(self.ordering):
+            raise InvalidCursor(values)
+        condition, equal = Q(), Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            value = self._clean(name, value)
+            descending = field.startswith('-') != backwards
+            condition |= equal & Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _values(self, obj) -> list:
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def _prepare(self, cursor):
+        """
+        Запрос страницы после (или перед) курсором с одной лишней строкой,
+        по которой видно, есть ли следующая страница
+        :return: tuple - (QuerySet, идём ли назад)
+        """
+        queryset, backwards = self.queryset, False
+        if cursor:
+            values, direction = decode_cursor(cursor)
+            backwards = direction == 'prev'
+            try:
+                queryset = queryset.filter(self._seek(values, backwards))
+            except (ValidationError, ValueError, TypeError):
+                # Курсор подделан: значения не того типа, что поля сортировки
+                raise InvalidCursor(cursor)
+            if backwards:
+                queryset = queryset.reverse()
+        return queryset[:self.per_page + 1], backwards
+
+    def _build_page(self, rows, cursor, backwards) -> CursorPage:
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return CursorPage(rows, None, None)
+        has_next = has_more if not backwards else True
+        has_previous = bool(cursor) if not backwards else has_more
+        return CursorPage(rows,
+                          encode_cursor(self._values(rows[-1]), 'next') if has_next else None,
+                          encode_cursor(self._values(rows[0]), 'prev') if has_previous else None)
+
+    def page(self, cursor=None) -> CursorPage:
+        """
+        Страница после (или перед) курсором, без курсора - первая страница
+        :param cursor: str - курсор из next_cursor/previous_cursor
+        :return: CursorPage
+        """
+        queryset, backwards = self._prepare(cursor)
+        return self._build_page(list(queryset), cursor, backwards)
+
+    async def apage(self, cursor=None) -> CursorPage:
+        """
+        Асинхронный аналог page()
+        """
+        queryset, backwards = self._prepare(cursor)
+        return self._build_page([obj async for obj in queryset], cursor, backwards)
+
+
+def can_estimate(queryset) -> bool:
+    """
+    Можно ли оценить кол-во строк выборки планировщиком: только выборка без фильтров на PostgreSQL
+    """
+    return not queryset.query.where and connections[queryset.db].vendor == 'postgresql'
+
+
+def estimate_count(queryset):
+    """
+    Оценка кол-ва строк планировщиком PostgreSQL (pg_class.reltuples) вместо COUNT(*)
+    Только если строк больше PAGINATION_ESTIMATE_THRESHOLD: на небольших таблицах точный COUNT(*) дешёвый
+    :param queryset: QuerySet
+    :return: int или None, если оценка не применима
+    """
+    if not can_estimate(queryset):
+        return None
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                       [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    # До первого ANALYZE reltuples = -1
+    if row is None or row[0] < getattr(settings, 'PAGINATION_ESTIMATE_THRESHOLD', 100000):
+        return None
+    return row[0]
+
+
+def format_count(count, approximate=False) -> str:
+    """
+    Кол-во для показа: точное - как есть, приблизительное - округлённым (1234567 -> '~1.2M')
+    :param count: int
+    :param approximate: bool
+    :return: str
+    """
+    if not approximate:
+        return str(count)
+    for divisor, suffix in ((10 ** 9, 'B'), (10 ** 6, 'M'), (10 ** 3, 'K')):
+        if count >= divisor:
+            return '~' + f'{count / divisor:.1f}'.rstrip('0').rstrip('.') + suffix
+    return f'~{count}'
+
+
+class CachedPaginator(Paginator):
+    """
+    Пагинатор по номерам страниц без COUNT(*) на каждый запрос
+    Общее кол-во берётся из ListingCache (точное, сбрасывается при добавлении и удалении статей),
+    а для большой выборки без фильтров - из оценки планировщика (approximate)
+    Кол-во можно передать и готовым (count), тогда ListingCache не нужен
+    При попадании в кэш страница загружается одним запросом по первичным ключам
+    """
+
+    def __init__(self, object_list, per_page, listing_cache=None, count=None, **kwargs):
+        super(CachedPaginator, self).__init__(object_list, per_page, **kwargs)
+        self.listing_cache = listing_cache
+        self.approximate = False
+        if count is not None:
+            self.__dict__['count'] = count
+
+    def _cached_count(self):
+        cached = self.listing_cache.get_count() if self.listing_cache is not None else None
+        if cached is None:
+            return None
+        count, self.approximate = cached
+        return count
+
+    def _store_count(self, count, approximate=False) -> int:
+        self.approximate = approximate
+        if self.listing_cache is not None:
+            self.listing_cache.set_count(count, approximate)
+        return count
+
+    @cached_property
+    def count(self) -> int:
+        count = self._cached_count()
+        if count is not None:
+            return count
+        estimate = estimate_count(self.object_list)
+        if estimate is not None:
+            return self._store_count(estimate, approximate=True)
+        return self._store_count(super(CachedPaginator, self).count)
+
+    async def acount(self) -> int:
+        if 'count' in self.__dict__:
+            return self.count
+        count = self._cached_count()
+        if count is not None:
+            return count
+        estimate = await sync_to_async(estimate_count)(self.object_list)
+        if estimate is not None:
+            return self._store_count(estimate, approximate=True)
+        return self._store_count(await self.object_list.acount())
+
+    @property
+    def display_count(self) -> str:
+        return format_count(self.count, self.approximate)
+
+    @property
+    def display_num_pages(self) -> str:
+        return format_count(self.num_pages, self.approximate)
+
+    def validate_number(self, number):
+        """
+        Приблизительное кол-во может быть меньше настоящего, поэтому номер страницы сверху не ограничиваем
+        """
+        try:
+            return super(CachedPaginator, self).validate_number(number)
+        except EmptyPage:
+            if not self.approximate or int(number) < 1:
+                raise
+            return int(number)
+
+    def _bounds(self, number) -> tuple:
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if not self.approximate and top + self.orphans >= self.count:
+            top = self.count
+        return bottom, top
+
+    def _remember(self, page):
+        if self.listing_cache is not None:
+            self.listing_cache.set_page(page.number, [obj.pk for obj in page.object_list])
+        return page
+
+    def _cached_ids(self, number):
+        return self.listing_cache.get_page(number) if self.listing_cache is not None else None
+
+    def page(self, number):
+        number = self.validate_number(number)
+        ids = self._cached_ids(number)
+        if ids is None:
+            bottom, top = self._bounds(number)
+            return self._remember(self._get_page(list(self.object_list[bottom:top]), number, self))
+        objects = self.object_list.in_bulk(ids)
+        return self._get_page([objects[pk] for pk in ids if pk in objects], number, self)
+
+    async def apage(self, number):
+        """
+        Асинхронный аналог page()
+        """
+        if 'count' not in self.__dict__:
+            self.__dict__['count'] = await self.acount()
+        number = self.validate_number(number)
+        ids = self._cached_ids(number)
+        if ids is None:
+            bottom, top = self._bounds(number)
+            rows = [obj async for obj in self.object_list[bottom:top]]
+            return self._remember(self._get_page(rows, number, self))
+        objects = await self.object_list.ain_bulk(ids)
+        return self._get_page([objects[pk] for pk in ids if pk in objects], number, self)
+
+
+async def apage(paginator, number):
+    """
+    Асинхронный аналог Paginator.page(): COUNT(*) и выборка страницы через асинхронный ORM
+    :param paginator: Paginator - пагинатор по QuerySet
+    :param number: int - номер страницы
+    :return: Page
+    """
+    if 'count' not in paginator.__dict__:
+        paginator.__dict__['count'] = await paginator.object_list.acount()
+    number = paginator.validate_number(number)
+    bottom = (number - 1) * paginator.per_page
+    top = bottom + paginator.per_page
+    if top + paginator.orphans >= paginator.count:
+        top = paginator.count
+    rows = [obj async for obj in paginator.object_list[bottom:top]]
+    return paginator._get_page(rows, number, paginator)
@@ -0,0 +1,96 @@
+"""
+Хэширование паролей в ограниченном пуле потоков
+
+Хэширование (PBKDF2 и т.п.) намеренно медленное и занимает ядро целиком, поэтому при волне входов
+оно вытесняло бы отдачу страниц. Все хэши считаются в пуле из PASSWORD_HASHING_WORKERS потоков
+(hashlib отпускает GIL), а в очереди к пулу ждут не больше PASSWORD_HASHING_QUEUE задач:
+лишние попытки сразу отклоняются (PasswordPoolBusy), а не копятся
+Асинхронные view ждут хэш через acheck_password(), не блокируя event loop
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PasswordPoolBusy(Exception):
+    """
+    Пул хэширования и очередь к нему заполнены
+    """
+
+
+class PasswordPool:
+    """
+    Пул потоков хэширования с ограниченной очередью
+    Потоки создаются при первой задаче
+    """
+
+    def __init__(self, workers=None, queue=None):
+        self.workers = workers or getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or os.cpu_count() or 1
+        queue = getattr(settings, 'PASSWORD_HASHING_QUEUE', 64) if queue is None else queue
+        self._slots = threading.BoundedSemaphore(self.workers + queue)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+            return self._executor
+
+    def submit(self, func, *args):
+        """
+        :return: Future
+        :raise PasswordPoolBusy: если свободных мест в очереди нет
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+password_pool = PasswordPool()
+
+
+def verify(password, encoded) -> tuple:
+    """
+    Проверка пароля (выполняется в потоке пула)
+    :return: tuple - (пароль верный, нужно ли перехэшировать пароль по текущим настройкам)
+    """
+    outdated = []
+    valid = hashers.check_password(password, encoded, setter=outdated.append)
+    return valid, bool(outdated)
+
+
+def check_password(password, encoded) -> tuple:
+    """
+    :param password: str - введённый пароль
+    :param encoded: str - хэш из User.password
+    :return: tuple - см. verify()
+    """
+    return password_pool.submit(verify, password, encoded).result()
+
+
+async def acheck_password(password, encoded) -> tuple:
+    return await asyncio.wrap_future(password_pool.submit(verify, password, encoded))
+
+
+def make_password(password) -> str:
+    """
+    :param password: str
+    :return: str - хэш для User.password
+    """
+    return password_pool.submit(hashers.make_password, password).result()
+
+
+async def amake_password(password) -> str:
+    return await asyncio.wrap_future(password_pool.submit(hashers.make_password, password))
@@ -0,0 +1,77 @@
+"""
+Оценки статей с поддержкой денормализованных агрегатов
+Article.rating_sum/rating_count обновляются атомарными дельтами через F-выражения,
+а Article.rating - средняя оценка - пересчитывается в том же UPDATE
+(вместе с версией статьи для ETag)
+Те же дельты применяются к счётчикам автора статьи (AuthorStats)
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.utils import timezone
+
+from .author_stats import author_of
+from .models import Article, AuthorStats, Rating
+from .trending import record_vote
+
+
+def rating_expression(rating_sum, rating_count):
+    """
+    Выражение средней оценки: сумма / кол-во, либо 0, если оценок нет
+    :param rating_sum: выражение суммы оценок
+    :param rating_count: выражение кол-ва оценок
+    :return: Expression
+    """
+    return Coalesce(Cast(rating_sum, FloatField()) / NullIf(rating_count, Value(0)), Value(0.0))
+
+
+def apply_rating_delta(article_id, delta_sum, delta_count) -> int:
+    """
+    Атомарно применяем изменение оценок к агрегатам статьи и её автора
+    :param article_id: int - id статьи
+    :param delta_sum: int - изменение суммы оценок
+    :param delta_count: int - изменение кол-ва оценок
+    :return: int - кол-во обновлённых строк
+    """
+    new_sum = F('rating_sum') + delta_sum
+    new_count = F('rating_count') + delta_count
+    updated = Article.objects.filter(id=article_id).update(rating_sum=new_sum,
+                                                           rating_count=new_count,
+                                                           rating=rating_expression(new_sum, new_count),
+                                                           version=F('version') + 1,
+                                                           updated=timezone.now())
+    # Поля агрегатов у AuthorStats те же, что у статьи
+    AuthorStats.objects.filter(author_id=author_of(article_id)).update(rating_sum=new_sum, rating_count=new_count,
+                                                                       rating=rating_expression(new_sum, new_count))
+    return updated
+
+
+def rate_article(user, article_id, mark) -> bool:
+    """
+    Фиксируем оценку юзера (одна на статью, повторная оценка заменяет прежнюю)
+    :param user: User - кто оценивает
+    :param article_id: int - id статьи
+    :param mark: int - оценка из Rating.RatingChoices
+    :return: bool - изменились ли агрегаты статьи
+    """
+    with transaction.atomic():
+        rating = Rating.objects.select_for_update().filter(user=user, article_id=article_id).first()
+        if rating is None:
+            try:
+                with transaction.atomic():
+                    Rating.objects.create(user=user, article_id=article_id, mark=mark)
+            except IntegrityError:
+                # Параллельный запрос успел создать оценку - обновляем её
+                rating = Rating.objects.select_for_update().get(user=user, article_id=article_id)
+            else:
+                apply_rating_delta(article_id, mark, 1)
+                record_vote(article_id, mark)
+                return True
+        if rating.mark == mark:
+            return False
+        delta_sum = mark - rating.mark
+        rating.mark = mark
+        rating.save(update_fields=['mark'])
+        apply_rating_delta(article_id, delta_sum, 0)
+        record_vote(article_id, mark)
+        return True
@@ -0,0 +1,190 @@
+"""
+Маршрутизация запросов к БД между основной базой и репликами
+
+Чтение в рамках HTTP-запроса уходит на реплики (DATABASE_REPLICAS) по очереди
+или на наименее загруженную (REPLICA_STRATEGY), запись - всегда в 'default'
+После первой записи запрос до конца читает из основной базы (read-after-write),
+а PrimaryAfterWriteMiddleware продлевает это на следующие запросы юзера,
+пока реплики догоняют основную базу
+Вне HTTP-запросов (команды, фоновый сброс просмотров) всё идёт в основную базу
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+_state = ContextVar('db_routing_state', default=None)
+
+
+class RoutingState:
+    """
+    Состояние маршрутизации одного HTTP-запроса
+    """
+
+    def __init__(self, pinned=False):
+        # Читать из основной базы
+        self.pinned = pinned
+        # Была ли в запросе запись
+        self.wrote = False
+
+
+@contextmanager
+def routing_state(pinned=False):
+    """
+    Включаем чтение с реплик для кода внутри блока (обычно - обработки HTTP-запроса)
+    :param pinned: bool - сразу читать из основной базы
+    """
+    state = RoutingState(pinned)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """
+    Читаем из основной базы внутри блока
+    """
+    state = _state.get()
+    if state is None or state.pinned:
+        yield
+        return
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = False
+
+
+class QueryLoad:
+    """
+    Кол-во выполняющихся сейчас запросов на каждой базе (во всех потоках процесса)
+    Считается обёрткой выполнения запросов (execute_wrapper) на каждом соединении
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        alias = context['connection'].alias
+        with self._lock:
+            self._in_flight[alias] = self._in_flight.get(alias, 0) + 1
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self._in_flight[alias] -= 1
+
+    def get(self, alias) -> int:
+        return self._in_flight.get(alias, 0)
+
+    def install(self, sender, connection, **kwargs):
+        """
+        Обработчик connection_created: подключаем счётчик к новому соединению
+        """
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+query_load = QueryLoad()
+
+
+class ReplicaRouter:
+    """
+    Роутер БД: чтение - с реплик, запись и read-after-write - в основную базу
+    """
+
+    def __init__(self):
+        self._counter = itertools.count()
+        if getattr(settings, 'REPLICA_STRATEGY', 'round_robin') == 'least_loaded':
+            connection_created.connect(query_load.install, dispatch_uid='socialnet.routers.query_load')
+
+    @staticmethod
+    def get_replicas() -> list:
+        return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+    def choose_replica(self, replicas) -> str:
+        """
+        :param replicas: list - псевдонимы реплик
+        :return: str - псевдоним реплики
+        """
+        start = next(self._counter)
+        ordered = [replicas[(start + shift) % len(replicas)] for shift in range(len(replicas))]
+        if getattr(settings, 'REPLICA_STRATEGY', 'round_robin') == 'least_loaded':
+            # При равной загрузке min() берёт первую, то есть очередную по кругу
+            return min(ordered, key=query_load.get)
+        return ordered[0]
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = self.get_replicas()
+        if state is None or state.pinned or not replicas or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return self.choose_replica(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = state.pinned = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+
+class PrimaryAfterWriteMiddleware:
+    """
+    Включает чтение с реплик на время обработки запроса
+    Небезопасные методы (POST и т.п.) сразу читают из основной базы
+    Если запрос что-то записал, следующие REPLICA_STICKY_SECONDS секунд запросы юзера
+    тоже читают из основной базы (отметка в cookie), чтобы он видел свои изменения
+    """
+    sync_capable = True
+    async_capable = True
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = getattr(settings, 'REPLICA_STICKY_COOKIE', 'primary_until')
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with routing_state(self.is_pinned(request)) as state:
+            response = self.get_response(request)
+        return self.process_response(state, response)
+
+    async def __acall__(self, request):
+        with routing_state(self.is_pinned(request)) as state:
+            response = await self.get_response(request)
+        return self.process_response(state, response)
+
+    def is_pinned(self, request) -> bool:
+        if request.method not in self.SAFE_METHODS:
+            return True
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def process_response(self, state, response):
+        if state.wrote:
+            response.set_cookie(self.cookie_name, str(time.time() + self.sticky_seconds),
+                                max_age=self.sticky_seconds, httponly=True, samesite='strict')
+        return response
@@ -0,0 +1,255 @@
+"""
+Полнотекстовый поиск статей по заголовку, краткому содержанию и описанию
+
+PostgreSQL: столбец tsvector, поддерживаемый триггером, GIN-индекс по нему
+и триграммные GIN-индексы (pg_trgm) для нечёткого совпадения по заголовку и slug
+SQLite: таблица FTS5 с триггерами синхронизации
+Остальные СУБД и SQLite, собранный без FTS5: поиск через icontains без ранжирования (без текста статьи)
+
+Текст статьи хранится сжатым (ArticleBody), поэтому в индекс его передаёт приложение (index_bodies):
+на PostgreSQL - в столбец body_vector, из которого триггер собирает общий tsvector,
+на SQLite - в столбец description таблицы FTS5
+
+Схема поиска ставится на post_migrate, результаты ранжируются по релевантности (search_rank)
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Article, ArticleBody
+
+
+class BasicSearchBackend:
+    """
+    Запасной поиск без индексов: icontains по текстовым полям
+    """
+
+    @classmethod
+    def is_available(cls, connection) -> bool:
+        """
+        Поддерживает ли СУБД подключения этот поиск
+        """
+        return True
+
+    def install(self, connection):
+        pass
+
+    def index_bodies(self, connection, bodies):
+        """
+        Индексируем тексты статей
+        :param connection: подключение к БД
+        :param bodies: iterable - (id статьи, текст)
+        """
+
+    def search(self, queryset, query):
+        """
+        Фильтруем статьи по запросу и аннотируем релевантность (search_rank)
+        :param queryset: QuerySet - статьи
+        :param query: str - поисковый запрос
+        :return: QuerySet
+        """
+        condition = Q()
+        for word in query.split():
+            condition &= Q(header__icontains=word) | Q(summary__icontains=word)
+        return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class PostgresSearchBackend(BasicSearchBackend):
+    """
+    Поиск через tsvector + GIN и нечёткое совпадение через pg_trgm
+    """
+    column = 'search_vector'
+    body_column = 'body_vector'
+
+    @property
+    def config(self) -> str:
+        return getattr(settings, 'SEARCH_CONFIG', 'russian')
+
+    def install(self, connection):
+        """
+        Столбцы, функция триггера и триггер создаются только если их нет или изменился документ
+        (например, SEARCH_CONFIG), и только тогда существующие статьи переиндексируются:
+        обычный migrate не берёт блокировок таблицы статей и не переписывает её строки
+        """
+        table = Article._meta.db_table
+        function = f'{table}_search_update'
+        # description - текст статей, ещё не перенесённых в ArticleBody
+        document = " || ".join(
+            f"setweight(to_tsvector('{self.config}', coalesce(NEW.{field}, '')), '{weight}')"
+            for field, weight in (('header', 'A'), ('summary', 'B'), ('description', 'C'))
+        ) + f" || coalesce(NEW.{self.body_column}, ''::tsvector)"
+        source = f"""
+                BEGIN
+                    NEW.{self.column} := {document};
+                    RETURN NEW;
+                END """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT column_name FROM information_schema.columns "
+                           "WHERE table_schema = current_schema() AND table_name = %s AND column_name IN (%s, %s)",
+                           [table, self.column, self.body_column])
+            columns = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT prosrc FROM pg_proc "
+                           "WHERE proname = %s AND pronamespace = current_schema()::regnamespace", [function])
+            row = cursor.fetchone()
+            changed = row is None or row[0] != source
+            cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = %s::regclass AND NOT tgisinternal",
+                           [f'{table}_search', table])
+            has_trigger = cursor.fetchone() is not None
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for column in (self.column, self.body_column):
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} tsvector')
+            if changed:
+                cursor.execute(f'CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $${source}$$ '
+                               f'LANGUAGE plpgsql')
+            if not has_trigger:
+                cursor.execute(f"""
+                    CREATE TRIGGER {table}_search
+                    BEFORE INSERT OR UPDATE OF header, summary, description, {self.body_column}
+                    ON {table} FOR EACH ROW EXECUTE PROCEDURE {function}()
+                """)
+            if self.column not in columns or changed:
+                # Заполняем столбец для уже существующих статей (триггер срабатывает на UPDATE)
+                cursor.execute(f'UPDATE {table} SET header = header')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_search_gin ON {table} USING gin ({self.column})')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_header_trgm ON {table} USING gin (header gin_trgm_ops)')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_slug_trgm ON {table} USING gin (slug gin_trgm_ops)')
+
+    def index_bodies(self, connection, bodies):
+        table = Article._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.executemany(f"UPDATE {table} SET {self.body_column} = setweight(to_tsvector(%s::regconfig, %s), 'C') "
+                               f"WHERE id = %s", [(self.config, text, article_id) for article_id, text in bodies])
+
+    def search(self, queryset, query):
+        tsquery = 'websearch_to_tsquery(%s::regconfig, %s)'
+        params = [self.config, query]
+        matches = RawSQL(f'({self.column} @@ {tsquery} OR header %% %s)', [*params, query],
+                         output_field=BooleanField())
+        rank = RawSQL(f'GREATEST(ts_rank({self.column}, {tsquery}), similarity(header, %s))', [*params, query],
+                      output_field=FloatField())
+        return queryset.filter(matches).annotate(search_rank=rank)
+
+
+class SqliteSearchBackend(BasicSearchBackend):
+    """
+    Поиск через таблицу FTS5 с собственной копией текста, ранжирование по bm25
+    Заголовки синхронизируют триггеры, текст статьи (сжатый в ArticleBody) - index_bodies()
+    """
+    fields = ('slug', 'header', 'summary', 'description')
+    # Поля, которые синхронизируют триггеры
+    row_fields = ('slug', 'header', 'summary')
+    # Веса полей для bm25 в порядке fields
+    weights = (0.5, 10.0, 5.0, 1.0)
+
+    # Есть ли FTS5 в SQLite подключения: {алиас: bool}
+    _fts5 = {}
+
+    @classmethod
+    def is_available(cls, connection) -> bool:
+        if connection.alias not in cls._fts5:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+                cls._fts5[connection.alias] = bool(cursor.fetchone()[0])
+        return cls._fts5[connection.alias]
+
+    @property
+    def fts_table(self) -> str:
+        return f'{Article._meta.db_table}_fts'
+
+    def install(self, connection):
+        table, fts = Article._meta.db_table, self.fts_table
+        columns = ', '.join(self.fields)
+        # description в таблице статьи - текст, ещё не перенесённый в ArticleBody
+        new_values = ', '.join(f'new.{field}' for field in self.fields)
+        assignments = ', '.join(f'{field} = new.{field}' for field in self.row_fields)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [fts])
+            row = cursor.fetchone()
+            # Прежняя внешняя (content=) таблица читала текст из таблицы статей - пересоздаём
+            if row is not None and 'content=' in row[0]:
+                cursor.execute(f'DROP TABLE {fts}')
+                row = None
+            created = row is None
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                    {columns}, tokenize='unicode61 remove_diacritics 2'
+                )
+            """)
+            for action in ('insert', 'update', 'delete'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{action}')
+            cursor.execute(f"""
+                CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN
+                    DELETE FROM {fts} WHERE rowid = old.id;
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER {fts}_update AFTER UPDATE OF {', '.join(self.row_fields)} ON {table} BEGIN
+                    UPDATE {fts} SET {assignments} WHERE rowid = new.id;
+                END
+            """)
+            if created:
+                cursor.execute(f'INSERT INTO {fts}(rowid, {columns}) SELECT id, {columns} FROM {table}')
+        if created:
+            self.index_bodies(connection, ((body.article_id, body.text)
+                                           for body in ArticleBody.objects.using(connection.alias).iterator()))
+
+    def index_bodies(self, connection, bodies):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'UPDATE {self.fts_table} SET description = %s WHERE rowid = %s',
+                               [(text, article_id) for article_id, text in bodies])
+
+    @staticmethod
+    def match_expression(query) -> str:
+        """
+        Превращаем ввод юзера в безопасное выражение FTS5: все слова, каждое как префикс
+        :param query: str - поисковый запрос
+        :return: str
+        """
+        return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in re.findall(r'\w+', query))
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        table, fts = Article._meta.db_table, self.fts_table
+        weights = ', '.join(str(weight) for weight in self.weights)
+        matches = RawSQL(f'{table}.id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s)', [expression],
+                         output_field=BooleanField())
+        rank = RawSQL(f'(SELECT -bm25({fts}, {weights}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {table}.id)',
+                      [expression], output_field=FloatField())
+        return queryset.filter(matches).annotate(search_rank=rank)
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    """
+    Выбираем реализацию поиска по СУБД подключения
+    :param using: str - алиас подключения
+    :return: BasicSearchBackend
+    """
+    connection = connections[using]
+    backend_class = BACKENDS.get(connection.vendor, BasicSearchBackend)
+    if not backend_class.is_available(connection):
+        backend_class = BasicSearchBackend
+    return backend_class()
+
+
+def install_search(sender=None, using='default', **kwargs):
+    """
+    Обработчик post_migrate: ставим столбцы, триггеры и индексы поиска
+    """
+    get_search_backend(using).install(connections[using])
@@ -0,0 +1,94 @@
+from functools import partial
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import author_stats, feeds
+from .authentication import token_cache
+from .favourites import SESSION_KEY, merge_favourites
+from .listing_cache import bump_generation
+from .models import Article, Rating, User
+from .suggest import suggest_index
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_listings(sender, **kwargs):
+    """
+    Состав и порядок списков статей изменились - переходим на новое поколение кэша
+    после коммита, чтобы в кэш не попала выдача из незавершённой транзакции
+    Кол-во статей меняется только при добавлении и удалении статьи (post_delete не передаёт created)
+    """
+    counts = sender is Article and kwargs.get('created', True)
+    transaction.on_commit(partial(bump_generation, counts=counts))
+
+
+@receiver(post_save, sender=Article)
+def count_new_article(sender, instance, created, raw=False, **kwargs):
+    """
+    Новая статья - в счётчики автора (в той же транзакции, что и вставка)
+    """
+    if created and not raw:
+        author_stats.add_article(instance.author_id)
+
+
+@receiver(post_delete, sender=Article)
+def uncount_article(sender, instance, **kwargs):
+    author_stats.reconcile_authors([instance.author_id])
+
+
+@receiver(post_save, sender=Article)
+def index_article(sender, instance, raw=False, **kwargs):
+    """
+    Статья (новая или с изменённым заголовком) - в индекс подсказок после коммита
+    """
+    if not raw:
+        transaction.on_commit(partial(suggest_index.add, instance.id, instance.slug, instance.header,
+                                      instance.reviews))
+
+
+@receiver(post_delete, sender=Article)
+def unindex_article(sender, instance, **kwargs):
+    transaction.on_commit(partial(suggest_index.remove, instance.id))
+
+
+@receiver(post_save, sender=Article)
+def refresh_feeds(sender, instance, created, raw=False, **kwargs):
+    """
+    Пересобираем ленты со статьёй после коммита
+    """
+    if not raw:
+        transaction.on_commit(partial(feeds.article_changed, instance.id, instance.author_id, created))
+
+
+@receiver(post_delete, sender=Article)
+def refresh_feeds_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(feeds.article_changed, instance.id, instance.author_id))
+
+
+@receiver(user_logged_in)
+def merge_session_favourites(sender, request, user, **kwargs):
+    """
+    Избранное, собранное анонимно (в сессии), переходит юзеру при входе
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    article_ids = request.session.pop(SESSION_KEY, None)
+    if article_ids:
+        merge_favourites(user, article_ids)
+    request.__dict__.pop('_favourites', None)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_tokens(sender, instance, update_fields=None, **kwargs):
+    """
+    Изменённый (например, деактивированный) или удалённый юзер больше не берётся из кэша токенов
+    Вход меняет только last_login - такие сохранения кэш не сбрасывают
+    """
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        token_cache.forget_user(instance.pk)
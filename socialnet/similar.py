@@ -0,0 +1,159 @@
+"""
+Похожие статьи по совместному добавлению в избранное
+
+Сходство статей a и b - косинусная мера по юзерам, добавившим их в избранное:
+common(a, b) / sqrt(n(a) * n(b)), где common - кол-во юзеров, у которых в избранном обе статьи,
+а n - кол-во юзеров у каждой статьи
+Матрица common считается разреженным произведением X^T X (X - юзеры × статьи) через SciPy,
+без SciPy - перебором пар в избранном каждого юзера
+Изменения избранного помечают статьи в StaleSimilarArticles, refresh() пересчитывает
+только их и статьи, которые добавлены в избранное теми же юзерами
+"""
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Article, Favourites, SimilarArticles, StaleSimilarArticles
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:
+    numpy = sparse = None
+
+
+def mark_stale(article_ids):
+    """
+    Помечаем статьи для пересчёта (вызывается при изменении избранного)
+    :param article_ids: iterable - id статей
+    """
+    StaleSimilarArticles.objects.bulk_create((StaleSimilarArticles(article_id=article_id)
+                                              for article_id in article_ids), ignore_conflicts=True)
+
+
+def get_neighbours(article) -> list:
+    """
+    Похожие статьи, подгруженные вместе со статьёй (select_related('similar'))
+    :param article: Article
+    :return: list - dict по похожим статьям
+    """
+    try:
+        return article.similar.neighbours
+    except SimilarArticles.DoesNotExist:
+        return []
+
+
+def similar_python(pairs, articles, counts, limit, min_common) -> dict:
+    """
+    Похожие статьи перебором пар в избранном каждого юзера
+    :param pairs: list - (id юзера, id статьи) для всех статей в избранном юзеров
+    :param articles: list - id статей, для которых ищем похожие
+    :param counts: dict - {id статьи: кол-во юзеров, добавивших её в избранное}
+    :param limit: int - кол-во похожих статей
+    :param min_common: int - минимальное кол-во общих юзеров
+    :return: dict - {id статьи: [(id похожей статьи, сходство), ...]}
+    """
+    targets = set(articles)
+    by_user = defaultdict(list)
+    for user_id, article_id in pairs:
+        by_user[user_id].append(article_id)
+    common = defaultdict(Counter)
+    for favourites in by_user.values():
+        for article_id in favourites:
+            if article_id in targets:
+                common[article_id].update(favourites)
+    result = {}
+    for article_id, together in common.items():
+        del together[article_id]
+        scored = [(other, shared / math.sqrt(counts[article_id] * counts[other]))
+                  for other, shared in together.items() if shared >= min_common]
+        result[article_id] = sorted(scored, key=lambda item: (-item[1], item[0]))[:limit]
+    return result
+
+
+def similar_numpy(pairs, articles, counts, limit, min_common) -> dict:
+    """
+    То же, что similar_python, разреженными матрицами SciPy
+    """
+    users, columns = {}, {}
+    rows = [users.setdefault(user_id, len(users)) for user_id, _ in pairs]
+    cols = [columns.setdefault(article_id, len(columns)) for _, article_id in pairs]
+    matrix = sparse.csr_matrix((numpy.ones(len(pairs), dtype=numpy.int32), (rows, cols)),
+                               shape=(len(users), len(columns)))
+    ids = numpy.fromiter(columns, dtype=numpy.int64, count=len(columns))
+    totals = numpy.array([counts[article_id] for article_id in columns], dtype=numpy.float64)
+    targets = [columns[article_id] for article_id in articles if article_id in columns]
+    common = (matrix[:, targets].T @ matrix).tocsr()
+    result = {}
+    for row, target in enumerate(targets):
+        others = common.indices[common.indptr[row]:common.indptr[row + 1]]
+        shared = common.data[common.indptr[row]:common.indptr[row + 1]]
+        keep = (others != target) & (shared >= min_common)
+        others, shared = others[keep], shared[keep]
+        scores = shared / numpy.sqrt(totals[target] * totals[others])
+        order = numpy.lexsort((ids[others], -scores))[:limit]
+        result[int(ids[target])] = [(int(ids[others[i]]), float(scores[i])) for i in order]
+    return result
+
+
+find_similar = similar_python if sparse is None else similar_numpy
+
+
+def refresh(full=False, batch_size=1000) -> int:
+    """
+    Пересчитываем похожие статьи для помеченных статей (или для всех при full)
+    Вместе с помеченной статьёй меняется сходство со всеми статьями, у которых с ней общие юзеры,
+    поэтому пересчитываются и они
+    :param full: bool - пересчитать все статьи
+    :param batch_size: int - кол-во статей за раз
+    :return: int - кол-во пересчитанных статей
+    """
+    with transaction.atomic():
+        stale = list(StaleSimilarArticles.objects.values_list('article_id', flat=True))
+        StaleSimilarArticles.objects.filter(article_id__in=stale).delete()
+    try:
+        if full:
+            targets = set(Favourites.objects.values_list('article_id', flat=True).distinct())
+            targets.update(SimilarArticles.objects.values_list('article_id', flat=True))
+        else:
+            users = Favourites.objects.filter(article_id__in=stale).values('who')
+            targets = set(stale)
+            targets.update(Favourites.objects.filter(who__in=users).values_list('article_id', flat=True).distinct())
+        counts = dict(Favourites.objects.order_by().values_list('article_id').annotate(total=Count('id')))
+        targets = sorted(targets)
+        for start in range(0, len(targets), batch_size):
+            save_neighbours(targets[start:start + batch_size], counts)
+    except Exception:
+        # Возвращаем пометки, чтобы статьи пересчитались при следующем запуске
+        mark_stale(Article.objects.filter(id__in=stale).values_list('id', flat=True))
+        raise
+    return len(targets)
+
+
+def save_neighbours(articles, counts):
+    """
+    Считаем и сохраняем похожие статьи для пачки статей
+    :param articles: list - id статей
+    :param counts: dict - {id статьи: кол-во юзеров, добавивших её в избранное}
+    """
+    users = Favourites.objects.filter(article_id__in=articles).values('who')
+    pairs = list(Favourites.objects.filter(who__in=users).values_list('who_id', 'article_id'))
+    neighbours = {}
+    if pairs:
+        neighbours = find_similar(pairs, articles, counts, getattr(settings, 'SIMILAR_ARTICLES_COUNT', 5),
+                                  getattr(settings, 'SIMILAR_ARTICLES_MIN_COMMON', 2))
+    linked = {other for scored in neighbours.values() for other, _ in scored}
+    headers = {article_id: (slug, header) for article_id, slug, header
+               in Article.objects.filter(id__in=linked).values_list('id', 'slug', 'header')}
+    rows = []
+    for article_id, scored in neighbours.items():
+        similar = [{'id': other, 'slug': headers[other][0], 'header': headers[other][1], 'score': round(score, 4)}
+                   for other, score in scored if other in headers]
+        if similar:
+            rows.append(SimilarArticles(article_id=article_id, neighbours=similar))
+    with transaction.atomic():
+        SimilarArticles.objects.filter(article_id__in=articles).delete()
+        SimilarArticles.objects.bulk_create(rows, ignore_conflicts=True)
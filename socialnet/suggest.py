@@ -0,0 +1,284 @@
+"""
+Подсказки при вводе в поле поиска статьи (поиск по префиксу slug и заголовка)
+
+Вместо icontains на каждое нажатие клавиши подсказки ищутся в памяти процесса:
+отсортированный список нормализованных ключей (slug и заголовок) и параллельный массив id статей,
+префикс находится двоичным поиском, совпавшие статьи ранжируются по просмотрам
+Для коротких префиксов совпадений тысячи, поэтому лучшие статьи префикса с большим диапазоном ключей
+запоминаются (_top), а изменение статьи сбрасывает запомненное только для префиксов её ключей
+Индекс строится из потокового values_list в каждом процессе при первом запросе подсказок
+(или заранее: warm() из post_fork-хука сервера), сигналы Article поддерживают его в актуальном состоянии
+в своём процессе, а изменения из других процессов и массовых вставок подхватывает перестроение
+раз в SUGGEST_REBUILD_INTERVAL
+Просмотры в индексе приблизительные: прирост приходит только от сброса счётчика своего процесса
+"""
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Article
+
+logger = logging.getLogger(__name__)
+
+# Символ больше любого другого: верхняя граница диапазона ключей с префиксом
+MAX_CHAR = '\U0010ffff'
+
+
+def normalize(text) -> str:
+    """
+    Ключ индекса: без учёта регистра, ё = е, пробелы схлопнуты
+    :param text: str
+    :return: str
+    """
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def keys_of(slug, header) -> set:
+    """
+    :return: set - ключи индекса для статьи
+    """
+    return {key for key in (normalize(slug), normalize(header)) if key}
+
+
+class SuggestIndex:
+    """
+    Префиксный индекс статей: _keys - отсортированные ключи, _ids - id статьи для ключа с тем же номером,
+    _articles - {id статьи: (просмотры, slug, заголовок)},
+    _top - {префикс: (сколько статей запрошено, id лучших статей)} для префиксов с диапазоном больше top_threshold
+    Изменения, пришедшие во время перестроения, повторяются на новом индексе перед подменой
+    """
+    top_threshold = 256
+
+    def __init__(self, rebuild_interval=None):
+        self.rebuild_interval = rebuild_interval
+        self._reset()
+
+    def _reset(self):
+        """
+        Пустой индекс с новыми блокировками
+        Вызывается и в дочернем процессе после fork: унаследованные от родителя блокировки
+        могли быть захвачены его потоками, а индекс процесс строит сам
+        """
+        self._keys = []
+        self._ids = array('q')
+        self._articles = {}
+        self._top = {}
+        self._built = None
+        self._changes = None
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._built is not None
+
+    def __len__(self) -> int:
+        return len(self._articles)
+
+    def build(self, batch_size=2000):
+        """
+        Строим индекс заново по всем статьям, читая их пачками
+        :param batch_size: int - кол-во статей, читаемых из БД за раз
+        """
+        with self._build_lock:
+            self._build(batch_size)
+
+    def _build(self, batch_size):
+        with self._lock:
+            self._changes = []
+        try:
+            entries, articles = [], {}
+            rows = Article.objects.order_by().values_list('id', 'slug', 'header', 'reviews')
+            for article_id, slug, header, reviews in rows.iterator(chunk_size=batch_size):
+                articles[article_id] = (reviews, slug, header)
+                entries.extend((key, article_id) for key in keys_of(slug, header))
+            entries.sort()
+            keys, ids = [key for key, _ in entries], array('q', (article_id for _, article_id in entries))
+            with self._lock:
+                self._keys, self._ids, self._articles, self._top = keys, ids, articles, {}
+                for change in self._changes:
+                    change[0](*change[1:])
+                self._built = time.monotonic()
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def warm(self):
+        """
+        Строим индекс в фоне (например, из post_fork-хука сервера), запросы до окончания сборки ждут её
+        Не вызывается при импорте wsgi/asgi: при --preload поток и соединение с БД достались бы родителю
+        """
+        if not self.built:
+            threading.Thread(target=self._rebuild, name='suggest-build', daemon=True).start()
+
+    def ensure_fresh(self):
+        """
+        Первый запрос строит индекс сам, устаревший индекс перестраивается в фоне,
+        а запросы тем временем обслуживает прежний
+        """
+        if not self.built:
+            with self._build_lock:
+                if not self.built:
+                    self._build(getattr(settings, 'SUGGEST_BATCH_SIZE', 2000))
+            return
+        interval = self.rebuild_interval or getattr(settings, 'SUGGEST_REBUILD_INTERVAL', 600)
+        if time.monotonic() - self._built > interval and not self._build_lock.locked():
+            threading.Thread(target=self._rebuild, name='suggest-rebuild', daemon=True).start()
+
+    def _rebuild(self):
+        if not self._build_lock.acquire(blocking=False):
+            return
+        try:
+            self._build(getattr(settings, 'SUGGEST_BATCH_SIZE', 2000))
+        except Exception:
+            logger.exception('Не удалось построить индекс подсказок')
+        finally:
+            self._build_lock.release()
+            close_old_connections()
+
+    def _apply(self, *change):
+        """
+        Изменение применяем только к построенному (или строящемуся) индексу:
+        в процессах без подсказок (команды, воркеры) индекс не занимает память
+        """
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(change)
+            elif not self.built:
+                return
+            change[0](*change[1:])
+
+    def add(self, article_id, slug, header, reviews):
+        """
+        Новая или изменённая статья
+        """
+        self._apply(self._insert, article_id, slug, header, reviews)
+
+    def remove(self, article_id):
+        self._apply(self._delete, article_id)
+
+    def add_reviews(self, counts):
+        """
+        Прирост просмотров после сброса счётчика (на ранжирование, поэтому при перестроении не повторяется)
+        Просмотры только растут, поэтому запомненные лучшие статьи префиксов не сбрасываются, а поправляются:
+        статья может только подняться внутри списка или войти в него
+        :param counts: dict - {id статьи: прирост просмотров}
+        """
+        with self._lock:
+            for article_id, amount in counts.items():
+                entry = self._articles.get(article_id)
+                if entry is None:
+                    continue
+                self._articles[article_id] = (entry[0] + amount, *entry[1:])
+                for key in keys_of(entry[1], entry[2]):
+                    for length in range(1, len(key) + 1):
+                        cached = self._top.get(key[:length])
+                        if cached is not None:
+                            self._top[key[:length]] = (cached[0], self._rerank(cached[0], cached[1], article_id))
+
+    def _rank(self, article_id) -> tuple:
+        return self._articles[article_id][0], -article_id
+
+    def _rerank(self, limit, top, article_id) -> list:
+        """
+        :return: list - лучшие статьи префикса после роста просмотров статьи article_id
+        """
+        if article_id not in top:
+            if len(top) == limit and self._rank(article_id) <= self._rank(top[-1]):
+                return top
+            top = [*top, article_id]
+        return sorted(top, key=self._rank, reverse=True)[:limit]
+
+    def _forget_top(self, keys):
+        """
+        Сбрасываем запомненные лучшие статьи для всех префиксов ключей
+        """
+        for key in keys:
+            for length in range(1, len(key) + 1):
+                self._top.pop(key[:length], None)
+
+    def _insert(self, article_id, slug, header, reviews):
+        self._delete(article_id)
+        self._articles[article_id] = (reviews, slug, header)
+        keys = keys_of(slug, header)
+        self._forget_top(keys)
+        for key in keys:
+            position = bisect_right(self._keys, key)
+            self._keys.insert(position, key)
+            self._ids.insert(position, article_id)
+
+    def _delete(self, article_id):
+        entry = self._articles.pop(article_id, None)
+        if entry is None:
+            return
+        keys = keys_of(entry[1], entry[2])
+        self._forget_top(keys)
+        for key in keys:
+            position = bisect_left(self._keys, key)
+            while position < len(self._keys) and self._keys[position] == key:
+                if self._ids[position] == article_id:
+                    del self._keys[position]
+                    del self._ids[position]
+                    break
+                position += 1
+
+    def suggest(self, prefix, limit) -> list:
+        """
+        Статьи, slug или заголовок которых начинается с prefix, по убыванию просмотров
+        :param prefix: str - введённый текст
+        :param limit: int - кол-во подсказок
+        :return: list - dict {'id', 'slug', 'header', 'reviews'}
+        """
+        prefix = normalize(prefix)
+        if len(prefix) < getattr(settings, 'SUGGEST_MIN_LENGTH', 2):
+            return []
+        self.ensure_fresh()
+        with self._lock:
+            articles = self._articles
+            return [{'id': article_id, 'slug': articles[article_id][1], 'header': articles[article_id][2],
+                     'reviews': articles[article_id][0]} for article_id in self._top_ids(prefix, limit)]
+
+    def _top_ids(self, prefix, limit) -> list:
+        cached = self._top.get(prefix)
+        if cached is not None and (cached[0] >= limit or len(cached[1]) < cached[0]):
+            return cached[1][:limit]
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + MAX_CHAR, start)
+        # У статьи не больше двух ключей, поэтому среди 2 * limit лучших ключей есть limit разных статей
+        ranked = heapq.nlargest(2 * limit, self._ids[start:end], key=self._rank)
+        top = list(dict.fromkeys(ranked))[:limit]
+        if end - start > self.top_threshold:
+            self._top[prefix] = (limit, top)
+        return top
+
+    def memory_usage(self) -> int:
+        """
+        Приблизительный объём индекса в памяти (общие для нескольких мест строки считаются один раз)
+        :return: int - байт
+        """
+        with self._lock:
+            seen = set()
+            total = sum(sys.getsizeof(container) for container in (self._keys, self._ids, self._articles, self._top))
+            objects = [*self._keys]
+            for prefix, entry in self._top.items():
+                objects.extend((prefix, entry, entry[1]))
+            for article_id, entry in self._articles.items():
+                objects.extend((article_id, entry, *entry))
+            for obj in objects:
+                if id(obj) not in seen:
+                    seen.add(id(obj))
+                    total += sys.getsizeof(obj)
+            return total
+
+
+suggest_index = SuggestIndex()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=suggest_index._reset)
@@ -1,3 +1,1571 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from urllib.parse import urlencode
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock, skipUnless
+from uuid import uuid4
 
-# Create your tests here.
+import jwt
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Count, Sum
+from django.db.models.query import QuerySet
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse, QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from .authentication import TokenCache, token_cache
+from .bodies import save_bodies
+from .counters import CacheStore, LocalMemoryStore, ViewCounter, view_counter
+from .favourites import SESSION_KEY, merge_favourites
+from .forms import ArticleForm
+from .listing_cache import BUMPED_KEY, ListingCache, bump_generation, get_generation
+from .metrics import registry
+from .management.commands.benchmark_async import build_urlconf
+from .models import (Article, ArticleActivity, ArticleBody, AuthorStats, Favourites, Rating, SimilarArticles,
+                     StaleSimilarArticles, User)
+from .pagination import CursorPaginator, InvalidCursor, encode_cursor, format_count
+from .ratings import rate_article
+from .routers import PrimaryAfterWriteMiddleware, ReplicaRouter, query_load, routing_state, use_primary
+from .search import BasicSearchBackend, PostgresSearchBackend, SqliteSearchBackend, get_search_backend
+from .suggest import SuggestIndex, suggest_index
+from .throttle import TokenBucket, account_throttle, client_ip, ip_throttle
+from . import author_stats, feeds, similar, trending
+
+
+class ListQueryCountMixin:
+    """
+    Помощник для тестов страниц со списками статей:
+    кол-во SQL-запросов страницы должно быть фиксированным и не зависеть от размера страницы
+    Каждый запрос делается с пустым кэшем
+    """
+    page_sizes = (10, 50, 100)
+
+    def assertListQueries(self, expected, url, params=None, page_sizes=None):
+        """
+        Запрашиваем страницу при разных размерах страницы и сверяем кол-во запросов
+        :param expected: int - ожидаемое кол-во запросов
+        :param url: str - адрес страницы
+        :param params: dict - GET-параметры
+        :param page_sizes: iterable - проверяемые размеры страницы
+        """
+        for page_size in page_sizes or self.page_sizes:
+            self.client.cookies['paginate_by'] = str(page_size)
+            cache.clear()
+            with self.subTest(page_size=page_size), self.assertNumQueries(expected):
+                response = self.client.get(url, params or {})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['articles']), page_size)
+
+
+def set_session_favourites(client, articles):
+    """
+    Кладём статьи в избранное анонима (в сессию тестового клиента)
+    """
+    session = client.session
+    session[SESSION_KEY] = [article.id for article in articles]
+    session.save()
+    return session.session_key
+
+
+def create_articles(count, prefix='article'):
+    """
+    Создаём статьи, у каждой свой автор
+    :param count: int - кол-во статей
+    :param prefix: str - префикс slug
+    :return: list - статьи
+    """
+    authors = User.objects.bulk_create(
+        User(username=f'{prefix[:4]}{i}', email=f'{prefix}{i}@example.com') for i in range(count)
+    )
+    articles = Article.objects.bulk_create(
+        Article(slug=f'{prefix}-{i}', header=f'Статья {i}', author=author, summary='Кратко', description='Подробно')
+        for i, author in enumerate(authors)
+    )
+    save_bodies(articles)
+    return articles
+
+
+class ViewCounterTest(TestCase):
+    """
+    Отдельный счётчик без фонового потока: сбрасываем его явно
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(3)
+
+    def setUp(self):
+        cache.clear()
+        view_counter.flush()
+
+    def make_counter(self, store) -> ViewCounter:
+        counter = ViewCounter(store=store)
+        patcher = mock.patch.object(counter, '_ensure_worker')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return counter
+
+    def test_flush_groups_updates_by_amount(self):
+        counter = self.make_counter(LocalMemoryStore())
+        first, second, third = self.articles
+        for article, amount in ((first, 2), (second, 2), (third, 5)):
+            counter.incr(article.id, amount)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(counter.flush(), 3)
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "socialnet_article"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(dict(Article.objects.values_list('id', 'reviews')), {first.id: 2, second.id: 2, third.id: 5})
+        self.assertEqual(counter.flush(), 0)
+
+    def test_failed_flush_keeps_views(self):
+        counter = self.make_counter(LocalMemoryStore())
+        counter.incr(self.articles[0].id, 4)
+        with mock.patch('socialnet.trending.record_views', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            counter.flush()
+        self.assertEqual(counter.store.drain(), {self.articles[0].id: 4})
+
+    def at_epoch(self, epoch, interval=5):
+        """
+        Часы в середине эпохи epoch
+        """
+        patcher = mock.patch('socialnet.counters.time.time', return_value=(epoch + 0.5) * interval)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return patcher
+
+    def test_cache_store_epochs(self):
+        store = CacheStore(key_prefix='test-views', interval=5)
+        patcher = self.at_epoch(100)
+        store.incr(1)
+        store.incr(1, 2)
+        store.incr(2)
+        # Эпоха забирается только через интервал после закрытия
+        self.assertEqual(store.drain(), {})
+        patcher.stop()
+        patcher = self.at_epoch(101)
+        store.incr(1)
+        self.assertEqual(store.drain(), {})
+        patcher.stop()
+        self.at_epoch(102)
+        self.assertEqual(store.drain(), {1: 3, 2: 1})
+        self.assertEqual(store.drain(final=True), {1: 1})
+        self.assertEqual(store.drain(final=True), {})
+
+    def test_cache_store_counter_evicted(self):
+        store = CacheStore(key_prefix='test-views', interval=5)
+        self.at_epoch(7)
+        store.incr(1)
+        incr, evicted = store.cache.incr, []
+
+        def evicting_incr(key, delta=1, version=None):
+            # Счётчик пропадает между add и incr
+            if ':count:' in key and not evicted:
+                evicted.append(key)
+                store.cache.delete(key)
+            return incr(key, delta, version)
+
+        with mock.patch.object(store.cache, 'incr', evicting_incr):
+            store.incr(1, 5)
+        self.assertEqual(evicted, ['test-views:7:count:1'])
+        self.assertEqual(store.drain(final=True), {1: 5})
+
+    def test_cache_store_shared_by_processes(self):
+        # Два процесса с общим кэшем: частые сбросы не сокращают задержку перед заборкой эпохи,
+        # а закрытую эпоху забирает только один из них
+        counters = [self.make_counter(CacheStore(key_prefix='test-views', interval=5)) for _ in range(2)]
+        patcher = self.at_epoch(50)
+        counters[0].incr(self.articles[0].id, 2)
+        counters[1].incr(self.articles[0].id, 3)
+        for _ in range(3):
+            self.assertEqual([counter.flush() for counter in counters], [0, 0])
+        patcher.stop()
+        patcher = self.at_epoch(51)
+        self.assertEqual([counter.flush() for counter in counters], [0, 0])
+        patcher.stop()
+        self.at_epoch(52)
+        self.assertEqual([counter.flush() for counter in counters], [1, 0])
+        self.assertEqual(Article.objects.get(id=self.articles[0].id).reviews, 5)
+
+    def test_flush_views_command(self):
+        with mock.patch('socialnet.management.commands.flush_views.view_counter',
+                        self.make_counter(LocalMemoryStore())), self.assertRaises(CommandError):
+            call_command('flush_views', stdout=io.StringIO())
+        counter = self.make_counter(CacheStore(key_prefix='test-views'))
+        counter.incr(self.articles[1].id, 3)
+        out = io.StringIO()
+        with mock.patch('socialnet.management.commands.flush_views.view_counter', counter):
+            call_command('flush_views', stdout=out)
+        self.assertIn('Обновлено статей: 1', out.getvalue())
+        self.assertEqual(Article.objects.get(id=self.articles[1].id).reviews, 3)
+
+
+class RatingAggregatesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(3)
+        cls.readers = User.objects.bulk_create(User(username=f'rate{i}', email=f'rate{i}@example.com')
+                                               for i in range(2))
+
+    def aggregates(self, article) -> tuple:
+        return Article.objects.values_list('rating_sum', 'rating_count', 'rating').get(id=article.id)
+
+    def test_rerating_applies_deltas(self):
+        article = self.articles[0]
+        first, second = self.readers
+        self.assertTrue(rate_article(first, article.id, Rating.RatingChoices.EXCELLENT))
+        self.assertTrue(rate_article(second, article.id, Rating.RatingChoices.NORMAL))
+        self.assertEqual(self.aggregates(article), (1, 2, 0.5))
+        # Та же оценка повторно ничего не меняет
+        version = Article.objects.get(id=article.id).version
+        self.assertFalse(rate_article(first, article.id, Rating.RatingChoices.EXCELLENT))
+        self.assertEqual(Article.objects.get(id=article.id).version, version)
+        # Смена оценки меняет сумму, но не кол-во
+        self.assertTrue(rate_article(first, article.id, Rating.RatingChoices.LOW))
+        self.assertEqual(self.aggregates(article), (-1, 2, -0.5))
+        self.assertEqual(Rating.objects.filter(article=article).count(), 2)
+
+    def test_concurrent_first_vote(self):
+        article = self.articles[1]
+        rate_article(self.readers[0], article.id, Rating.RatingChoices.LOW)
+        # Параллельный запрос уже создал оценку, а этот её не увидел: INSERT упирается в unique_together
+        with mock.patch.object(QuerySet, 'first', return_value=None):
+            self.assertTrue(rate_article(self.readers[0], article.id, Rating.RatingChoices.EXCELLENT))
+        self.assertEqual(self.aggregates(article), (1, 1, 1.0))
+        self.assertEqual(Rating.objects.get(article=article).mark, Rating.RatingChoices.EXCELLENT)
+
+    def test_reconcile_fixes_drift(self):
+        first, second, third = self.articles
+        rate_article(self.readers[0], first.id, Rating.RatingChoices.EXCELLENT)
+        rate_article(self.readers[1], first.id, Rating.RatingChoices.EXCELLENT)
+        rate_article(self.readers[0], second.id, Rating.RatingChoices.LOW)
+        Article.objects.filter(id=first.id).update(rating_sum=7, rating_count=1, rating=7.0)
+        Article.objects.filter(id=third.id).update(rating_sum=3, rating_count=3, rating=1.0)
+        out = io.StringIO()
+        call_command('reconcile_ratings', batch_size=2, stdout=out)
+        self.assertIn('Пересчитано статей: 3', out.getvalue())
+        self.assertEqual([self.aggregates(article) for article in self.articles],
+                         [(2, 2, 1.0), (-1, 1, -1.0), (0, 0, 0.0)])
+
+
+class SearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(4)
+        for article, header, summary in zip(cls.articles,
+                                            ('Оптимизация запросов', 'Кэш и очереди', 'Новости недели', 'Отпуск'),
+                                            ('Индексы', 'Оптимизация кэша', 'Коротко', 'Море')):
+            Article.objects.filter(id=article.id).update(header=header, summary=summary)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query) -> list:
+        return list(get_search_backend().search(Article.objects.all(), query).order_by('-search_rank', 'id')
+                    .values_list('id', flat=True))
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 - поиск SQLite')
+    def test_fts5_match_and_rank(self):
+        self.assertIsInstance(get_search_backend(), SqliteSearchBackend)
+        first, second, third, _ = self.articles
+        # Совпадение в заголовке весит больше, чем в кратком содержании; слова ищутся по префиксу
+        self.assertEqual(self.search('оптимизац'), [first.id, second.id])
+        self.assertEqual(self.search('оптимизация кэш'), [second.id])
+        self.assertEqual(self.search('"*) OR'), [])
+        Article.objects.filter(id=third.id).update(header='Оптимизация недели')
+        self.assertIn(third.id, self.search('оптимизация'))
+        Article.objects.filter(id=first.id).delete()
+        self.assertEqual(self.search('индексы'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'tsvector - поиск PostgreSQL')
+    def test_tsvector_match_and_reinstall(self):
+        backend = get_search_backend()
+        self.assertIsInstance(backend, PostgresSearchBackend)
+        first, second, third, _ = self.articles
+        self.assertEqual(self.search('оптимизация'), [first.id, second.id])
+        self.assertEqual(self.search('оптимизация кэш'), [second.id])
+        Article.objects.filter(id=third.id).update(header='Оптимизация недели')
+        self.assertIn(third.id, self.search('оптимизация'))
+        # Повторный migrate не трогает схему и не переписывает строки статей
+        with CaptureQueriesContext(connection) as queries:
+            backend.install(connection)
+        statements = ' '.join(query['sql'] for query in queries).upper()
+        for keyword in ('ALTER TABLE', 'CREATE TRIGGER', 'CREATE OR REPLACE', 'UPDATE '):
+            self.assertNotIn(keyword, statements)
+
+    def test_fallback_without_fts5(self):
+        with mock.patch.object(SqliteSearchBackend, 'is_available', return_value=False):
+            self.assertIsInstance(get_search_backend(), BasicSearchBackend)
+            # LIKE в SQLite не различает регистр только для латиницы
+            self.assertEqual(sorted(self.search('Оптимизация')), [self.articles[0].id, self.articles[1].id])
+            self.assertEqual(self.search('Оптимизация Индексы'), [self.articles[0].id])
+
+    def test_fulltext_mode_in_listing(self):
+        params = {'date_order': 'header', 'rating_order': 'header', 'search_mode': 'fulltext',
+                  'filter_by_slug': 'Кэш'}
+        response = self.client.get(reverse('index'), params)
+        self.assertEqual([article.id for article in response.context['articles']],
+                         [self.articles[1].id])
+
+
+class ArticleListQueriesTest(ListQueryCountMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(120)
+
+    def test_index_pages(self):
+        self.assertListQueries(2, reverse('index'))
+
+    def test_index_filtered_and_sorted(self):
+        params = {'date_order': '-date', 'rating_order': '-rating', 'filter_by_slug': 'article'}
+        self.assertListQueries(2, reverse('index'), params)
+
+    def test_index_cursor_pages(self):
+        self.client.cookies['pagination'] = 'cursor'
+        # Страница и время последнего изменения выдачи для ETag (при пустом кэше)
+        self.assertListQueries(2, reverse('index'))
+
+    def test_anonymous_favourites(self):
+        set_session_favourites(self.client, self.articles)
+        # Сессия и страница: кол-во статей известно из набора id избранного
+        self.assertListQueries(2, reverse('favourites'))
+
+    def test_list_skips_description(self):
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'Подробно')
+        self.assertContains(response, 'Кратко')
+
+
+class CursorPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(7)
+        for rating, article in zip((3, 1, 4, 1, 5, 2, 2), cls.articles):
+            Article.objects.filter(id=article.id).update(rating=rating)
+
+    def setUp(self):
+        cache.clear()
+
+    def paginator(self, *ordering) -> CursorPaginator:
+        return CursorPaginator(Article.objects.order_by(*ordering), 3)
+
+    def test_forward_and_back(self):
+        paginator = self.paginator('-rating', '-date')
+        expected = list(Article.objects.order_by('-rating', '-id').values_list('id', flat=True))
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([article.id for article in page])
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(pages, [expected[:3], expected[3:6], expected[6:]])
+        self.assertFalse(paginator.page().has_previous())
+
+        previous = paginator.page(page.previous_cursor)
+        self.assertEqual([article.id for article in previous], expected[3:6])
+        self.assertTrue(previous.has_next() and previous.has_previous())
+        self.assertEqual([article.id for article in paginator.page(previous.previous_cursor)], expected[:3])
+
+    def test_tampered_cursor(self):
+        paginator = self.paginator('-rating')
+        for cursor in ('garbage!', encode_cursor([1], 'next'), encode_cursor([1, 2], 'up'),
+                       encode_cursor(['abc', 1], 'next'), encode_cursor([None, 1], 'next'),
+                       encode_cursor([1, [2]], 'prev'), encode_cursor([1, 10 ** 30], 'next')):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+
+        self.client.cookies['pagination'] = 'cursor'
+        params = {'date_order': 'header', 'rating_order': '-rating', 'filter_by_slug': ''}
+        response = self.client.get(reverse('index'), {**params, 'cursor': encode_cursor(['abc', 'x', 1], 'next')})
+        self.assertEqual(response.status_code, 404)
+
+
+class ListingCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(30)
+
+    def setUp(self):
+        cache.clear()
+        # Cookie сессии выключает полностраничный кэш, проверяем именно кэш выдачи
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+
+    def test_cached_page_loads_by_ids(self):
+        params = {'date_order': 'date', 'rating_order': 'header', 'filter_by_slug': ''}
+        first = self.client.get(reverse('index'), params)
+        with self.assertNumQueries(1):
+            second = self.client.get(reverse('index'), params)
+        self.assertEqual(list(first.context['articles']), list(second.context['articles']))
+        self.assertEqual(second.context['page_obj'].paginator.count, 30)
+
+    def test_new_article_invalidates_listing(self):
+        params = {'date_order': '-date', 'rating_order': 'header', 'filter_by_slug': ''}
+        self.client.get(reverse('index'), params)
+        with self.captureOnCommitCallbacks(execute=True):
+            article = Article.objects.create(slug='fresh', header='Свежая', author=self.articles[0].author,
+                                             summary='Кратко', description='Подробно')
+        response = self.client.get(reverse('index'), params)
+        self.assertEqual(response.context['articles'][0], article)
+        self.assertEqual(response.context['page_obj'].paginator.count, 31)
+
+    def test_rating_keeps_cached_count(self):
+        params = {'date_order': '-date', 'rating_order': '-rating', 'filter_by_slug': 'article'}
+        self.client.get(reverse('index'), params)
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(user=self.articles[1].author, article=self.articles[0], mark=1)
+        # Порядок выдачи изменился, а кол-во статей - нет: время изменения для ETag и страница, без COUNT(*)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'), params)
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('COUNT', ' '.join(query['sql'] for query in queries))
+        self.assertEqual(response.context['page_obj'].paginator.count, 30)
+
+    def test_approximate_count(self):
+        params = {'date_order': 'date', 'rating_order': 'header', 'filter_by_slug': ''}
+        ListingCache(QueryDict(urlencode(params)), 10).set_count(1234567, approximate=True)
+        response = self.client.get(reverse('index'), params)
+        self.assertContains(response, 'of ~123.5K')
+        self.assertContains(response, 'Статей: ~1.2M')
+        self.assertNotContains(response, 'last &raquo;')
+        # Настоящих статей меньше оценки: дальние страницы пустые, но не 404
+        response = self.client.get(reverse('index'), dict(params, page=5))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['articles']), 0)
+
+    def test_format_count(self):
+        self.assertEqual([format_count(count, approximate=True) for count in (950, 1000, 12345, 1250000)],
+                         ['~950', '~1K', '~12.3K', '~1.2M'])
+        self.assertEqual(format_count(1250000), '1250000')
+
+
+class AnonymousPageCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_detail_served_from_cache(self):
+        url = reverse('detail', args=[self.articles[0].slug])
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertNotIn('Cookie', second.get('Vary', ''))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=second['ETag']).status_code, 304)
+
+    def test_logged_in_user_bypasses_cache(self):
+        self.client.get(reverse('index'))
+        self.client.force_login(self.articles[0].author)
+        response = self.client.get(reverse('index'))
+        self.assertIsNotNone(response.context)
+
+    def test_fragment_reports_liked_state(self):
+        article = self.articles[1]
+        set_session_favourites(self.client, [article])
+        data = self.client.get(reverse('fragment'), {'article': article.id}).json()
+        self.assertFalse(data['authenticated'])
+        self.assertTrue(data['liked'])
+        data = self.client.get(reverse('fragment'), {'article': self.articles[2].id}).json()
+        self.assertFalse(data['liked'])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class DetailArticleTest(TransactionTestCase):
+    """
+    Страница статьи под многопоточным воркером: ответы не смешиваются между потоками,
+    а все просмотры доходят до БД
+    Чтение - из основной базы: тест про страницу статьи, а не про реплики (см. ReplicaRoutingRequestsTest)
+    Просмотры копит отдельный счётчик без фонового сброса: поток общего счётчика писал бы в SQLite
+    одновременно с потоками теста (database table is locked)
+    """
+
+    def setUp(self):
+        cache.clear()
+        view_counter.flush(final=True)
+        self.view_counter = ViewCounter(store=LocalMemoryStore())
+        for patcher in (mock.patch.object(self.view_counter, '_ensure_worker'),
+                        mock.patch('socialnet.views.view_counter', self.view_counter),
+                        mock.patch('socialnet.middleware.view_counter', self.view_counter)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.articles = create_articles(5)
+
+    def test_detail_single_query(self):
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+        article = self.articles[0]
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('detail', args=[article.slug]))
+        self.assertEqual(list(response.context['articles']), [article])
+        self.assertEqual(self.client.get(reverse('detail', args=['missing'])).status_code, 404)
+
+    def test_concurrent_requests(self):
+        def worker(seed):
+            client = Client()
+            client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+            picked = random.Random(seed).choices(self.articles, k=25)
+            try:
+                for article in picked:
+                    response = client.get(reverse('detail', args=[article.slug]))
+                    # response.context собирается глобальным сигналом, поэтому сверяем сам ответ
+                    self.assertEqual(response.article_id, article.id)
+                    self.assertContains(response, f'>{article.header}</a>')
+            finally:
+                connection.close()
+            return picked
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            views = Counter(article.id for picked in executor.map(worker, range(16)) for article in picked)
+        self.view_counter.flush(final=True)
+        self.assertEqual(dict(Article.objects.filter(reviews__gt=0).values_list('id', 'reviews')), dict(views))
+
+
+class FavouritesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(3)
+        cls.user = cls.articles[0].author
+        cls.user.set_password('password')
+        cls.user.save()
+
+    def setUp(self):
+        cache.clear()
+
+    def toggle(self, article, like=True):
+        params = {'favourite': '1', 'like': 'on'} if like else {'favourite': '1'}
+        return self.client.get(reverse('detail', args=[article.slug]), params)
+
+    def favourites_counts(self):
+        return list(Article.objects.order_by('id').values_list('favourites_count', flat=True))
+
+    def test_anonymous_favourites_merge_on_login(self):
+        first, second, third = self.articles
+        Favourites.objects.create(who=self.user, article=second)
+        Article.objects.filter(id=second.id).update(favourites_count=1)
+        for article in (first, second, third):
+            self.toggle(article)
+        self.toggle(third, like=False)
+        self.assertEqual(self.client.session[SESSION_KEY], [first.id, second.id])
+
+        self.client.post(reverse('login'), {'username': self.user.email, 'password': 'password'})
+        self.assertNotIn(SESSION_KEY, self.client.session)
+        self.assertEqual(set(self.user.favourites_set.values_list('article_id', flat=True)), {first.id, second.id})
+        self.assertEqual(self.favourites_counts(), [1, 1, 0])
+
+    def test_user_favourites_cached(self):
+        self.client.force_login(self.user)
+        self.toggle(self.articles[2])
+        self.assertEqual(self.favourites_counts(), [0, 0, 1])
+        self.client.get(reverse('fragment'), {'article': self.articles[2].id})
+        # Сессия и юзер, набор id избранного - из кэша
+        with self.assertNumQueries(2):
+            data = self.client.get(reverse('fragment'), {'article': self.articles[2].id}).json()
+        self.assertTrue(data['liked'])
+        self.toggle(self.articles[2], like=False)
+        self.assertFalse(self.client.get(reverse('fragment'), {'article': self.articles[2].id}).json()['liked'])
+        self.assertEqual(self.favourites_counts(), [0, 0, 0])
+
+    def test_legacy_cookie_moves_to_session(self):
+        first, second, _ = self.articles
+        self.client.cookies['likes'] = f'{first.id},{second.id},999999,x,'
+        response = self.client.get(reverse('fragment'), {'article': first.id})
+        self.assertTrue(response.json()['liked'])
+        self.assertEqual(response.cookies['likes'].value, '')
+        self.assertEqual(self.client.session[SESSION_KEY], [first.id, second.id])
+        self.assertEqual(self.favourites_counts(), [0, 0, 0])
+
+    def test_legacy_cookie_moves_to_user(self):
+        first, second, third = self.articles
+        self.client.force_login(self.user)
+        self.toggle(first)
+        self.client.cookies['likes'] = f'{first.id},{second.id},'
+        response = self.toggle(third)
+        self.assertEqual(response.cookies['likes'].value, '')
+        self.assertEqual(set(self.user.favourites_set.values_list('article_id', flat=True)),
+                         {first.id, second.id, third.id})
+        self.assertEqual(self.favourites_counts(), [1, 1, 1])
+
+    def test_merge_counts_only_inserted(self):
+        first, second, _ = self.articles
+        self.assertEqual(merge_favourites(self.user, [first.id, second.id]), 2)
+        self.assertEqual(merge_favourites(self.user, [first.id, second.id]), 0)
+        self.assertEqual(self.favourites_counts(), [1, 1, 0])
+
+    def test_reconcile_favourites(self):
+        first, second, _ = self.articles
+        Favourites.objects.create(who=self.user, article=first)
+        Article.objects.filter(id=second.id).update(favourites_count=5)
+        out = io.StringIO()
+        call_command('reconcile_favourites', batch_size=2, stdout=out)
+        self.assertIn('Пересчитано статей: 3', out.getvalue())
+        self.assertEqual(self.favourites_counts(), [1, 0, 0])
+
+
+class JWTAuthenticationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader', email='reader@example.com')
+        cls.user.set_password('password')
+        cls.user.save()
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+
+    def test_login_sets_token_cookie(self):
+        response = self.client.post(reverse('login'), {'username': self.user.email, 'password': 'password'})
+        token = response.cookies[settings.JWT_COOKIE_NAME].value
+        client = Client()
+        client.cookies[settings.JWT_COOKIE_NAME] = token
+        with self.assertNumQueries(1):
+            self.assertTrue(client.get(reverse('fragment')).json()['authenticated'])
+        # Повторный запрос: юзер из кэша проверенных токенов, без сессии и БД
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get(reverse('fragment')).json()['username'], self.user.username)
+
+    def test_bearer_refresh(self):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {self.user.token}'}
+        response = self.client.post(reverse('token_refresh'), **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['token'], response.cookies[settings.JWT_COOKIE_NAME].value)
+        self.assertEqual(Client().post(reverse('token_refresh')).status_code, 401)
+
+    def test_expired_token_rejected(self):
+        token = jwt.encode({'id': str(self.user.id), 'exp': int(time.time()) - 1}, settings.SECRET_KEY,
+                           algorithm='HS256')
+        token = token.decode() if isinstance(token, bytes) else token
+        data = self.client.get(reverse('fragment'), HTTP_AUTHORIZATION=f'Bearer {token}').json()
+        self.assertFalse(data['authenticated'])
+
+    def test_cached_user_copied_and_forgotten_on_save(self):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {self.user.token}'}
+        self.assertTrue(self.client.get(reverse('fragment'), **headers).json()['authenticated'])
+        cached = token_cache.get(self.user.token)
+        cached.username = 'changed'
+        self.assertEqual(token_cache.get(self.user.token).username, self.user.username)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(token_cache.get(self.user.token))
+        self.assertFalse(self.client.get(reverse('fragment'), **headers).json()['authenticated'])
+
+    def test_token_cache_timeout(self):
+        tokens = TokenCache(timeout=30)
+        tokens.set('token', self.user, time.time() + 3600)
+        with mock.patch('socialnet.authentication.time.time', return_value=time.time() + 31):
+            self.assertIsNone(tokens.get('token'))
+
+    def test_token_cache_evicts_expired_first(self):
+        tokens = TokenCache(max_size=2)
+        now = time.time()
+        tokens.set('fresh', 'fresh', now + 60)
+        tokens.set('expired', 'expired', now - 1)
+        tokens.set('new', 'new', now + 60)
+        self.assertEqual((tokens.get('fresh'), tokens.get('expired'), tokens.get('new')), ('fresh', None, 'new'))
+        tokens.set('newest', 'newest', now + 60)
+        self.assertIsNone(tokens.get('fresh'))
+
+
+class ReplicaRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    @override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+    def test_reads_rotate_until_write(self):
+        self.assertEqual(self.router.db_for_read(Article), 'default')
+        with routing_state():
+            reads = {self.router.db_for_read(Article) for _ in range(4)}
+            self.assertEqual(reads, {'replica_1', 'replica_2'})
+            with use_primary():
+                self.assertEqual(self.router.db_for_read(Article), 'default')
+            self.assertEqual(self.router.db_for_write(Article), 'default')
+            self.assertEqual(self.router.db_for_read(Article), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'], REPLICA_STRATEGY='least_loaded')
+    def test_least_loaded(self):
+        query_load._in_flight['replica_1'] = 2
+        self.addCleanup(query_load._in_flight.pop, 'replica_1')
+        with routing_state():
+            self.assertEqual({self.router.db_for_read(Article) for _ in range(4)}, {'replica_2'})
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class PrimaryAfterWriteMiddlewareTest(SimpleTestCase):
+    """
+    Чтение после записи: запрос с записью ставит cookie primary_until, и пока она не истекла,
+    запросы юзера читают из основной базы
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def handle(self, request, write=False) -> tuple:
+        """
+        :return: tuple - (базы чтения до и после записи, ответ)
+        """
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Article))
+            if write:
+                self.router.db_for_write(Article)
+            reads.append(self.router.db_for_read(Article))
+            return HttpResponse()
+
+        response = PrimaryAfterWriteMiddleware(view)(request)
+        return reads, response
+
+    def test_read_after_write_cookie(self):
+        reads, response = self.handle(self.factory.get('/'))
+        self.assertEqual(reads, ['replica_1', 'replica_1'])
+        self.assertNotIn('primary_until', response.cookies)
+
+        reads, response = self.handle(self.factory.get('/'), write=True)
+        self.assertEqual(reads, ['replica_1', 'default'])
+        cookie = response.cookies['primary_until']
+        self.assertGreater(float(cookie.value), time.time())
+        self.assertEqual(cookie['max-age'], settings.REPLICA_STICKY_SECONDS)
+
+        request = self.factory.get('/')
+        request.COOKIES['primary_until'] = cookie.value
+        self.assertEqual(self.handle(request)[0], ['default', 'default'])
+
+    def test_pinned_requests(self):
+        self.assertEqual(self.handle(self.factory.post('/'))[0], ['default', 'default'])
+        for value in (str(time.time() - 1), 'garbage'):
+            request = self.factory.get('/')
+            request.COOKIES['primary_until'] = value
+            with self.subTest(cookie=value):
+                self.assertEqual(self.handle(request)[0], ['replica_1', 'replica_1'])
+
+
+@skipUnless('replica' in settings.DATABASES, 'нужна реплика (DB_ENGINE=sqlite, DB_READ_FROM_REPLICAS=1)')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingRequestsTest(TransactionTestCase):
+    """
+    Реплика - второе соединение к той же тестовой базе, поэтому данные коммитятся (без обёртки TestCase)
+    Без реплики класс пропускается, поэтому базы не перечисляются явно
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        self.articles = create_articles(3)
+        # Создание статей сменило поколение: без очистки кэша запросы читали бы из основной базы
+        cache.clear()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+
+    def test_read_after_write_sticks_to_primary(self):
+        with CaptureQueriesContext(connections['replica']) as replica, \
+                CaptureQueriesContext(connections['default']) as primary:
+            self.client.get(reverse('index'))
+        self.assertTrue(replica.captured_queries)
+        self.assertFalse(primary.captured_queries)
+
+        self.client.force_login(self.articles[0].author)
+        article = self.articles[1]
+        response = self.client.get(reverse('detail', args=[article.slug]), {'favourite': '1', 'like': 'on'})
+        self.assertIn('primary_until', response.cookies)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(reverse('favourites'))
+        self.assertFalse(replica.captured_queries)
+        self.assertEqual([item.id for item in response.context['articles']], [article.id])
+
+    def test_cache_refill_after_bump_reads_primary(self):
+        bump_generation()
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('index'))
+            # Полностраничный кэш анонимов
+            del self.client.cookies[settings.SESSION_COOKIE_NAME]
+            self.client.get(reverse('detail', args=[self.articles[0].slug]))
+        self.assertFalse(replica.captured_queries)
+
+        # Реплики догнали основную базу
+        cache.delete(BUMPED_KEY)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('detail', args=[self.articles[1].slug]))
+        self.assertTrue(replica.captured_queries)
+
+    def test_benchmark_counts_replica_queries(self):
+        output = io.StringIO()
+        with mock.patch('socialnet.views.view_counter'):
+            call_command('run_benchmarks', requests=2, warmup=0, only=['detail'], cold=True,
+                         stdout=output, stderr=io.StringIO())
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['environment']['replicas'], ['replica'])
+        self.assertEqual(report['results']['detail']['queries_max'], 1)
+
+
+class MetricsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(3)
+
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+
+    def test_server_timing_and_histograms(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        self.client.get(reverse('detail', args=[self.articles[0].slug]))
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('socialnet_request_duration_seconds_count{view="index"} 1', metrics)
+        self.assertIn('socialnet_db_queries_sum{view="detail"} 1', metrics)
+        self.assertIn('socialnet_template_render_seconds_bucket{view="detail",le="+Inf"} 1', metrics)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('index'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class SeedAndBenchmarkTest(TestCase):
+
+    def test_seed_aggregates_match_rows(self):
+        call_command('seed_fake_data', users=10, articles=30, ratings=100, favourites=40, stdout=io.StringIO())
+        self.assertEqual((User.objects.count(), Article.objects.count()), (10, 30))
+        self.assertEqual(Rating.objects.count(), 100)
+        articles = Article.objects.annotate(marks=Sum('article_fk__mark'), votes=Count('article_fk'))
+        for article in articles:
+            self.assertEqual((article.rating_sum, article.rating_count), (article.marks or 0, article.votes))
+        self.assertEqual(Article.objects.aggregate(total=Sum('favourites_count'))['total'], 40)
+
+    def test_benchmark_report(self):
+        call_command('seed_fake_data', users=3, articles=5, ratings=5, favourites=5, stdout=io.StringIO())
+        output = io.StringIO()
+        call_command('run_benchmarks', requests=3, warmup=0, only=['index', 'detail'], cold=True,
+                     stdout=output, stderr=io.StringIO())
+        results = json.loads(output.getvalue())['results']
+        self.assertEqual(set(results), {'index', 'detail'})
+        self.assertEqual(results['detail']['status'], [200])
+        self.assertEqual(results['detail']['queries_max'], 1)
+
+    def test_benchmark_all_routes(self):
+        call_command('seed_fake_data', users=3, articles=5, ratings=5, favourites=5, stdout=io.StringIO())
+        output = io.StringIO()
+        call_command('run_benchmarks', requests=1, warmup=0, stdout=output, stderr=io.StringIO())
+        results = json.loads(output.getvalue())['results']
+        self.assertTrue({'index', 'detail', 'author', 'feed', 'author_feed', 'suggest'} <= set(results))
+        self.assertEqual(results['feed']['status'], [200])
+        self.assertEqual(results['author_feed']['status'], [200])
+
+
+class ArticleExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(5)
+        cls.staff = User.objects.create(username='staff', email='staff@example.com', is_staff=True)
+
+    def test_ndjson_since(self):
+        self.client.force_login(self.staff)
+        since = self.articles[2].date
+        expected = Article.objects.filter(date__gt=since).order_by('date', 'id').select_related('author')
+        response = self.client.get(reverse('export'), {'since': since.isoformat()})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['slug'] for row in rows], [article.slug for article in expected])
+        self.assertEqual([row['author'] for row in rows], [article.author.username for article in expected])
+
+    def test_invalid_since(self):
+        self.client.force_login(self.staff)
+        for since in ('вчера', '2024-02-30T00:00:00'):
+            self.assertEqual(self.client.get(reverse('export'), {'since': since}).status_code, 400)
+
+    async def test_async_stream_under_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        response = await self.async_client.get(reverse('export'), {'format': 'csv'})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(len(rows), 6)
+
+    def test_csv_command(self):
+        output = io.StringIO()
+        call_command('export_articles', format='csv', stdout=output)
+        rows = list(csv.reader(io.StringIO(output.getvalue())))
+        self.assertEqual(rows[0][:2], ['id', 'slug'])
+        self.assertEqual(len(rows), 6)
+
+    def test_export_requires_staff(self):
+        self.client.force_login(self.articles[0].author)
+        self.assertEqual(self.client.get(reverse('export')).status_code, 403)
+
+
+@override_settings(ROOT_URLCONF=build_urlconf(async_views=True))
+class ImportArticlesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.existing = create_articles(1, prefix='taken')[0]
+        cls.author = User.objects.create(username='importer', email='importer@example.com')
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, content) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        return path
+
+    def run_import(self, path, **options) -> tuple:
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_articles', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_reserved_slugs_rejected(self):
+        for slug, valid in (('metrics', False), ('authors', False), ('login', False), ('feed', True),
+                            ('token', True), ('metrics-1', True)):
+            form = ArticleForm(data={'slug': slug, 'header': 'Статья', 'summary': 'Кратко', 'description': 'Текст'})
+            self.assertEqual(form.is_valid(), valid, slug)
+        path = self.write('articles.csv', 'slug,header,summary,description,author\n'
+                                          'trending,Популярное,Кратко,Текст,importer\n')
+        out, err = self.run_import(path)
+        self.assertIn('отклонено 1', out)
+        self.assertFalse(Article.objects.filter(slug='trending').exists())
+
+    def test_csv_skip_conflicts(self):
+        path = self.write('articles.csv', 'slug,header,summary,description,author\n'
+                                          'first,Первая,Кратко,Текст первой,importer@example.com\n'
+                                          'taken-0,Занятая,Кратко,Текст,importer\n'
+                                          'first,Дубль,Кратко,Текст,importer\n'
+                                          'second,,Кратко,Текст,importer\n'
+                                          'third,Третья,Кратко,Текст,nobody@example.com\n'
+                                          'fourth,Четвёртая,Кратко,Текст четвёртой,importer\n')
+        out, err = self.run_import(path, batch_size=3)
+        self.assertEqual(out.count('Контрольная точка'), 2)
+        self.assertIn('создано 2, обновлено 0, пропущено 2, отклонено 2', out)
+        self.assertEqual([line.split(':')[0] for line in err.splitlines()],
+                         ['Строка 3', 'Строка 4', 'Строка 5', 'Строка 6'])
+        self.assertIn('slug taken-0 уже занят', err)
+        self.assertEqual(Article.objects.get(id=self.existing.id).header, 'Статья 0')
+        self.assertEqual(Article.objects.get(slug='fourth').description, 'Текст четвёртой')
+        self.assertEqual(AuthorStats.objects.get(author=self.author).articles_count, 2)
+
+    def test_jsonl_resume_with_default_author(self):
+        rows = [json.dumps({'slug': f'line-{i}', 'header': f'Строка {i}', 'summary': 'Кратко',
+                            'description': 'Текст'}) for i in range(4)]
+        path = self.write('articles.jsonl', '\n'.join(rows[:2] + ['{broken'] + rows[2:]) + '\n')
+        out, err = self.run_import(path, skip=1, author='importer@example.com')
+        self.assertIn('создано 3, обновлено 0, пропущено 0, отклонено 1', out)
+        self.assertIn('Строка 3: некорректная строка', err)
+        self.assertEqual(sorted(Article.objects.filter(author=self.author).values_list('slug', flat=True)),
+                         ['line-1', 'line-2', 'line-3'])
+
+    def test_update_and_suffix(self):
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+        url = reverse('detail', args=['taken-0'])
+        etag = self.client.get(url)['ETag']
+        path = self.write('articles.jsonl', json.dumps({'slug': 'taken-0', 'header': 'Обновлена', 'summary': 'Ново',
+                                                        'description': 'Новый текст', 'author': 'importer'}))
+        out, _ = self.run_import(path, on_conflict='update')
+        self.assertIn('создано 0, обновлено 1', out)
+        article = Article.objects.get(id=self.existing.id)
+        self.assertEqual((article.header, article.author_id, article.description, article.version),
+                         ('Обновлена', self.author.id, 'Новый текст', self.existing.version + 1))
+        self.assertGreater(article.updated, self.existing.updated)
+        # Клиент с прежним ETag получает новую статью, а не 304
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Обновлена')
+        self.assertFalse(AuthorStats.objects.filter(author=self.existing.author).exists())
+
+        Article.objects.create(slug='taken-0-2', header='Занято', author=self.author, summary='Кратко')
+        out, _ = self.run_import(path, on_conflict='suffix')
+        self.assertIn('создано 1', out)
+        self.assertTrue(Article.objects.filter(slug='taken-0-3', header='Обновлена').exists())
+
+    def test_suffix_slugs_respects_max_length(self):
+        from .management.commands.import_articles import Command
+
+        base = 'a' * 50
+        Article.objects.create(slug=base, header='Длинная', author=self.author, summary='Кратко')
+        articles = [Article(slug=base), Article(slug=base), Article(slug='taken-0')]
+        resolved = Command.suffix_slugs(articles, taken={base})
+        self.assertEqual([article.slug for article in resolved], ['a' * 48 + '-2', 'a' * 48 + '-3', 'taken-0-2'])
+
+
+class AsyncReadViewsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(3)
+
+    def setUp(self):
+        cache.clear()
+        session_key = set_session_favourites(self.client, [self.articles[1]])
+        self.async_client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+
+    async def test_index_and_detail(self):
+        response = await self.async_client.get(reverse('index'), {'rating_order': 'desc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['articles']), 3)
+        article = self.articles[0]
+        response = await self.async_client.get(reverse('detail', kwargs={'slug': article.slug}))
+        self.assertContains(response, article.header)
+        self.assertEqual(response.article_id, article.id)
+
+    async def test_anonymous_favourites(self):
+        response = await self.async_client.get(reverse('favourites'))
+        self.assertEqual([article.id for article in response.context['articles']], [self.articles[1].id])
+
+
+@override_settings(TRENDING_HALF_LIFE=3600, TRENDING_VIEW_WEIGHT=1, TRENDING_VOTE_WEIGHT=10, TRENDING_MIN_WEIGHT=1)
+class TrendingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(4)
+
+    def setUp(self):
+        cache.clear()
+        # Просмотры, оставшиеся в буфере от других тестов
+        view_counter.flush()
+        ArticleActivity.objects.all().delete()
+        self.now = timezone.now()
+
+    def add_activity(self, article, hours_ago, views=0, vote_points=0):
+        ArticleActivity.objects.create(article=article, views=views, vote_points=vote_points,
+                                       created=self.now - timedelta(hours=hours_ago))
+
+    def test_incremental_refresh(self):
+        # Вес через 10 часов затухает до 100 / 2^10 < 1 - строка удаляется
+        self.add_activity(self.articles[0], 10, views=100)
+        self.add_activity(self.articles[1], 0, views=20)
+        self.add_activity(self.articles[2], 1, vote_points=2)
+        self.assertEqual(trending.refresh(batch_size=2, now=self.now), 3)
+        self.assertFalse(ArticleActivity.objects.exists())
+        top = [row['id'] for row in trending.get_top(10)]
+        self.assertEqual(top, [self.articles[1].id, self.articles[2].id])
+
+        self.add_activity(self.articles[2], 0, views=50)
+        self.assertEqual(trending.refresh(now=self.now), 1)
+        top = [row['id'] for row in trending.get_top(10)]
+        self.assertEqual(top, [self.articles[2].id, self.articles[1].id])
+
+    def test_views_and_votes_are_recorded(self):
+        view_counter.incr(self.articles[0].id, 3)
+        view_counter.flush()
+        rate_article(self.articles[1].author, self.articles[1].id, Rating.RatingChoices.EXCELLENT)
+        rate_article(self.articles[2].author, self.articles[2].id, Rating.RatingChoices.LOW)
+        activity = ArticleActivity.objects.values_list('article_id', 'views', 'vote_points')
+        self.assertEqual(sorted(activity), [(self.articles[0].id, 3, 0), (self.articles[1].id, 0, 2)])
+
+    def test_index_and_endpoint(self):
+        self.add_activity(self.articles[3], 0, views=5)
+        self.add_activity(self.articles[1], 0, views=50)
+        trending.refresh(now=self.now)
+        response = self.client.get(reverse('index'), {'date_order': 'header', 'rating_order': trending.ORDER,
+                                                    'filter_by_slug': ''})
+        self.assertEqual([article.id for article in response.context['articles']],
+                         [self.articles[1].id, self.articles[3].id])
+        response = self.client.get(reverse('trending'), {'limit': 1})
+        self.assertEqual([row['slug'] for row in response.json()['articles']], [self.articles[1].slug])
+        self.assertEqual(self.client.get(reverse('trending'), {'limit': 'x'}).status_code, 400)
+
+
+    def test_cached_listing_follows_refresh(self):
+        # Мимо полностраничного кэша анонимов: проверяется кэш выдачи
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+        params = {'date_order': 'header', 'rating_order': trending.ORDER, 'filter_by_slug': ''}
+        self.add_activity(self.articles[0], 0, views=50)
+        trending.refresh(now=self.now)
+        response = self.client.get(reverse('index'), params)
+        self.assertEqual([article.id for article in response.context['articles']], [self.articles[0].id])
+        generation = get_generation()
+
+        self.add_activity(self.articles[2], 0, views=500)
+        trending.refresh(now=self.now)
+        self.assertEqual(get_generation(), generation)
+        response = self.client.get(reverse('index'), params)
+        self.assertEqual([article.id for article in response.context['articles']],
+                         [self.articles[2].id, self.articles[0].id])
+
+@override_settings(SIMILAR_ARTICLES_COUNT=2, SIMILAR_ARTICLES_MIN_COMMON=1)
+class SimilarArticlesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(5)
+        cls.users = [article.author for article in cls.articles]
+        first, second, third, fourth, _ = cls.articles
+        for user, liked in zip(cls.users, ([first, second, third], [first, second], [second, third], [fourth])):
+            merge_favourites(user, [article.id for article in liked])
+
+    def setUp(self):
+        cache.clear()
+
+    def neighbours(self):
+        return {row.article_id: [neighbour['id'] for neighbour in row.neighbours]
+                for row in SimilarArticles.objects.all()}
+
+    def test_refresh_and_detail(self):
+        first, second, third, _, _ = self.articles
+        self.assertEqual(similar.refresh(), 4)
+        self.assertFalse(StaleSimilarArticles.objects.exists())
+        # Сходство first-second и second-third - 2 / sqrt(2 * 3), first-third - 1 / 2
+        self.assertEqual(self.neighbours(), {first.id: [second.id, third.id], second.id: [first.id, third.id],
+                                             third.id: [second.id, first.id]})
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('detail', args=[first.slug]))
+        self.assertEqual([row['id'] for row in response.context['similar_articles']], [second.id, third.id])
+        self.assertContains(response, f'<li><a href="{reverse("detail", args=[third.slug])}">{third.header}</a></li>')
+
+    def test_incremental_refresh(self):
+        first, second, third, fourth, fifth = self.articles
+        similar.refresh(full=True)
+        self.client.force_login(self.users[1])
+        self.client.get(reverse('detail', args=[second.slug]), {'favourite': '1'})
+        self.client.force_login(self.users[4])
+        self.client.get(reverse('detail', args=[fifth.slug]), {'favourite': '1', 'like': 'on'})
+        self.assertEqual(set(StaleSimilarArticles.objects.values_list('article_id', flat=True)),
+                         {first.id, second.id, fifth.id})
+        # fourth не связана с изменениями и не пересчитывается
+        self.assertEqual(similar.refresh(), 4)
+        scores = {row['id']: row['score'] for row in SimilarArticles.objects.get(article=first).neighbours}
+        self.assertEqual(scores, {second.id: 0.5, third.id: 0.5})
+
+    @skipUnless(similar.sparse, 'SciPy не установлен')
+    def test_numpy_matches_python(self):
+        generator = random.Random(1)
+        pairs = list({(generator.randrange(50), generator.randrange(200)) for _ in range(2000)})
+        counts = Counter(article_id for _, article_id in pairs)
+        articles = list(range(0, 200, 3))
+        self.assertEqual(similar.similar_numpy(pairs, articles, counts, 5, 2),
+                         similar.similar_python(pairs, articles, counts, 5, 2))
+
+
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(3)
+
+    def setUp(self):
+        cache.clear()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+
+    def test_detail_not_modified(self):
+        article = self.articles[0]
+        url = reverse('detail', args=[article.slug])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        rate_article(self.articles[1].author, article.id, Rating.RatingChoices.EXCELLENT)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        last_modified = response['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_list_etag_follows_filtered_set(self):
+        params = {'date_order': 'date', 'rating_order': 'header', 'filter_by_slug': 'article-1'}
+        etag = self.client.get(reverse('index'), params)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('index'), params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Оценка статьи вне выдачи не меняет её ETag
+        with self.captureOnCommitCallbacks(execute=True):
+            rate_article(self.articles[0].author, self.articles[2].id, Rating.RatingChoices.LOW)
+        self.assertEqual(self.client.get(reverse('index'), params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            rate_article(self.articles[0].author, self.articles[1].id, Rating.RatingChoices.LOW)
+        self.assertEqual(self.client.get(reverse('index'), params, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ArticleBodyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='writer', email='writer@example.com')
+        cls.text = ' '.join(f'абзац {i} о производительности баз данных' for i in range(300))
+        cls.article = Article.objects.create(slug='long', header='Длинная', author=cls.author, summary='Кратко',
+                                             description=cls.text)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_compressed_round_trip(self):
+        body = ArticleBody.objects.get(article=self.article)
+        self.assertEqual(body.codec, 'zlib')
+        self.assertLess(len(body.data), len(self.text.encode()) // 4)
+        self.assertEqual(Article.objects.get(id=self.article.id).description, self.text)
+
+    def test_detail_renders_body(self):
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'anonymous'
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('detail', args=['long']))
+        self.assertContains(response, 'абзац 299 о производительности')
+
+    def test_list_skips_body(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        self.assertFalse([query for query in queries if ArticleBody._meta.db_table in query['sql']])
+
+    def test_edit_replaces_body(self):
+        article = Article.objects.get(id=self.article.id)
+        article.description = 'Новый текст'
+        article.save()
+        self.assertEqual(Article.objects.select_related('body').get(id=article.id).description, 'Новый текст')
+        self.assertEqual(ArticleBody.objects.get(article=article).codec, 'plain')
+
+    def test_move_article_bodies(self):
+        legacy = create_articles(3, prefix='legacy')
+        ArticleBody.objects.filter(article__in=legacy).delete()
+        Article.objects.filter(id__in=[article.id for article in legacy]).update(legacy_description='Старый текст')
+        call_command('move_article_bodies', batch_size=2, stdout=io.StringIO())
+        self.assertFalse(Article.objects.exclude(legacy_description='').exists())
+        self.assertEqual({Article.objects.get(id=article.id).description for article in legacy}, {'Старый текст'})
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'нужен полнотекстовый индекс')
+    def test_search_body(self):
+        found = get_search_backend().search(Article.objects.all(), 'производительности')
+        self.assertEqual(list(found.values_list('slug', flat=True)), ['long'])
+
+
+# Быстрый хэшер: тесты считают вызовы хэширования, а не его стоимость
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginThrottleTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='guard', email='guard@example.com',
+                                       password=hashers.make_password('password'))
+
+    def setUp(self):
+        cache.clear()
+        self.clear_throttles()
+        self.addCleanup(self.clear_throttles)
+
+    @staticmethod
+    def clear_throttles():
+        ip_throttle.clear()
+        account_throttle.clear()
+
+    def login(self, password='password'):
+        return self.client.post(reverse('login'), {'username': self.user.email, 'password': password})
+
+    def test_login_hashes_once(self):
+        with mock.patch('django.contrib.auth.hashers.check_password', wraps=hashers.check_password) as check:
+            response = self.login()
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertEqual(check.call_count, 1)
+
+    def test_account_burst_rejected_before_hashing(self):
+        burst = account_throttle.burst
+        with mock.patch('django.contrib.auth.hashers.check_password', wraps=hashers.check_password) as check:
+            statuses = [self.login('wrong').status_code for _ in range(burst + 2)]
+        self.assertEqual(statuses, [200] * burst + [429] * 2)
+        self.assertEqual(check.call_count, burst)
+        self.assertGreater(int(self.login().headers['Retry-After']), 0)
+
+    def test_wrong_passwords_do_not_lock_out_owner(self):
+        burst = account_throttle.burst
+        attacker = {'REMOTE_ADDR': '127.0.0.1', 'HTTP_X_FORWARDED_FOR': '203.0.113.5'}
+        statuses = [self.client.post(reverse('login'), {'username': self.user.email, 'password': 'wrong'},
+                                     **attacker).status_code for _ in range(burst + 1)]
+        self.assertEqual(statuses[-1], 429)
+        response = self.client.post(reverse('login'), {'username': self.user.email, 'password': 'password'},
+                                    REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='198.51.100.7')
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+
+    @override_settings(TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_client_ip_behind_proxy(self):
+        factory = RequestFactory()
+        cases = (
+            # Прокси дописывает адрес клиента справа, левые адреса подставлены клиентом
+            ({'REMOTE_ADDR': '10.0.0.2', 'HTTP_X_FORWARDED_FOR': '1.1.1.1, 203.0.113.5'}, '203.0.113.5'),
+            ({'REMOTE_ADDR': '10.0.0.2', 'HTTP_X_FORWARDED_FOR': '203.0.113.5, 10.0.0.3'}, '203.0.113.5'),
+            ({'REMOTE_ADDR': '10.0.0.2'}, '10.0.0.2'),
+            # От недоверенного адреса заголовок не учитывается
+            ({'REMOTE_ADDR': '198.51.100.7', 'HTTP_X_FORWARDED_FOR': '1.1.1.1'}, '198.51.100.7'),
+        )
+        for meta, expected in cases:
+            self.assertEqual(client_ip(factory.get('/', **meta)), expected)
+
+    def test_token_bucket_refill(self):
+        now = [0.0]
+        bucket = TokenBucket(2, 0.5, clock=lambda: now[0])
+        self.assertEqual([bucket.consume('a'), bucket.consume('a'), bucket.consume('a')], [0, 0, 2.0])
+        self.assertEqual(bucket.consume('b'), 0)
+        now[0] = 2.0
+        self.assertEqual(bucket.consume('a'), 0)
+
+    def test_signup_duplicate_email(self):
+        data = {'username': 'newbie', 'email': self.user.email,
+                'password1': 'Sl0w-hashing', 'password2': 'Sl0w-hashing'}
+        response = self.client.post(reverse('signup'), data)
+        self.assertContains(response, 'Пользователь с таким email уже существует!')
+        response = self.client.post(reverse('signup'), {**data, 'email': 'newbie@example.com'})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertTrue(User.objects.get(email='newbie@example.com').check_password('Sl0w-hashing'))
+
+    @override_settings(ROOT_URLCONF=build_urlconf(async_views=True))
+    async def test_async_login(self):
+        response = await self.async_client.post(reverse('login'), {'username': self.user.email, 'password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.post(reverse('login'),
+                                                {'username': self.user.email, 'password': 'password'})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertIn(settings.JWT_COOKIE_NAME, response.cookies)
+
+    @override_settings(ROOT_URLCONF=build_urlconf(async_views=True))
+    async def test_async_login_uses_cleaned_credentials_and_signals(self):
+        failed = []
+
+        def on_failed(sender, credentials, **kwargs):
+            failed.append(credentials)
+
+        user_login_failed.connect(on_failed)
+        self.addCleanup(user_login_failed.disconnect, on_failed)
+        response = await self.async_client.post(reverse('login'), {'username': self.user.email, 'password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(failed, [{'username': self.user.email, 'password': '********************'}])
+        # Поле формы обрезает пробелы - вход по очищенному значению
+        response = await self.async_client.post(reverse('login'),
+                                                {'username': f'  {self.user.email} ', 'password': 'password'})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        # Пустой пароль отклоняет форма, без обращения к бэкендам
+        response = await self.async_client.post(reverse('login'), {'username': self.user.email, 'password': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(failed), 1)
+
+
+class AuthorStatsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Просмотры, оставшиеся в буфере от других тестов, попали бы в статьи с теми же id
+        view_counter.flush()
+        cls.authors = User.objects.bulk_create(User(username=f'auth{i}', email=f'author{i}@example.com')
+                                               for i in range(2))
+        cls.readers = User.objects.bulk_create(User(username=f'read{i}', email=f'reader{i}@example.com')
+                                               for i in range(3))
+        cls.articles = [Article.objects.create(slug=f'by-{i}', header=f'Статья {i}', author=cls.authors[i % 2],
+                                               summary='Кратко', description='Подробно') for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+
+    def snapshot(self) -> dict:
+        return {stats.author_id: (stats.articles_count, stats.reviews, stats.rating_sum, stats.rating_count,
+                                  stats.favourites_count) for stats in AuthorStats.objects.all()}
+
+    def test_incremental_counters_match_reconcile(self):
+        first, second, third = self.articles
+        rate_article(self.readers[0], first.id, Rating.RatingChoices.EXCELLENT)
+        rate_article(self.readers[1], first.id, Rating.RatingChoices.LOW)
+        rate_article(self.readers[1], first.id, Rating.RatingChoices.EXCELLENT)
+        rate_article(self.readers[0], second.id, Rating.RatingChoices.LOW)
+        merge_favourites(self.readers[2], [first.id, second.id, third.id])
+        for article in (first, first, third):
+            view_counter.incr(article.id)
+        view_counter.flush()
+        expected = {self.authors[0].id: (2, 3, 2, 2, 2), self.authors[1].id: (1, 0, -1, 1, 1)}
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(AuthorStats.objects.get(author=self.authors[0]).rating, 1.0)
+
+        third.delete()
+        expected[self.authors[0].id] = (1, 2, 2, 2, 1)
+        self.assertEqual(self.snapshot(), expected)
+        author_stats.reconcile(batch_size=2)
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_reconcile_fixes_drift(self):
+        bulk = create_articles(2, prefix='bulk')
+        AuthorStats.objects.filter(author=self.authors[0]).update(reviews=999, articles_count=0)
+        call_command('reconcile_author_stats', batch_size=3, stdout=io.StringIO())
+        stats = self.snapshot()
+        self.assertEqual(stats[self.authors[0].id], (2, 0, 0, 0, 0))
+        self.assertEqual(stats[bulk[0].author_id], (1, 0, 0, 0, 0))
+        self.assertEqual(len(stats), 4)
+
+    def test_top_authors_and_profile(self):
+        AuthorStats.objects.filter(author=self.authors[1]).update(reviews=50)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('authors'), {'order': 'reviews'})
+        self.assertEqual([stats.author_id for stats in response.context['authors']],
+                         [self.authors[1].id, self.authors[0].id])
+        self.assertEqual(self.client.get(reverse('authors'), {'order': 'name'}).status_code, 400)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('author', args=[self.authors[1].id]))
+        self.assertContains(response, '50 просмотров')
+        response = self.client.get(reverse('author', args=[self.readers[0].id]))
+        self.assertContains(response, 'Статей: 0')
+
+
+class SuggestTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(4)
+        Article.objects.filter(id=cls.articles[1].id).update(header='Ёжик в тумане', reviews=5)
+        Article.objects.filter(id=cls.articles[2].id).update(reviews=10)
+
+    def setUp(self):
+        suggest_index.build(batch_size=2)
+
+    def suggest(self, query, **params) -> list:
+        response = self.client.get(reverse('suggest'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [article['slug'] for article in response.json()['articles']]
+
+    def test_prefix_ranked_by_reviews(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest_index.suggest('стат', 10)[0]['header'], 'Статья 2')
+        self.assertEqual(self.suggest('СТАТЬЯ'), ['article-2', 'article-0', 'article-3'])
+        self.assertEqual(self.suggest('article', limit=2), ['article-2', 'article-1'])
+        self.assertEqual(self.suggest('ежик  в'), ['article-1'])
+        self.assertEqual(self.suggest('a'), [])
+        self.assertEqual(self.suggest('туман'), [])
+
+    def test_reset_after_fork(self):
+        index = SuggestIndex()
+        index.build()
+        index._build_lock.acquire()
+        # Так индекс выглядит в дочернем процессе, если родитель строил его в момент fork
+        index._reset()
+        self.assertFalse(index.built)
+        self.assertFalse(index._build_lock.locked())
+        self.assertEqual(index.suggest('стат', 10)[0]['header'], 'Статья 2')
+
+    def test_script_only_on_list(self):
+        self.assertContains(self.client.get(reverse('index')), 'id="suggestions"')
+        with mock.patch('socialnet.views.view_counter'):
+            response = self.client.get(reverse('detail', args=[self.articles[0].slug]))
+        self.assertNotContains(response, 'id="suggestions"')
+        self.assertNotContains(response, 'id_filter_by_slug')
+
+    # Запоминаем лучшие статьи для всех префиксов, чтобы проверить их сброс и поправку
+    @mock.patch.object(suggest_index, 'top_threshold', 0)
+    def test_signals_and_flush_update_index(self):
+        self.assertEqual(self.suggest('article'), ['article-2', 'article-1', 'article-0', 'article-3'])
+        with self.captureOnCommitCallbacks(execute=True):
+            article = Article.objects.create(slug='new-article', header='Новая статья',
+                                             author=self.articles[0].author, summary='Кратко')
+        self.assertEqual(self.suggest('нова'), ['new-article'])
+        with self.captureOnCommitCallbacks(execute=True):
+            article.header = 'Переименована'
+            article.save()
+        self.assertEqual(self.suggest('нова'), [])
+        self.assertEqual(self.suggest('пере'), ['new-article'])
+
+        view_counter.flush()
+        view_counter.incr(self.articles[0].id, 20)
+        view_counter.flush()
+        self.assertEqual(self.suggest('article')[0], 'article-0')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.articles[0].delete()
+        self.assertEqual(self.suggest('article')[0], 'article-2')
+        self.assertEqual(len(suggest_index), 4)
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_suggest', queries=10, stdout=out)
+        self.assertIn('на 100 тыс. статей', out.getvalue())
+
+
+class FeedTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.articles = create_articles(3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feed_is_served_from_cache_with_etag(self):
+        url = reverse('feed', args=['rss'])
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertContains(response, 'http://localhost:8000' + reverse('detail', args=['article-2']))
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+            self.assertEqual(cached.content, response.content)
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(self.client.get(reverse('feed', args=['json'])).status_code, 404)
+
+    def test_feeds_are_rebuilt_only_when_affected(self):
+        author = self.articles[0].author
+        global_url, author_url = reverse('feed', args=['atom']), reverse('author_feed', args=[author.id, 'atom'])
+        etags = {url: self.client.get(url)['ETag'] for url in (global_url, author_url)}
+        self.assertNotContains(self.client.get(author_url), 'Статья 1')
+
+        # Статья другого автора, которой нет в ленте автора, его ленту не меняет
+        with self.captureOnCommitCallbacks(execute=True):
+            article = Article.objects.get(id=self.articles[1].id)
+            article.header = 'Новый заголовок'
+            article.save()
+        self.assertEqual(self.client.get(author_url)['ETag'], etags[author_url])
+        response = self.client.get(global_url)
+        self.assertNotEqual(response['ETag'], etags[global_url])
+        self.assertContains(response, 'Новый заголовок')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Article.objects.create(slug='fresh', header='Свежая статья', author=author, summary='Кратко')
+        with self.assertNumQueries(0):
+            response = self.client.get(author_url, HTTP_IF_NONE_MATCH=etags[author_url])
+        self.assertContains(response, 'Свежая статья')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Article.objects.filter(slug='fresh').delete()
+        self.assertEqual(self.client.get(author_url)['ETag'], etags[author_url])
+        self.assertEqual(self.client.get(reverse('author_feed', args=[uuid4(), 'rss'])).status_code, 404)
+
+    def test_last_modified_follows_content(self):
+        url = reverse('feed', args=['rss'])
+        last_modified = self.client.get(url)['Last-Modified']
+        # Пересборка без изменений не меняет Last-Modified
+        feeds.build_feed()
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        # Удаление самой свежей статьи меняет ленту: по If-Modified-Since отдаётся новая лента
+        later = timezone.now() + timedelta(minutes=1)
+        with mock.patch('socialnet.feeds.timezone.now', return_value=later), \
+                self.captureOnCommitCallbacks(execute=True):
+            Article.objects.filter(id=self.articles[2].id).delete()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Статья 2')
+        self.assertEqual(response['Last-Modified'], http_date(later.timestamp()))
@@ -0,0 +1,133 @@
+"""
+Ограничение частоты попыток входа и регистрации
+
+Token bucket в памяти процесса: у каждого ключа (IP, аккаунт) до burst жетонов,
+которые восстанавливаются со скоростью rate в секунду, каждая попытка тратит жетон
+Проверка идёт до хэширования пароля, поэтому отклонённая попытка почти ничего не стоит
+Лимиты свои в каждом процессе: при N воркерах общий лимит на ключ - до N * burst
+За обратным прокси IP клиента берётся из X-Forwarded-For (см. client_ip), иначе все клиенты делили бы одну корзину
+Корзина аккаунта - по паре (аккаунт, IP): подбор пароля с одного адреса ограничен,
+а чужие неверные пароли не блокируют вход владельцу аккаунта с его адреса
+"""
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse
+
+
+class TokenBucket:
+    """
+    Корзины жетонов по ключам: ключ -> (жетоны, момент последнего пополнения)
+    Хранится не больше max_size ключей, давно не использованные вытесняются
+    (вытесненный ключ получает полную корзину - как новый)
+    """
+
+    def __init__(self, burst, rate, max_size=10000, clock=time.monotonic):
+        self.burst = burst
+        self.rate = rate
+        self.max_size = max_size
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key) -> float:
+        """
+        Тратим жетон ключа
+        :param key: str
+        :return: float - 0, если попытка разрешена, иначе через сколько секунд появится жетон
+        """
+        with self._lock:
+            now = self.clock()
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+            return 0.0 if allowed else (1 - tokens) / self.rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def make_bucket(setting, default) -> TokenBucket:
+    """
+    :param setting: str - имя настройки вида (burst, период в секундах)
+    :param default: tuple - значение по умолчанию
+    """
+    burst, period = getattr(settings, setting, default)
+    return TokenBucket(burst, burst / period, getattr(settings, 'LOGIN_THROTTLE_SIZE', 10000))
+
+
+ip_throttle = make_bucket('LOGIN_THROTTLE_IP', (20, 60))
+account_throttle = make_bucket('LOGIN_THROTTLE_ACCOUNT', (5, 60))
+
+
+@lru_cache(maxsize=None)
+def trusted_networks(proxies) -> tuple:
+    """
+    :param proxies: tuple - адреса и подсети доверенных прокси (TRUSTED_PROXIES)
+    :return: tuple - ip_network
+    """
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def is_trusted_proxy(address) -> bool:
+    try:
+        ip = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_networks(tuple(getattr(settings, 'TRUSTED_PROXIES', ()))))
+
+
+def client_ip(request) -> str:
+    """
+    IP клиента: если запрос пришёл от доверенного прокси, то самый правый адрес X-Forwarded-For,
+    который не принадлежит доверенным прокси (левые адреса клиент может подставить сам)
+    :param request:
+    :return: str
+    """
+    remote = request.META.get('REMOTE_ADDR', '')
+    if not is_trusted_proxy(remote):
+        return remote
+    hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else remote
+
+
+def check_attempt(request, account=None) -> float:
+    """
+    Тратим жетоны попытки входа/регистрации: по IP и (для входа) по аккаунту с этого IP
+    :param request:
+    :param account: str - email, под которым пытаются войти
+    :return: float - 0, если попытка разрешена, иначе секунды до следующей разрешённой попытки
+    """
+    ip = client_ip(request)
+    wait = ip_throttle.consume(ip)
+    if account:
+        wait = max(wait, account_throttle.consume(f'{account.strip().lower()}|{ip}'))
+    return wait
+
+
+def too_many_attempts(wait) -> HttpResponse:
+    """
+    :param wait: float - секунды до следующей разрешённой попытки
+    :return: HttpResponse - 429 с заголовком Retry-After
+    """
+    response = HttpResponse('Слишком много попыток, попробуйте позже', status=429)
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response
@@ -0,0 +1,169 @@
+"""
+Рейтинг «популярное сейчас»
+
+Активность по статьям (прирост просмотров при сбросе счётчика и новые оценки) копится в ArticleActivity,
+refresh() разбирает её пачками и обновляет только затронутые строки TrendingScore
+Вес активности w, случившейся в момент t, учитывается как w * 2^((t - EPOCH) / период полураспада),
+а хранится натуральный логарифм суммы таких весов: порядок статей тот же, что при затухании
+старой активности, но старые строки не нужно пересчитывать, а числа не переполняются
+Строки, вклад которых затух ниже TRENDING_MIN_WEIGHT, удаляются, поэтому таблица остаётся маленькой
+"""
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone as django_timezone
+
+from .listing_cache import TRENDING_ORDER, bump_trending_generation
+from .models import Article, ArticleActivity, TrendingScore
+
+EPOCH = datetime(2022, 1, 1, tzinfo=timezone.utc)
+ORDER = TRENDING_ORDER
+TOP_CACHE_KEY = 'trending:top'
+
+
+def get_cache():
+    return caches[getattr(settings, 'TRENDING_CACHE', 'default')]
+
+
+def decay_exponent(moment) -> float:
+    """
+    Натуральный логарифм множителя времени для активности в момент moment
+    :param moment: datetime
+    :return: float
+    """
+    half_life = getattr(settings, 'TRENDING_HALF_LIFE', 6 * 3600)
+    return (moment - EPOCH).total_seconds() / half_life * math.log(2)
+
+
+def log_add(a, b) -> float:
+    """
+    log(e^a + e^b) без переполнения
+    """
+    if a == -math.inf:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def activity_weight(views, vote_points) -> float:
+    return (views * getattr(settings, 'TRENDING_VIEW_WEIGHT', 1)
+            + vote_points * getattr(settings, 'TRENDING_VOTE_WEIGHT', 10))
+
+
+def record_views(counts, batch_size=1000):
+    """
+    Прирост просмотров пачками INSERT (вызывается при сбросе счётчика просмотров)
+    Статьи, удалённые до сброса, пропускаем
+    :param counts: dict - {id статьи: прирост просмотров}
+    :param batch_size: int - кол-во статей за раз
+    """
+    article_ids = list(counts)
+    for start in range(0, len(article_ids), batch_size):
+        existing = Article.objects.filter(id__in=article_ids[start:start + batch_size]).values_list('id', flat=True)
+        ArticleActivity.objects.bulk_create(ArticleActivity(article_id=article_id, views=counts[article_id])
+                                            for article_id in existing)
+
+
+def record_vote(article_id, mark):
+    """
+    :param article_id: int - id статьи
+    :param mark: int - новая оценка
+    """
+    if mark + 1 > 0:
+        ArticleActivity.objects.create(article_id=article_id, vote_points=mark + 1)
+
+
+def with_trending(queryset):
+    """
+    Статьи из рейтинга «популярное сейчас» с его оценкой (поле trending_score для сортировки и курсора)
+    :param queryset: QuerySet
+    :return: QuerySet
+    """
+    return queryset.filter(trending__isnull=False).annotate(trending_score=F('trending__score'))
+
+
+def refresh(batch_size=5000, now=None) -> int:
+    """
+    Разбираем накопленную активность и обновляем затронутые строки рейтинга
+    Каждая пачка - отдельная транзакция: строки активности удаляются вместе с обновлением рейтинга
+    Рассчитано на один запуск за раз (по крону)
+    :param batch_size: int - кол-во строк активности за раз
+    :param now: datetime - текущий момент (для удаления затухших строк)
+    :return: int - кол-во разобранных строк активности
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            rows = list(ArticleActivity.objects.order_by('id')
+                        .values_list('id', 'article_id', 'views', 'vote_points', 'created')[:batch_size])
+            if not rows:
+                break
+            gains = {}
+            for _, article_id, views, vote_points, created in rows:
+                weight = activity_weight(views, vote_points)
+                if weight > 0:
+                    term = math.log(weight) + decay_exponent(created)
+                    gains[article_id] = log_add(gains.get(article_id, -math.inf), term)
+            scores = TrendingScore.objects.select_for_update().in_bulk(gains)
+            stamp = django_timezone.now()
+            for article_id, row in scores.items():
+                row.score = log_add(row.score, gains[article_id])
+                row.updated = stamp
+            TrendingScore.objects.bulk_update(scores.values(), ['score', 'updated'], batch_size=batch_size)
+            TrendingScore.objects.bulk_create((TrendingScore(article_id=article_id, score=gain)
+                                               for article_id, gain in gains.items() if article_id not in scores),
+                                              ignore_conflicts=True)
+            ArticleActivity.objects.filter(id__lte=rows[-1][0]).delete()
+        processed += len(rows)
+    prune(now)
+    cache_top()
+    # Закэшированные страницы выдачи «популярные сейчас» построены по прежнему рейтингу
+    bump_trending_generation()
+    return processed
+
+
+def prune(now=None) -> int:
+    """
+    Удаляем строки, текущий вес которых затух ниже TRENDING_MIN_WEIGHT
+    :return: int - кол-во удалённых строк
+    """
+    threshold = decay_exponent(now or django_timezone.now()) + math.log(getattr(settings, 'TRENDING_MIN_WEIGHT', 1))
+    deleted, _ = TrendingScore.objects.filter(score__lt=threshold).delete()
+    return deleted
+
+
+def load_top(limit) -> list:
+    """
+    :param limit: int - кол-во статей
+    :return: list - dict по статьям в порядке убывания популярности
+    """
+    rows = (TrendingScore.objects.order_by('-score')
+            .values_list('article_id', 'score', 'article__slug', 'article__header', 'article__author__username')
+            [:limit])
+    return [{'id': article_id, 'score': round(score, 4), 'slug': slug, 'header': header, 'author': author}
+            for article_id, score, slug, header, author in rows]
+
+
+def cache_top():
+    """
+    Сохраняем в кэш первые TRENDING_TOP_SIZE статей рейтинга (после каждого обновления)
+    """
+    top = load_top(getattr(settings, 'TRENDING_TOP_SIZE', 100))
+    get_cache().set(TOP_CACHE_KEY, top, getattr(settings, 'TRENDING_CACHE_TIMEOUT', 600))
+    return top
+
+
+def get_top(limit) -> list:
+    """
+    Первые limit статей рейтинга из кэша (при промахе - из TrendingScore)
+    :param limit: int - не больше TRENDING_TOP_SIZE
+    :return: list
+    """
+    top = get_cache().get(TOP_CACHE_KEY)
+    if top is None:
+        top = cache_top()
+    return top[:limit]
@@ -1,14 +1,40 @@
+from django.conf import settings
 from django.urls import path
 from .views import *
 
 
-urlpatterns = [
-    path('login/', UserLoginView.as_view(), name='login'),
-    path('signup/', RegisterView.as_view(), name='signup'),
-    path('logout/', UserLogoutView.as_view(), name='logout'),
-    path('', ArticleView.as_view(), name='index'),
-    path('favourites/', FavouriteView.as_view(), name='favourites'),
-    path('preferences/', SettingsView.as_view(), name='preferences'),
-    path('add/', CreateArticleView.as_view(), name='add'),
-    path('<slug:slug>/', DetailArticle.as_view(), name='detail'),
-]
+def get_urlpatterns(async_views=False):
+    """
+    Маршруты приложения
+    :param async_views: bool - обслуживать чтение статей и вход асинхронными view (под ASGI)
+    :return: list
+    """
+    if async_views:
+        article_view, favourite_view, detail_view = AsyncArticleView, AsyncFavouriteView, AsyncDetailArticle
+        login_view = AsyncUserLoginView
+    else:
+        article_view, favourite_view, detail_view = ArticleView, FavouriteView, DetailArticle
+        login_view = UserLoginView
+    return [
+        path('login/', login_view.as_view(), name='login'),
+        path('signup/', RegisterView.as_view(), name='signup'),
+        path('logout/', UserLogoutView.as_view(), name='logout'),
+        path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+        path('', article_view.as_view(), name='index'),
+        path('favourites/', favourite_view.as_view(), name='favourites'),
+        path('preferences/', SettingsView.as_view(), name='preferences'),
+        path('add/', CreateArticleView.as_view(), name='add'),
+        path('fragment/', UserFragmentView.as_view(), name='fragment'),
+        path('export/', ArticleExportView.as_view(), name='export'),
+        path('trending/', TrendingView.as_view(), name='trending'),
+        path('suggest/', SuggestView.as_view(), name='suggest'),
+        path('authors/', TopAuthorsView.as_view(), name='authors'),
+        path('authors/<uuid:author_id>/', AuthorView.as_view(), name='author'),
+        path('authors/<uuid:author_id>/feed/<str:file_format>/', FeedView.as_view(), name='author_feed'),
+        path('feed/<str:file_format>/', FeedView.as_view(), name='feed'),
+        path('metrics/', MetricsView.as_view(), name='metrics'),
+        path('<slug:slug>/', detail_view.as_view(), name='detail'),
+    ]
+
+
+urlpatterns = get_urlpatterns(getattr(settings, 'ASYNC_READ_VIEWS', False))
@@ -1,60 +1,188 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.views import LoginView, LogoutView
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.contrib.auth import login, authenticate
-from django.db.models import F, Q
-from django.http import HttpResponseRedirect
-from django.shortcuts import reverse, redirect
-from django.views.generic import CreateView, ListView
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth import login
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import InvalidPage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
+from django.shortcuts import reverse, redirect, render, get_object_or_404
+from django.utils import timezone
+from django.utils.cache import add_never_cache_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views.decorators.debug import sensitive_post_parameters
+from django.views.generic import CreateView, ListView, View
 from django.views.generic.edit import FormView, FormMixin
 from .forms import RegisterForm, LoginForm, ArticleForm, SettingForm, OrderAndFilterForm, FavouriteForm, RateForm
-from .models import Article, Favourites
+from .authentication import aauthenticate, get_cookie_name, get_request_token, set_token_cookie, token_cache
+from .conditional import has_conditions, make_etag, not_modified, set_validators, timestamp
+from .counters import view_counter
+from .export import FORMATS, aiterate, export_rows
+from .favourites import get_favourites
+from .metrics import registry
+from .models import Article, AuthorStats, User
+from .passwords import PasswordPoolBusy
+from .listing_cache import COUNT_GENERATION_KEY, ListingCache, get_generation, primary_after_bump
+from .middleware import AnonymousPageCacheMiddleware
+from .pagination import CachedPaginator, CursorPaginator, InvalidCursor, apage, can_estimate, keyset_ordering
+from .ratings import rate_article
+from .search import get_search_backend
+from .similar import get_neighbours
+from .suggest import suggest_index
+from .throttle import check_attempt, too_many_attempts
+from . import author_stats, feeds, trending
 
 
 class RegisterView(CreateView):
     """
     Обработка регистрации юзера
+    Попытки сверх лимита по IP (socialnet.throttle) отклоняются до хэширования пароля
     """
     form_class = RegisterForm
     template_name = 'signup.html'
     success_url = 'index'
 
+    def post(self, request, *args, **kwargs):
+        wait = check_attempt(request)
+        if wait:
+            return too_many_attempts(wait)
+        try:
+            return super(RegisterView, self).post(request, *args, **kwargs)
+        except PasswordPoolBusy:
+            return too_many_attempts(1)
+
     def form_valid(self, form):
         """
-        После отправки (валидации) формы логиним юзера
+        После отправки (валидации) формы сохраняем и логиним юзера
+        Занятый email обнаруживается по ограничению уникальности при вставке
         :param form:
-        :return:
+        :return: HttpResponseRedirect
         """
-        user = form.save()
+        try:
+            with transaction.atomic():
+                user = form.save()
+        except IntegrityError:
+            if not User.objects.filter(email=form.cleaned_data['email']).exists():
+                raise
+            form.add_error('email', form.duplicate_email_message)
+            return self.form_invalid(form)
+        self.object = user
         login(self.request, user)
-        return super(RegisterView, self).form_valid(form)
+        return redirect(self.success_url)
 
 
 class UserLoginView(LoginView):
     """
     Обработка входа юзера
+    Попытки сверх лимита по IP и по аккаунту (socialnet.throttle) отклоняются с 429 до хэширования пароля,
+    пароль хэшируется один раз - при валидации формы (PooledModelBackend)
     """
     template_name = 'login.html'
     authentication_form = LoginForm
     success_url = 'index'
 
+    def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        wait = check_attempt(request, form.data.get('username'))
+        if wait:
+            return too_many_attempts(wait)
+        try:
+            return self.submit(form)
+        except PasswordPoolBusy:
+            return too_many_attempts(1)
+
+    def submit(self, form):
+        return self.form_valid(form) if form.is_valid() else self.form_invalid(form)
+
     def form_valid(self, form):
         """
-        После отправки (валидации) формы ищём юзера в БД и затем логиним его
+        После отправки (валидации) формы логиним юзера, найденного формой
         :param form:
         :return: HttpResponseRedirect
         """
-        cd = form.cleaned_data
-        user = authenticate(self.request, email=cd['username'], password=cd['password'])
+        user = form.get_user()
         login(self.request, user)
-        return redirect('index')
+        response = redirect('index')
+        set_token_cookie(response, user.token)
+        return response
+
+
+class AsyncUserLoginView(UserLoginView):
+    """
+    Асинхронная версия UserLoginView (под ASGI): хэш пароля ждём, не занимая поток
+    Декораторы dispatch у LoginView синхронные, поэтому CSRF проверяет CsrfViewMiddleware,
+    а заголовки no-cache ставятся здесь
+    """
+
+    @method_decorator(sensitive_post_parameters())
+    def dispatch(self, request, *args, **kwargs):
+        return View.dispatch(self, request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        response = await sync_to_async(super(AsyncUserLoginView, self).get)(request, *args, **kwargs)
+        add_never_cache_headers(response)
+        return response
+
+    async def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        wait = check_attempt(request, form.data.get('username'))
+        if wait:
+            return too_many_attempts(wait)
+        # Незаполненные или некорректные поля отклонит сама форма, не проверяя пароль
+        credentials = form.clean_credentials()
+        if credentials is not None:
+            username, password = credentials
+            try:
+                form.set_user(await aauthenticate(request, username=username, password=password))
+            except PasswordPoolBusy:
+                return too_many_attempts(1)
+        response = await sync_to_async(self.submit)(form)
+        add_never_cache_headers(response)
+        return response
+
+    async def put(self, request, *args, **kwargs):
+        return await self.post(request, *args, **kwargs)
 
 
 class UserLogoutView(LogoutView):
     """
     Обработка выхода юзера редиректом на страницу входа
+    Удаляем и JWT из cookie
     """
     next_page = 'login'
 
+    def dispatch(self, request, *args, **kwargs):
+        token, _ = get_request_token(request)
+        if token:
+            token_cache.discard(token)
+        response = super(UserLogoutView, self).dispatch(request, *args, **kwargs)
+        response.delete_cookie(get_cookie_name(), samesite='strict')
+        return response
+
+
+class TokenRefreshView(View):
+    """
+    Выдача нового JWT залогиненному юзеру (по действующему токену или сессии)
+    Токен возвращается в JSON и обновляется в cookie
+    """
+
+    def post(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: JsonResponse
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({'detail': 'Требуется вход'}, status=401)
+        token = request.user.token
+        response = JsonResponse({'token': token})
+        set_token_cookie(response, token)
+        add_never_cache_headers(response)
+        return response
+
 
 class ArticleView(ListView):
     """
@@ -63,122 +191,300 @@ class ArticleView(ListView):
     model = Article
     template_name = 'index.html'
     context_object_name = 'articles'
-    # Добавляем в контекст форму для фильтрации и сортировки
-    extra_context = {'form': OrderAndFilterForm()}
+    default_ordering = ('header', )
+    # Выдача одинакова для всех юзеров, поэтому страницы можно кэшировать
+    cache_listing = True
+
+    @property
+    def conditional_get(self) -> bool:
+        """
+        ETag ставится общим выдачам, кроме «популярных сейчас»: рейтинг меняется без изменения статей
+        """
+        return self.cache_listing and self.request.GET.get('rating_order') != trending.ORDER
+
+    def get(self, request, *args, **kwargs):
+        """
+        Условный GET: при совпадении ETag отвечаем 304 без выборки статей и рендеринга
+        :param request:
+        :return: HttpResponse
+        """
+        # Выдача, прочитанная здесь, ложится в ListingCache
+        with primary_after_bump():
+            if not self.conditional_get:
+                return super(ArticleView, self).get(request, *args, **kwargs)
+            listing_cache = ListingCache(request.GET, self.get_paginate_by(None))
+            latest = listing_cache.get_latest_change()
+            if latest is None:
+                queryset, aggregates = self.get_latest_change_aggregates(listing_cache)
+                latest = self.store_latest_change(listing_cache, queryset.aggregate(**aggregates))
+            etag = self.get_etag(latest)
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+            return set_validators(super(ArticleView, self).get(request, *args, **kwargs), etag)
+
+    def get_latest_change_aggregates(self, listing_cache) -> tuple:
+        """
+        Запрос времени последнего изменения статей выдачи
+        Если кол-ва статей для пагинатора ещё нет в кэше и оценка планировщика не подходит,
+        считаем его тем же запросом
+        :param listing_cache: ListingCache
+        :return: tuple - (QuerySet, dict агрегатов)
+        """
+        queryset = self.get_queryset()
+        aggregates = {'latest': Max('updated')}
+        if not self.cursor_pagination and listing_cache.get_count() is None and not can_estimate(queryset):
+            aggregates['total'] = Count('id')
+        return queryset, aggregates
+
+    @staticmethod
+    def store_latest_change(listing_cache, result) -> int:
+        """
+        :param listing_cache: ListingCache
+        :param result: dict - результат get_latest_change_aggregates
+        :return: float - время последнего изменения (0 - статей нет)
+        """
+        if 'total' in result:
+            listing_cache.set_count(result['total'])
+        # Для ETag нужна полная точность: Last-Modified (секунды) выдаче не ставится
+        latest = result['latest'].timestamp() if result['latest'] is not None else 0
+        listing_cache.set_latest_change(latest)
+        return latest
+
+    def get_etag(self, latest) -> str:
+        """
+        ETag выдачи: время последнего изменения её статей, поколение кол-ва статей (удаление статьи
+        не меняет время изменения остальных), адрес и cookies, от которых зависит вёрстка
+        Last-Modified выдаче не ставим - по нему удаление статьи не заметить
+        :param latest: float - время последнего изменения статей выдачи
+        :return: str
+        """
+        cookies = [self.request.COOKIES.get(name, '') for name in AnonymousPageCacheMiddleware.VARY_COOKIES]
+        return make_etag(latest, get_generation(COUNT_GENERATION_KEY), self.request.get_full_path(), cookies)
 
     def get_queryset(self):
         """
         Обработка выдачи статей
         Если в GET-запросе переданы с формы данные для фильрации/сортировки, тогда фильтруем/сортируем
         Иначе, возвращаем все записи из БД
+        В режиме полнотекстового поиска статьи сначала сортируются по релевантности
+        В режиме «популярные сейчас» выдаются только статьи из рейтинга trending
         :return: QuerySet
         """
-        queryset = Article.objects.all()
-        if {'date_order', 'rating_order', 'filter_by_slug'} != self.request.GET.keys():
-            return queryset
-        else:
-            filter_by = self.request.GET.get('filter_by_slug')
-            order_by_date = self.request.GET.get('date_order')
-            order_by_rating = self.request.GET.get('rating_order')
-            queryset = Article.objects.filter(Q(slug__icontains=filter_by)).order_by(order_by_rating,order_by_date)
+        queryset = Article.objects.for_list()
+        form = OrderAndFilterForm(self.request.GET)
+        if not form.is_valid():
             return queryset
+        cd = form.cleaned_data
+        ordering = (cd['rating_order'], cd['date_order'])
+        filter_by = cd['filter_by_slug']
+        if cd['rating_order'] == trending.ORDER:
+            queryset = trending.with_trending(queryset)
+        if filter_by and cd['search_mode'] == 'fulltext':
+            return get_search_backend().search(queryset, filter_by).order_by('-search_rank', *ordering)
+        if filter_by:
+            queryset = queryset.filter(Q(slug__icontains=filter_by))
+        return queryset.order_by(*ordering)
 
     def get_paginate_by(self, queryset) -> int:
         """
         Получаем от cookies кол-во записей на одной странице,
         если ещё не установлены, то возвращаем значение по умолчанию - 10
+        Значение ограничиваем пределами из SettingForm
         :param queryset:
         :return: int - кол-во записей на одной странице
         """
-        return self.request.COOKIES.get('paginate_by', 10)
+        field = SettingForm.base_fields['paginate_by']
+        try:
+            paginate_by = int(self.request.COOKIES.get('paginate_by', field.initial))
+        except ValueError:
+            paginate_by = field.initial
+        return min(max(paginate_by, field.min_value), field.max_value)
+
+    @property
+    def cursor_pagination(self) -> bool:
+        """
+        Курсорная пагинация включается юзером в настройках (хранится в cookies)
+        """
+        return self.request.COOKIES.get('pagination') == 'cursor'
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """
+        Для общих списков берём кол-во статей и id статей страницы из кэша,
+        а для большой таблицы без фильтров - оценку кол-ва статей
+        :return: Paginator
+        """
+        if not self.cache_listing:
+            return super(ArticleView, self).get_paginator(queryset, per_page, orphans, allow_empty_first_page, **kwargs)
+        return CachedPaginator(queryset, per_page, ListingCache(self.request.GET, per_page), orphans=orphans,
+                               allow_empty_first_page=allow_empty_first_page, **kwargs)
+
+    def get_stable_ordering(self, queryset):
+        """
+        Сортировку дополняем уникальным id, чтобы порядок был стабильным
+        :param queryset:
+        :return: QuerySet
+        """
+        return queryset.order_by(*keyset_ordering(queryset.query.order_by or self.default_ordering))
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Сортировку дополняем уникальным id, чтобы порядок был стабильным
+        В режиме курсорной пагинации страница выбирается по курсору, без OFFSET и COUNT(*)
+        :param queryset:
+        :param page_size: int - кол-во записей на одной странице
+        :return: tuple - (paginator, page, object_list, is_paginated)
+        """
+        queryset = self.get_stable_ordering(queryset)
+        if not self.cursor_pagination:
+            return super(ArticleView, self).paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Некорректный курсор страницы')
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        """
+        Для ссылок пагинации сохраняем текущие параметры фильтрации и сортировки
+        :param kwargs:
+        :return: dict - контекст шаблона
+        """
+        # Форма фильтрации и сортировки создаётся на каждый запрос, а не разделяется между потоками
+        kwargs.setdefault('form', OrderAndFilterForm())
+        context = super(ArticleView, self).get_context_data(**kwargs)
+        query_params = self.request.GET.copy()
+        for param in ('page', 'cursor'):
+            query_params.pop(param, None)
+        context['query_params'] = query_params.urlencode()
+        context['cursor_pagination'] = self.cursor_pagination
+        return context
 
 
 class DetailArticle(FormMixin, ArticleView):
     """
     Обработка просмотра детальной информации по статье
     Добавлем форму для оценки, наследуясь от FormMixin
+    Всё состояние запроса хранится в экземпляре view (свой на каждый запрос),
+    поэтому view безопасна для многопоточных WSGI и ASGI воркеров
+    Показ статьи - один SELECT: просмотр копится в буфере счётчика,
+    похожие статьи и сжатый текст присоединяются по первичным ключам SimilarArticles и ArticleBody,
+    а отметка «в избранном» подгружается с фрагмента 'fragment'
     """
     form_class = FavouriteForm
-    extra_context = {'rate_form': RateForm(),
-                     'button_rate': 'Оценить'}
-    checked = False
+    cache_listing = False
+    extra_context = {'button_rate': 'Оценить',
+                     'show_description': True}
+    article = None
 
     def get_queryset(self):
-        """
-        Инкрементим кол-во просмотров к текущей статье
-        :return: QuerySet
-        """
-        article = Article.objects.filter(slug=self.kwargs['slug'])
-        DetailArticle.queryset = article
-        article.update(reviews=F("reviews") + 1)
-        return article
+        return Article.objects.select_related('author', 'similar', 'body').filter(slug=self.kwargs['slug'])
+
+    def get_paginate_by(self, queryset):
+        # Страница из одной статьи: без пагинации и COUNT(*)
+        return None
 
     def get(self, request, *args, **kwargs):
         """
-        Обработка фиксации понравившихся статей
-        Понравившиеся статьи ложим в cookies с сохранением их id
-        Далее редиректим на главную страницу - 'index'
+        Обработка оценки статьи и фиксации понравившихся статей
+        Понравившиеся статьи сохраняем в избранное юзера (сессия или БД)
+        Далее редиректим на страницу избранного - 'favourites'
+        Без параметров формы просто показываем статью
         :param request:
         :param args:
         :param kwargs:
+        :return: HttpResponse
+        """
+        if 'rate' in request.GET:
+            return self.rate(request)
+        if 'favourite' in request.GET:
+            return self.toggle_favourite(request)
+        if has_conditions(request):
+            state = self.get_queryset().values_list('id', 'version', 'updated', 'similar__updated').first()
+            if state is None:
+                raise Http404('Статья не найдена')
+            response = not_modified(request, *self.get_validators(*state))
+            if response is not None:
+                view_counter.incr(state[0])
+                return response
+        self.article = get_object_or_404(self.get_queryset())
+        view_counter.incr(self.article.id)
+        return self.render_article()
+
+    @staticmethod
+    def get_validators(article_id, version, updated, similar_updated) -> tuple:
+        """
+        ETag и Last-Modified страницы статьи: версия статьи и время пересчёта похожих статей
+        :return: tuple - (ETag, время изменения в секундах)
+        """
+        return (make_etag(article_id, version, timestamp(similar_updated)),
+                max(timestamp(updated), timestamp(similar_updated) or 0))
+
+    def render_article(self):
+        """
+        Рендерим уже полученную статью
+        :return: TemplateResponse
+        """
+        self.object_list = [self.article]
+        response = self.render_to_response(self.get_context_data(similar_articles=get_neighbours(self.article)))
+        # По id статьи полностраничный кэш учитывает просмотры при отдаче из кэша
+        response.article_id = self.article.id
+        similar = getattr(self.article, 'similar', None)
+        return set_validators(response, *self.get_validators(self.article.id, self.article.version,
+                                                             self.article.updated, similar and similar.updated))
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault('rate_form', RateForm())
+        return super(DetailArticle, self).get_context_data(**kwargs)
+
+    def toggle_favourite(self, request):
+        """
+        Отмеченный checkbox добавляет статью в избранное, снятый - убирает
+        :param request:
         :return: HttpResponseRedirect
         """
-        
-        if 'like' not in request.GET and not DetailArticle.checked:
-            return super(DetailArticle, self).get(request, *args, **kwargs)
+        article_id = get_object_or_404(Article.objects.values_list('id', flat=True), slug=self.kwargs['slug'])
+        favourites = get_favourites(request)
+        if request.GET.get('like') == 'on':
+            favourites.add(article_id)
         else:
-            like = request.GET.get('like', '')
-            cookies = request.COOKIES.get('likes', '')
-            current_article = str(DetailArticle.queryset.values('id')[0]['id'])
-            response = HttpResponseRedirect(reverse('favourites'), 'Ваша оценка успешно отправлена!')
-            if like == 'on':
-                response.set_cookie(key='likes', value=cookies + current_article + ',',
-                                    secure=True, samesite='strict')
-            elif DetailArticle.checked:
-                """
-                Если залогиненный юзер хочет убрать из избранного статью, то ищем в БД эту статью и удаляем её
-                """
-                DetailArticle.checked = False
-                updated_cookies = cookies.replace(current_article + ',', '')
-                response.set_cookie(key='likes', value=updated_cookies, secure=True, samesite='strict')
-                if self.request.user.is_authenticated:
-                    Favourites.objects.filter(who=self.request.user, article_id=current_article).delete()
-            return response
+            favourites.remove(article_id)
+        return HttpResponseRedirect(reverse('favourites'), 'Ваша оценка успешно отправлена!')
 
-    def get_initial(self):
+    def rate(self, request):
         """
-        Устанавливаем checkbox выделенным,
-        чтобы юзер знал, что он уже оценивал текущую статью
-        :return: dict - данные формы
+        Фиксируем оценку статьи залогиненным юзером и возвращаем его на страницу статьи
+        :param request:
+        :return: HttpResponseRedirect
         """
-        initial = super(DetailArticle, self).get_initial()
-        current_article = str(DetailArticle.queryset.values('id')[0]['id'])
-        cookies = self.request.COOKIES.get('likes', '')
-        initial['like'] = True if current_article in cookies else False
-        DetailArticle.checked = initial['like']
-        return initial
+        form = RateForm(request.GET)
+        if request.user.is_authenticated and form.is_valid() and form.cleaned_data['rate'] != '':
+            article_id = get_object_or_404(Article.objects.values_list('id', flat=True), slug=self.kwargs['slug'])
+            rate_article(request.user, article_id, int(form.cleaned_data['rate']))
+        return HttpResponseRedirect(reverse('detail', args=[self.kwargs['slug']]))
 
 
 class FavouriteView(ArticleView):
     """
     Обработка получения понравившихся статей
     """
+    cache_listing = False
 
     def get_queryset(self):
         """
-        Получаем понравившиеся статьи путём фильрации объектов модели по id
-        извлечёнными из cookies, если юзер не авторизован
-        Если юзер залогинен, то добавляем из cookie товары в БД
+        Получаем понравившиеся статьи по id из избранного юзера
         :return: QuerySet
         """
-        favourites = self.request.COOKIES.get('likes', '').split(',')[:-1]
-        current_user = self.request.user
-        if current_user.is_authenticated:
-            is_user_favourites = Favourites.objects.filter(who=current_user, article_id__in=favourites).exists()
-            if len(favourites) != 0 and not is_user_favourites:
-                Favourites.objects.bulk_create(Favourites(who=current_user, article_id=id) for id in favourites)
-                return Article.objects.filter(favourites__who=current_user)
-        return Article.objects.filter(id__in=favourites)
+        return Article.objects.for_list().filter(id__in=get_favourites(self.request).ids)
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """
+        Кол-во статей в избранном известно из набора id, COUNT(*) не нужен
+        :return: Paginator
+        """
+        return CachedPaginator(queryset, per_page, count=len(get_favourites(self.request)), orphans=orphans,
+                               allow_empty_first_page=allow_empty_first_page, **kwargs)
 
 
 class CreateArticleView(LoginRequiredMixin, CreateView):
@@ -202,7 +508,8 @@ class CreateArticleView(LoginRequiredMixin, CreateView):
         article = form.save(commit=False)
         article.author = self.request.user
         article.save()
-        return super(CreateArticleView, self).form_valid(form)
+        self.object = article
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class SettingsView(FormView):
@@ -220,6 +527,7 @@ class SettingsView(FormView):
         """
         initial = super(SettingsView, self).get_initial()
         initial['paginate_by'] = self.request.COOKIES.get('paginate_by', 10)
+        initial['pagination'] = self.request.COOKIES.get('pagination', 'pages')
         return initial
 
     def form_valid(self, form):
@@ -232,4 +540,306 @@ class SettingsView(FormView):
         cd = form.cleaned_data
         response = HttpResponseRedirect(reverse('index'), 'Настройки успешно сохранены!')
         response.set_cookie(key='paginate_by', value=cd['paginate_by'], secure=True, samesite='strict')
+        response.set_cookie(key='pagination', value=cd['pagination'], secure=True, samesite='strict')
+        return response
+
+
+class UserFragmentView(View):
+    """
+    Персональная часть страниц, которые отдаются из общего кэша:
+    ссылки входа/выхода и отметка «в избранном» для статьи из параметра article
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: JsonResponse
+        """
+        user = request.user
+        if user.is_authenticated:
+            links = [{'url': reverse('logout'), 'title': 'Выйти'}]
+        else:
+            links = [{'url': reverse('login'), 'title': 'Войти'},
+                     {'url': reverse('signup'), 'title': 'Регистрация'}]
+        article = request.GET.get('article', '')
+        response = JsonResponse({'authenticated': user.is_authenticated,
+                                 'username': user.username if user.is_authenticated else '',
+                                 'links': links,
+                                 'liked': article.isdigit() and int(article) in get_favourites(request)})
+        add_never_cache_headers(response)
+        return response
+
+
+class ArticleExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Потоковая выгрузка статей для аналитики (только для персонала)
+    Параметры: format - ndjson или csv, since - выгрузить статьи, опубликованные после даты (ISO 8601)
+    """
+    login_url = 'login'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: StreamingHttpResponse
+        """
+        export_format = request.GET.get('format', 'ndjson')
+        if export_format not in FORMATS:
+            return HttpResponseBadRequest('Неизвестный формат выгрузки')
+        since = None
+        if request.GET.get('since'):
+            try:
+                # Корректная по формату, но несуществующая дата (30 февраля) - ValueError
+                since = parse_datetime(request.GET['since'])
+            except ValueError:
+                since = None
+            if since is None:
+                return HttpResponseBadRequest('Дата since должна быть в формате ISO 8601')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        serialize, content_type = FORMATS[export_format]
+        lines = serialize(export_rows(since))
+        if isinstance(request, ASGIRequest):
+            lines = aiterate(lines)
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="articles.{export_format}"'
+        return response
+
+
+class MetricsView(View):
+    """
+    Гистограммы MetricsMiddleware в текстовом формате Prometheus
+    Доступно только с адресов из METRICS_ALLOWED_IPS
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: HttpResponse
+        """
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise Http404('Метрики отключены')
+        if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', )):
+            return HttpResponseForbidden()
+        response = HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+        add_never_cache_headers(response)
         return response
+
+
+class TrendingView(View):
+    """
+    Первые статьи рейтинга «популярное сейчас» в JSON
+    Список берётся из кэша, который обновляет команда refresh_trending
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: JsonResponse
+        """
+        top_size = getattr(settings, 'TRENDING_TOP_SIZE', 100)
+        try:
+            limit = int(request.GET.get('limit', 10))
+        except ValueError:
+            return HttpResponseBadRequest('Некорректный limit')
+        articles = [dict(article, url=reverse('detail', kwargs={'slug': article['slug']}))
+                    for article in trending.get_top(min(max(limit, 1), top_size))]
+        return JsonResponse({'articles': articles})
+
+
+class SuggestView(View):
+    """
+    Подсказки для поля поиска статьи в JSON: статьи, slug или заголовок которых начинается с введённого текста
+    Ищутся в индексе в памяти процесса (socialnet.suggest), без запросов к БД
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: JsonResponse
+        """
+        max_limit = getattr(settings, 'SUGGEST_LIMIT', 10)
+        try:
+            limit = int(request.GET.get('limit', max_limit))
+        except ValueError:
+            return HttpResponseBadRequest('Некорректный limit')
+        articles = [dict(article, url=reverse('detail', kwargs={'slug': article['slug']}))
+                    for article in suggest_index.suggest(request.GET.get('q', ''), min(max(limit, 1), max_limit))]
+        return JsonResponse({'articles': articles})
+
+
+class FeedView(View):
+    """
+    Лента последних статей (общая или автора) в RSS/Atom
+    Документ ленты готов заранее (socialnet.feeds): ответ - одно чтение кэша, с If-None-Match - 304
+    """
+
+    def get(self, request, file_format, author_id=None):
+        """
+        :param request:
+        :param file_format: str - формат ленты (ключ feeds.FORMATS)
+        :param author_id: UUID - id автора (None - общая лента)
+        :return: HttpResponse
+        """
+        if file_format not in feeds.FORMATS:
+            raise Http404('Неизвестный формат ленты')
+        feed = feeds.get_feed(author_id)
+        if feed is None:
+            raise Http404('Автор не найден')
+        content, etag = feed['documents'][file_format]
+        last_modified = timestamp(feed['updated'])
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = HttpResponse(content, content_type=feeds.FORMATS[file_format].content_type)
+        return set_validators(response, etag, last_modified)
+
+
+class AuthorView(View):
+    """
+    Профиль автора: счётчики AuthorStats приходят тем же запросом, что и юзер (JOIN по первичному ключу)
+    """
+
+    def get(self, request, author_id):
+        """
+        :param request:
+        :param author_id: UUID - id автора
+        :return: HttpResponse
+        """
+        author = User.objects.select_related('stats').filter(id=author_id).first()
+        if author is None:
+            raise Http404('Автор не найден')
+        try:
+            stats = author.stats
+        except AuthorStats.DoesNotExist:
+            # Статей у автора ещё нет
+            stats = AuthorStats(author=author)
+        return render(request, 'author.html', {'author': author, 'stats': stats})
+
+
+class TopAuthorsView(View):
+    """
+    Лучшие авторы по выбранному счётчику (параметр order) - один запрос по индексу AuthorStats
+    """
+    ORDER_TITLES = {
+        'rating': 'По средней оценке',
+        'reviews': 'По просмотрам',
+        'favourites': 'По избранному',
+        'articles': 'По кол-ву статей',
+    }
+
+    def get(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: HttpResponse
+        """
+        order = request.GET.get('order', 'rating')
+        if order not in author_stats.TOP_ORDERS:
+            return HttpResponseBadRequest('Некорректный order')
+        authors = author_stats.top_authors(order, getattr(settings, 'AUTHOR_TOP_SIZE', 20))
+        return render(request, 'authors.html', {'authors': authors, 'order': order,
+                                                'orders': self.ORDER_TITLES.items()})
+
+
+class AsyncArticleListMixin:
+    """
+    Асинхронная обработка GET для списков статей под ASGI
+    COUNT(*) и выборка страницы идут через асинхронный ORM, шаблон рендерится по готовому списку
+    """
+    pagination = None
+
+    async def get(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: TemplateResponse
+        """
+        with primary_after_bump():
+            etag = None
+            if self.conditional_get:
+                listing_cache = ListingCache(request.GET, self.get_paginate_by(None))
+                latest = listing_cache.get_latest_change()
+                if latest is None:
+                    queryset, aggregates = self.get_latest_change_aggregates(listing_cache)
+                    latest = self.store_latest_change(listing_cache, await queryset.aaggregate(**aggregates))
+                etag = self.get_etag(latest)
+                response = not_modified(request, etag)
+                if response is not None:
+                    return response
+            self.object_list = await self.aget_queryset()
+            self.pagination = await self.apaginate_queryset(self.object_list, self.get_paginate_by(self.object_list))
+            response = self.render_to_response(self.get_context_data())
+            return set_validators(response, etag) if etag is not None else response
+
+    async def aget_queryset(self):
+        return self.get_queryset()
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """
+        Асинхронный аналог ArticleView.paginate_queryset
+        :return: tuple - (paginator, page, object_list, is_paginated)
+        """
+        queryset = self.get_stable_ordering(queryset)
+        try:
+            if self.cursor_pagination:
+                paginator = CursorPaginator(queryset, page_size)
+                page = await paginator.apage(self.request.GET.get('cursor'))
+            else:
+                paginator = self.get_paginator(queryset, page_size, allow_empty_first_page=self.get_allow_empty())
+                cached = isinstance(paginator, CachedPaginator)
+                paginator.__dict__['count'] = await (paginator.acount() if cached else queryset.acount())
+                number = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1
+                if number == 'last':
+                    number = paginator.num_pages
+                page = await (paginator.apage(number) if cached else apage(paginator, number))
+        except (InvalidCursor, InvalidPage):
+            raise Http404('Некорректная страница')
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def paginate_queryset(self, queryset, page_size):
+        # Страница уже получена асинхронно в get()
+        return self.pagination
+
+
+class AsyncArticleView(AsyncArticleListMixin, ArticleView):
+    """
+    Асинхронная версия ArticleView
+    """
+
+
+class AsyncFavouriteView(AsyncArticleListMixin, FavouriteView):
+    """
+    Асинхронная версия FavouriteView
+    """
+
+    async def aget_queryset(self):
+        # Избранное читается из сессии или кэша/БД синхронно
+        return await sync_to_async(self.get_queryset)()
+
+
+class AsyncDetailArticle(AsyncArticleListMixin, DetailArticle):
+    """
+    Асинхронная версия DetailArticle
+    Оценка и отметка избранного (редкие записи) обрабатываются синхронной версией
+    """
+
+    async def get(self, request, *args, **kwargs):
+        """
+        :param request:
+        :return: HttpResponse
+        """
+        if 'rate' in request.GET or 'favourite' in request.GET:
+            return await sync_to_async(super(AsyncArticleListMixin, self).get)(request, *args, **kwargs)
+        if has_conditions(request):
+            state = await self.get_queryset().values_list('id', 'version', 'updated', 'similar__updated').afirst()
+            if state is None:
+                raise Http404('Статья не найдена')
+            response = not_modified(request, *self.get_validators(*state))
+            if response is not None:
+                await view_counter.aincr(state[0])
+                return response
+        self.article = await self.get_queryset().afirst()
+        if self.article is None:
+            raise Http404('Статья не найдена')
+        await view_counter.aincr(self.article.id)
+        return self.render_article()